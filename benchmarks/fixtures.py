@@ -0,0 +1,89 @@
+"""Deterministic MPEG-TS fixtures generated with ffmpeg lavfi sources.
+
+Every fixture alternates test patterns with a scene cut in the middle of each
+audio silence, like the CM breaks tscutter looks for, so the expected cut
+positions are known. Generated files are kept in a folder and only made again
+when their spec changes.
+"""
+
+import hashlib, json, random, shutil, subprocess
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+TS_PACKET_SIZE = 188
+VIDEO_SOURCES = [ 'testsrc2', 'smptebars', 'rgbtestsrc', 'testsrc', 'pal100bars', 'yuvtestsrc' ]
+
+@dataclass
+class Fixture:
+    name: str
+    duration: float
+    cuts: list[float]
+    silenceLen: float = 1.2
+    width: int = 640
+    height: int = 360
+    audioTracks: int = 1
+    corruptPackets: int = 0
+    long: bool = False
+    seed: int = 0
+
+    def Silences(self) -> list[tuple[float, float]]:
+        return [ (cut - self.silenceLen / 2, cut + self.silenceLen / 2) for cut in self.cuts ]
+
+    def Digest(self) -> str:
+        return hashlib.sha1(json.dumps(asdict(self), sort_keys=True).encode()).hexdigest()[:12]
+
+FIXTURES = [
+    Fixture('cuts', duration=120, cuts=[ 30, 60, 90 ]),
+    Fixture('multitrack', duration=60, cuts=[ 15, 40 ], audioTracks=3),
+    Fixture('corrupted', duration=60, cuts=[ 20, 45 ], corruptPackets=200, seed=1),
+    Fixture('long', duration=1800, cuts=[ 90.0 * i for i in range(1, 20) ], width=320, height=180, long=True),
+]
+
+def _FilterGraph(fixture: Fixture) -> str:
+    bounds = [ 0.0 ] + list(fixture.cuts) + [ float(fixture.duration) ]
+    rate = '30000/1001'
+    graph = []
+    for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        graph.append(f'{VIDEO_SOURCES[i % len(VIDEO_SOURCES)]}=size={fixture.width}x{fixture.height}:rate={rate}:duration={end - start}[v{i}]')
+    scenes = len(bounds) - 1
+    graph.append(''.join(f'[v{i}]' for i in range(scenes)) + f'concat=n={scenes}:v=1:a=0,format=yuv420p[v]')
+    mute = '+'.join(f'between(t,{start},{end})' for start, end in fixture.Silences()) or '0'
+    for track in range(fixture.audioTracks):
+        graph.append(f"sine=frequency={440 * (track + 1)}:sample_rate=48000:duration={fixture.duration},volume=volume=0:enable='{mute}'[a{track}]")
+    return ';'.join(graph)
+
+def _Corrupt(path: Path, fixture: Fixture):
+    rng = random.Random(fixture.seed)
+    packets = path.stat().st_size // TS_PACKET_SIZE
+    with path.open('r+b') as f:
+        for index in sorted(rng.sample(range(packets // 20, packets - packets // 20), fixture.corruptPackets)):
+            f.seek(index * TS_PACKET_SIZE)
+            if rng.random() < 0.3:
+                # lost sync byte
+                f.write(b'\x00')
+            else:
+                f.seek(4, 1)
+                f.write(rng.randbytes(TS_PACKET_SIZE - 4))
+
+def GenerateFixture(fixture: Fixture, folder: Path, ffmpeg='ffmpeg') -> Path:
+    """Return the TS file of fixture in folder, generating it if needed."""
+    folder = Path(folder)
+    path = folder / f'{fixture.name}-{fixture.Digest()}.ts'
+    if path.is_file():
+        return path
+    folder.mkdir(parents=True, exist_ok=True)
+    tmpPath = path.with_suffix('.tmp')
+    args = [ ffmpeg, '-hide_banner', '-nostats', '-loglevel', 'error', '-y', '-filter_complex', _FilterGraph(fixture), '-map', '[v]' ]
+    for track in range(fixture.audioTracks):
+        args += [ '-map', f'[a{track}]' ]
+    args += [
+        '-c:v', 'mpeg2video', '-q:v', '4', '-g', '15', '-bf', '2',
+        '-c:a', 'mp2', '-b:a', '128k',
+        '-fflags', '+bitexact', '-flags', '+bitexact', '-threads', '1',
+        '-f', 'mpegts', str(tmpPath),
+    ]
+    subprocess.run(args, check=True)
+    if fixture.corruptPackets:
+        _Corrupt(tmpPath, fixture)
+    shutil.move(tmpPath, path)
+    return path
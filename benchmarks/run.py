@@ -0,0 +1,169 @@
+"""Time the analyze and split stages on the synthetic fixtures.
+
+    python -m benchmarks.run -o results.json
+    python -m benchmarks.run -o new.json --baseline results.json
+
+Each stage gets its wall time, throughput (MB/s and times real time) and
+the peak RSS of this process and of the ffmpeg children it waited for
+during the stage. With
+--baseline, stages that got slower than --tolerance times the baseline are
+listed and the exit code is 1.
+"""
+
+import argparse, json, os, platform, shutil, subprocess, sys, tempfile, threading, time
+from datetime import datetime, timezone
+from pathlib import Path
+from tscutter import __version__, stats
+from tscutter._progress import SilentProgress
+from tscutter.analyze import GeneratePtsMap, LookingForCutLocations, MergeIntervals, WritePtsMap
+from tscutter.audio import DetectSilence
+from tscutter.common import PtsMap
+from tscutter.ffmpeg import InputFile
+from .fixtures import FIXTURES, Fixture, GenerateFixture
+
+# a detected cut counts when it is this close to the expected one, in seconds
+CUT_TOLERANCE = 0.5
+
+def _CurrentRss() -> int | None:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class Stage:
+    """Time a block, sample the RSS of this process while it runs and collect the rusage of the ffmpeg children it waits for."""
+    def __init__(self, name: str, results: dict, size: int, duration: float) -> None:
+        self.name, self.results, self.size, self.duration = name, results, size, duration
+
+    def _Sample(self):
+        while not self.stopped.wait(0.02):
+            self.peakRss = max(self.peakRss, _CurrentRss() or 0)
+
+    def __enter__(self):
+        self.peakRss = _CurrentRss() or 0
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self._Sample, daemon=True)
+        self.sampler.start()
+        # ReapChild() records the children of this stage only, unlike RUSAGE_CHILDREN
+        self.previousStats = stats._collector
+        self.stats = stats.Stats()
+        stats.Install(self.stats)
+        self.startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, *excInfo):
+        seconds = time.perf_counter() - self.startTime
+        self.stopped.set()
+        self.sampler.join()
+        stats.Install(self.previousStats)
+        childrenRss = max((record['childMaxRssMiB'] for record in self.stats.stages.values() if record['children']), default=None)
+        self.results[self.name] = {
+            'seconds': round(seconds, 4),
+            'mbPerSecond': round(self.size / 1e6 / seconds, 2) if seconds > 0 else None,
+            'realtime': round(self.duration / seconds, 2) if seconds > 0 else None,
+            'peakRssMiB': round(self.peakRss / 2**20, 1) if self.peakRss else None,
+            'childrenMaxRssMiB': round(childrenRss, 1) if childrenRss else None,
+        }
+        return False
+
+def _MatchCuts(found: list[float], expected: list[float]) -> dict:
+    matched = [ cut for cut in expected if any(abs(pts - cut) <= CUT_TOLERANCE for pts in found) ]
+    return { 'expected': len(expected), 'found': len(found), 'matched': len(matched) }
+
+def RunFixture(fixture: Fixture, path: Path, workFolder: Path, jobs=1) -> dict:
+    size = path.stat().st_size
+    stages = {}
+    def Timed(name):
+        return Stage(name, stages, size, fixture.duration)
+    inputFile = InputFile(path)
+    progress = SilentProgress()
+    with Timed('DetectSilence'):
+        intervals = DetectSilence(inputFile=inputFile, jobs=jobs, progress=progress)
+    with Timed('LookingForCutLocations'):
+        cutLocations = LookingForCutLocations(inputFile=inputFile, intervals=MergeIntervals(intervals), splitPosShift=1, progress=progress, jobs=jobs)
+    with Timed('GeneratePtsMap'):
+        ptsMap = GeneratePtsMap(inputFile=inputFile, cutLocations=cutLocations)
+    indexPath = workFolder / f'{fixture.name}.ptsmap'
+    WritePtsMap(ptsMap, indexPath)
+    ptsMapObj = PtsMap(indexPath)
+    with Timed('SplitVideo'):
+        ptsMapObj.SplitVideo(videoPath=path, outputFolder=workFolder / fixture.name)
+    longest = max(ptsMapObj.Clips(), key=lambda clip: clip[1] - clip[0])
+    with open(os.devnull, 'wb') as devnull, Timed('ExtractClipPipe'):
+        ptsMapObj.ExtractClipPipe(path, longest, devnull)
+    with open(os.devnull, 'wb') as devnull, Timed('ExtractClipsPipe'):
+        ptsMapObj.ExtractClipsPipe(path, ptsMapObj.Clips(), devnull)
+    shutil.rmtree(workFolder / fixture.name, ignore_errors=True)
+    return {
+        'file': path.name,
+        'size': size,
+        'duration': fixture.duration,
+        'audioTracks': fixture.audioTracks,
+        'corruptPackets': fixture.corruptPackets,
+        'cuts': _MatchCuts(ptsMapObj.pts[1:-1].tolist(), fixture.cuts),
+        'stages': stages,
+    }
+
+def _FfmpegVersion() -> str | None:
+    try:
+        return subprocess.run([ 'ffmpeg', '-version' ], capture_output=True, text=True).stdout.split('\n')[0]
+    except OSError:
+        return None
+
+def CompareResults(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, fixture in results['fixtures'].items():
+        for stage, values in fixture['stages'].items():
+            try:
+                before = baseline['fixtures'][name]['stages'][stage]['seconds']
+            except KeyError:
+                continue
+            ratio = values['seconds'] / before if before > 0 else 1.0
+            # stdout may carry the results JSON
+            print(f'{name:12} {stage:24} {before:9.3f}s -> {values["seconds"]:9.3f}s  x{ratio:.2f}', file=sys.stderr)
+            if ratio > tolerance:
+                regressions.append(f'{name}/{stage}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tscutter stages on synthetic TS fixtures.')
+    parser.add_argument('--fixtures', '-f', type=Path, default=Path(tempfile.gettempdir()) / 'tscutter-benchmarks', help='folder for the generated fixtures')
+    parser.add_argument('--output', '-o', type=Path, help='JSON results path (default: stdout)')
+    parser.add_argument('--only', nargs='*', help='names of the fixtures to run')
+    parser.add_argument('--long', action='store_true', help='include the long fixtures')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='parallel cut position searches and silence detection decoders')
+    parser.add_argument('--baseline', type=Path, help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    fixtures = [ fixture for fixture in FIXTURES if (args.long or not fixture.long) and (not args.only or fixture.name in args.only) ]
+    results = {
+        'tscutter': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'ffmpeg': _FfmpegVersion(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'jobs': args.jobs,
+        'fixtures': {},
+    }
+    with tempfile.TemporaryDirectory() as workFolder:
+        for fixture in fixtures:
+            path = GenerateFixture(fixture, args.fixtures)
+            print(f'{fixture.name}: {path}', file=sys.stderr)
+            results['fixtures'][fixture.name] = RunFixture(fixture, path, Path(workFolder), jobs=args.jobs)
+
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with args.output.open('w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline is not None:
+        with args.baseline.open() as f:
+            regressions = CompareResults(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f'Slower than x{args.tolerance}: {", ".join(regressions)}', file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import asyncio, json, os, sys
+import pytest
+from tscutter.common import InvalidTsFormat
+from tscutter.aio import AsyncInputFile, _Lines, _Process
+
+def test_Lines_SplitsOnCarriageReturns():
+    async def Run():
+        reader = asyncio.StreamReader()
+        reader.feed_data('frame=1 time=00:00:01.00\rframe=2 time=00:00:0'.encode())
+        reader.feed_data('2.00\rpts_time:1 \xe9\n'.encode()[:-2])
+        reader.feed_data('\xe9\n'.encode()[-2:] + b'end')
+        reader.feed_eof()
+        return [ line async for line in _Lines(reader) ]
+    assert asyncio.run(Run()) == [ 'frame=1 time=00:00:01.00', 'frame=2 time=00:00:02.00', 'pts_time:1 \xe9', 'end' ]
+
+def test_Process_CancelKillsChild():
+    async def Run():
+        slots = asyncio.Semaphore(1)
+        started = asyncio.Event()
+        processes = []
+        async def Child():
+            async with _Process(slots, sys.executable, '-c', 'import time; time.sleep(60)') as process:
+                processes.append(process)
+                started.set()
+                await process.wait()
+        task = asyncio.create_task(Child())
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return processes[0].returncode, slots.locked()
+    returncode, locked = asyncio.run(Run())
+    assert returncode is not None and returncode != 0
+    assert not locked
+
+def _StubTools(folder, monkeypatch, ffmpeg='import sys; sys.stdout.buffer.write(bytes(16000))', ffmpeg5=None):
+    probe = { 'streams': [ { 'codec_type': 'video', 'duration': '2.0', 'width': 720, 'height': 480, 'avg_frame_rate': '30000/1001', 'sample_aspect_ratio': '8:9', 'display_aspect_ratio': '4:3' }, { 'codec_type': 'audio' } ], 'programs': [ { 'program_id': 1, 'nb_streams': 2 } ] }
+    tools = {
+        'ffprobe': f'import sys; sys.stdout.write({json.dumps(json.dumps(probe))})',
+        # 1 s of mono s16 silence at 8 kHz by default
+        'ffmpeg': ffmpeg,
+    }
+    if ffmpeg5 is not None:
+        tools['ffmpeg5'] = ffmpeg5
+    for name, code in tools.items():
+        path = folder / name
+        path.write_text(f'#!{sys.executable}\n{code}\n')
+        path.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{folder}{os.pathsep}{os.environ["PATH"]}')
+
+def test_ReadAudio_SingleSlot(tmp_path, monkeypatch):
+    _StubTools(tmp_path, monkeypatch)
+    videoPath = tmp_path / 'test.ts'
+    videoPath.write_bytes(bytes(188))
+    async def Run():
+        inputFile = AsyncInputFile(videoPath, slots=asyncio.Semaphore(1))
+        # ffprobe needs the slot as well
+        return [ samples async for samples in inputFile.ReadAudio(sampleRate=8000) ]
+    chunks = asyncio.run(asyncio.wait_for(Run(), 30))
+    assert sum(len(samples) for samples in chunks) == 8000
+
+# some samples, then a decode error
+FAILING_FFMPEG = 'import sys; sys.stdout.buffer.write(bytes(1000)); sys.stderr.write("Invalid data found when processing input\\n"); sys.exit(1)'
+
+def test_ReadAudio_Failed(tmp_path, monkeypatch):
+    _StubTools(tmp_path, monkeypatch, ffmpeg=FAILING_FFMPEG)
+    videoPath = tmp_path / 'test.ts'
+    videoPath.write_bytes(bytes(188))
+    async def Run():
+        inputFile = AsyncInputFile(videoPath, slots=asyncio.Semaphore(1))
+        return [ samples async for samples in inputFile.ReadAudio(sampleRate=8000) ]
+    with pytest.raises(InvalidTsFormat, match='exit code 1: Invalid data found'):
+        asyncio.run(asyncio.wait_for(Run(), 30))
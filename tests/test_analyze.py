@@ -1,8 +1,11 @@
+import io, threading
+import numpy as np
 import pytest
 from tests import junjyoukirari_23_ts, salor_moon_C_02_ts, salor_moon_C_02_ptsmap, salor_moon_C_11_ts, invalid_ts, not_existing_ts
 import tscutter.analyze
 from tscutter.ffmpeg import InputFile
 from tscutter.common import PtsMap, InvalidTsFormat
+from tscutter._progress import Progress
 import shutil
 
 def test_Analyze_Success():
@@ -26,3 +29,43 @@ def test_Analyze_BuggyFile():
     assert indexPath.is_file()
     assert indexPath.stat().st_size > 0
     indexPath.unlink()
+
+def test_CoarseWindows():
+    keyFrames = [ { 'ptsTime': 1.0 + i * 0.5, 'sad': { 4: 4.0, 11: 5.0 }.get(i, 1.0) } for i in range(17) ]
+    windows = tscutter.analyze._CoarseWindows(keyFrames, 2, 8, 1, 9)
+    assert windows == [ pytest.approx([ 1.4, 3.6, 2.0 ]), pytest.approx([ 4.9, 7.1, 5.5 ]) ]
+    # partial GOPs at both ends of the window are always decoded
+    windows = tscutter.analyze._CoarseWindows(keyFrames[2:-2], 1, 9, 0.5, 9.5)
+    assert windows[0][:1] == [ 0.5 ] and windows[-1][1] == 9.5
+
+class _FakeInputFile:
+    def __init__(self) -> None:
+        self.searched = threading.Event()
+        self.searchedEarly = None
+
+    def ReadAudio(self, ss=0, to=999999, sampleRate=48000, progress=None):
+        # 1 s of tone, then silences of 1 s and 2 s at 2 and 5 s
+        samples = np.full(8 * sampleRate, 3000, dtype=np.int16)
+        samples[2 * sampleRate:3 * sampleRate] = 0
+        samples[5 * sampleRate:7 * sampleRate] = 0
+        for i in range(0, len(samples), sampleRate // 2):
+            if i == 5 * sampleRate:
+                # the first silence is final since 3.8 s
+                self.searchedEarly = self.searched.wait(10)
+            yield samples[i:i + sampleRate // 2]
+
+def test_PipelinedCutLocations(monkeypatch):
+    searched = []
+    def FindSplitPosition(inputFile, ss, to, splitPosShift=1, **kwargs):
+        searched.append((ss, to))
+        inputFile.searched.set()
+        frame = { 'ptsTime': ss, 'sad': 1.0, 'pos': 0 }
+        return frame, frame, frame
+    monkeypatch.setattr(tscutter.analyze, 'FindSplitPosition', FindSplitPosition)
+    inputFile = _FakeInputFile()
+    blockLevels = tscutter.analyze.BlockLevels(48000)
+    locations = tscutter.analyze.PipelinedCutLocations(inputFile, 800, -80, 1, Progress(use_protocol=True, stream=io.StringIO()), jobs=2, blockLevels=blockLevels)
+    assert inputFile.searchedEarly
+    assert sorted(searched) == [ (2.0, 3.0), (5.0, 7.0) ]
+    assert [ sceneChange['ptsTime'] for _, sceneChange, _ in locations ] == [ 2.0, 5.0 ]
+    assert len(blockLevels.Levels()) == 800
@@ -0,0 +1,70 @@
+import numpy as np
+from tscutter.audio import SilenceDetector
+
+def _Signal(rate, seconds, silences):
+    rng = np.random.default_rng(0)
+    samples = rng.normal(0, 3000, rate * seconds).astype(np.int16)
+    for start, end in silences:
+        samples[rate * start // 1000:rate * end // 1000] = 0
+    return samples
+
+def _Detect(samples, rate, chunk):
+    detector = SilenceDetector(sampleRate=rate, min_silence_len=800, silence_thresh=-80)
+    periods = []
+    for i in range(0, len(samples), chunk):
+        periods += detector.Feed(samples[i:i + chunk])
+    return periods + detector.Flush()
+
+def test_SilenceDetector_Periods():
+    samples = _Signal(16000, 20, [(2000, 3500), (9000, 9500), (15000, 20000)])
+    assert _Detect(samples, 16000, 16000) == [[2000, 3500], [15000, 20000]]
+
+def test_SilenceDetector_ChunkSizeIndependent():
+    samples = _Signal(48000, 12, [(1000, 2000), (2500, 4000), (7000, 8000)])
+    assert _Detect(samples, 48000, 1234) == _Detect(samples, 48000, len(samples))
+
+class _FakeInputFile:
+    """Decodes _Signal() with an off-by-one error after a seek until the first digital silence, like ffmpeg's mp2 decoder."""
+    def __init__(self, samples, rate) -> None:
+        self.samples, self.rate = samples, rate
+
+    def GetInfo(self):
+        return type('VideoInfo', (), { 'duration': len(self.samples) / self.rate })
+
+    def ReadAudio(self, ss=0, to=999999, sampleRate=48000, progress=None):
+        samples = self.samples[round(ss * self.rate):round(min(to, self.GetInfo().duration) * self.rate)].copy()
+        if ss > 0:
+            converged = np.flatnonzero(samples == 0)
+            samples[:converged[0] if len(converged) else len(samples)] += 1
+        for i in range(0, len(samples), 5000):
+            yield samples[i:i + 5000]
+
+def test_DetectSilence_Segmented(monkeypatch):
+    import tscutter.audio
+    monkeypatch.setattr(tscutter.audio, 'SEGMENT_MIN_LENGTH', 5)
+    monkeypatch.setattr(tscutter.audio, 'SEGMENT_OVERLAP', 3000)
+    samples = _Signal(8000, 30, [ (1000, 2000), (9000, 16000), (22000, 23000), (29000, 30000) ])
+    # just below the threshold, but not anymore when decoded off by one, across the boundary of 3 segments
+    samples[19000 * 8:22000 * 8] = 3
+    inputFile = _FakeInputFile(samples, 8000)
+    single = tscutter.audio.DetectSilence(inputFile, sampleRate=8000)
+    assert single == [ [ 1000, 2000 ], [ 9000, 16000 ], [ 19000, 23000 ], [ 29000, 30000 ] ]
+    _, levels = tscutter.audio.DetectSilence(inputFile, sampleRate=8000, withLevels=True)
+    assert levels.tolist() == (samples.astype(np.int64) ** 2).reshape(-1, 80).sum(axis=1).tolist()
+    for jobs in (2, 3, 5):
+        periods, segmentedLevels = tscutter.audio.DetectSilence(inputFile, sampleRate=8000, jobs=jobs, withLevels=True)
+        assert periods == single
+        assert segmentedLevels.tolist() == levels.tolist()
+    # switching at the boundary itself would pick up the decoding error
+    monkeypatch.setattr(tscutter.audio, '_SwitchPoint', lambda boundary, *args: boundary)
+    assert tscutter.audio.DetectSilence(inputFile, sampleRate=8000, jobs=3) != single
+
+def test_SwitchPoint_DifferentLengths():
+    from tscutter.audio import _SwitchPoint, SEGMENT_MATCH_BLOCKS, SEGMENT_PREROLL
+    rng = np.random.default_rng(0)
+    before = rng.integers(0, 1000, 3100)
+    after = before[:2900].copy()
+    after[:10] += 1
+    assert _SwitchPoint(60000, before, after, 10) == 60000 - SEGMENT_PREROLL + 10 * 10
+    # too few blocks to agree on
+    assert _SwitchPoint(60000, before, after[:SEGMENT_MATCH_BLOCKS - 1], 10) == 60000
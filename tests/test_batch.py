@@ -0,0 +1,58 @@
+import os
+from pathlib import Path
+from tscutter.batch import BatchJournal, CollectInputs
+
+def test_CollectInputs(tmp_path):
+    (tmp_path / 'sub' / '_metadata').mkdir(parents=True)
+    for name in [ 'a.ts', 'b.m2ts', 'sub/c.ts', 'sub/_metadata/d.ts', 'notes.txt' ]:
+        (tmp_path / name).write_bytes(b'')
+    paths = CollectInputs([ tmp_path, str(tmp_path / '*.ts') ])
+    assert sorted(path.relative_to(tmp_path).as_posix() for path in paths) == [ 'a.ts', 'b.m2ts', 'sub/c.ts' ]
+
+def test_BatchJournal(tmp_path):
+    videoPath = tmp_path / 'a.ts'
+    videoPath.write_bytes(b'\x47' * 188)
+    indexPath = tmp_path / '_metadata' / 'a.ptsmap'
+    journalPath = tmp_path / 'batch.jsonl'
+    params = { 'minSilenceLen': 800 }
+
+    journal = BatchJournal(journalPath)
+    assert not journal.IsDone(videoPath, indexPath, params)
+    indexPath.parent.mkdir()
+    indexPath.write_text('{}')
+    journal.Record(videoPath, 'failed', params, error='InvalidTsFormat')
+    assert not journal.IsDone(videoPath, indexPath, params)
+    journal.Record(videoPath, 'done', params)
+    # a killed batch may leave half a line behind
+    with journalPath.open('a') as f:
+        f.write('{"path": ')
+
+    journal = BatchJournal(journalPath)
+    assert journal.IsDone(videoPath, indexPath, params)
+    assert not journal.IsDone(videoPath, indexPath, { 'minSilenceLen': 500 })
+    stat = videoPath.stat()
+    os.utime(videoPath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert not journal.IsDone(videoPath, indexPath, params)
+    journal.Record(videoPath, 'done', params)
+    assert BatchJournal(journalPath).IsDone(videoPath, indexPath, params)
+
+def _CrashingAnalyzeFile(videoPath, indexPath, params, useCache):
+    if videoPath.name == 'crash.ts':
+        # like an OOM kill
+        os._exit(1)
+    indexPath.write_text('{}')
+    return 'done', None, 0.0
+
+def test_AnalyzeBatch_WorkerDies(tmp_path, monkeypatch):
+    import tscutter.batch
+    from tscutter._progress import SilentProgress
+    from tscutter.batch import AnalyzeBatch
+    monkeypatch.setattr(tscutter.batch, '_AnalyzeFile', _CrashingAnalyzeFile)
+    # the largest file goes first
+    for name, size in [ ('crash.ts', 3), ('b.ts', 2), ('c.ts', 1) ]:
+        (tmp_path / name).write_bytes(b'\x47' * 188 * size)
+    journalPath = tmp_path / 'batch.jsonl'
+    results = AnalyzeBatch([ tmp_path ], journalPath=journalPath, workers=1, progress=SilentProgress())
+    assert { Path(path).name: status for path, status in results.items() } == { 'crash.ts': 'failed', 'b.ts': 'done', 'c.ts': 'done' }
+    journal = BatchJournal(journalPath)
+    assert sorted((Path(path).name, record['status']) for path, record in journal.records.items()) == [ ('b.ts', 'done'), ('c.ts', 'done'), ('crash.ts', 'failed') ]
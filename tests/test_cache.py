@@ -0,0 +1,74 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from tscutter.cache import Cache, FileFingerprint
+
+def _TsFile(path, content):
+    path.write_bytes(content)
+    return path
+
+def test_FileFingerprint(tmp_path):
+    a = _TsFile(tmp_path / 'a.ts', b'\x47' * 5000)
+    b = _TsFile(tmp_path / 'b.ts', b'\x47' * 4999 + b'\x48')
+    assert FileFingerprint(a) == FileFingerprint(a)
+    assert FileFingerprint(a) != FileFingerprint(b)
+
+def test_CacheEntry_Segments(tmp_path):
+    cache = Cache(root=tmp_path / 'cache')
+    entry = cache.Entry(_TsFile(tmp_path / 'a.ts', b'\x47' * 188))
+    entry.PutProbe({ 'duration': 10.0 })
+    entry.PutSegment('pes', 1.0, 2.0, np.arange(3))
+    entry.PutSegment('pes', 3.0, 4.0, np.arange(4))
+    entry.PutSegment('pes', 1.0, 4.0, np.arange(7), replaces=entry.Segments('pes'))
+    segments = entry.Segments('pes')
+    assert [ (s['ss'], s['to']) for s in segments ] == [ (1.0, 4.0) ]
+    assert list(entry.LoadSegment(segments[0])) == list(range(7))
+    assert entry.GetProbe() == { 'duration': 10.0 }
+    assert len(list(entry.folder.glob('*.npy'))) == 1
+
+def test_Cache_PruneLeastRecentlyUsed(tmp_path):
+    cache = Cache(root=tmp_path / 'cache')
+    old = cache.Entry(_TsFile(tmp_path / 'old.ts', b'\x47' * 188))
+    old.PutSegment('pes', 0.0, 1.0, np.zeros(1000))
+    new = cache.Entry(_TsFile(tmp_path / 'new.ts', b'\x47' * 376))
+    new.PutSegment('pes', 0.0, 1.0, np.zeros(1000))
+    removed = cache.Prune(maxSize=new.Size(), inUseSeconds=0)
+    assert [ entry.folder for entry in removed ] == [ old.folder ]
+    assert [ entry.Name() for entry in cache.Entries() ] == [ 'new.ts' ]
+
+def _PutSegments(root, tsPath, count):
+    entry = Cache(root=root).Entry(tsPath)
+    for i in range(count):
+        entry.PutSegment('pes', float(i), i + 1.0, np.arange(i + 1))
+
+def test_CacheEntry_ConcurrentProcesses(tmp_path):
+    tsPath = _TsFile(tmp_path / 'a.ts', b'\x47' * 188)
+    with ProcessPoolExecutor(max_workers=4, mp_context=multiprocessing.get_context('spawn')) as executor:
+        list(executor.map(_PutSegments, [ tmp_path / 'cache' ] * 4, [ tsPath ] * 4, [ 20 ] * 4))
+    entry = Cache(root=tmp_path / 'cache').Entry(tsPath)
+    # no process lost the index updates of another
+    assert len(entry.Segments('pes')) == 80
+    assert len(list(entry.folder.glob('*.npy'))) == 80
+
+def test_Cache_PruneSparesEntriesInUse(tmp_path):
+    cache = Cache(root=tmp_path / 'cache')
+    entry = cache.Entry(_TsFile(tmp_path / 'a.ts', b'\x47' * 188))
+    entry.PutSegment('pes', 0.0, 1.0, np.zeros(1000))
+    assert cache.Prune(maxSize=0) == []
+    assert len(cache.Prune(maxSize=0, inUseSeconds=0)) == 1
+
+def test_Cache_PrunesOnlyWhenFull(tmp_path, monkeypatch):
+    import tscutter.cache
+    monkeypatch.setattr(tscutter.cache, 'PRUNE_STEP', 50000)
+    cache = Cache(root=tmp_path / 'cache', maxSize=100000)
+    passes = []
+    prune = cache.Prune
+    monkeypatch.setattr(cache, 'Prune', lambda **kwargs: passes.append(kwargs) or prune(**kwargs))
+    entry = cache.Entry(_TsFile(tmp_path / 'a.ts', b'\x47' * 188))
+    for i in range(10):
+        entry.PutSegment('pes', float(i), i + 1.0, np.zeros(100))
+    # the first write learns the size of the cache
+    assert len(passes) == 1
+    for i in range(10):
+        entry.PutSegment('pes', float(i), i + 1.0, np.zeros(2000))
+    assert 1 < len(passes) < 10
@@ -1,5 +1,8 @@
+import json
+import numpy as np
+import pytest
 from tests import salor_moon_C_02_ptsmap
-from tscutter.common import PtsMap
+from tscutter.common import InvalidIndexFormat, PtsMap
 
 def test_PtsMap_Duration():
     ptsMap = PtsMap(salor_moon_C_02_ptsmap)
@@ -7,4 +10,74 @@ def test_PtsMap_Duration():
 
 def test_PtsMap_Length():
     ptsMap = PtsMap(salor_moon_C_02_ptsmap)
-    assert ptsMap.Length() == 2112393756
\ No newline at end of file
+    assert ptsMap.Length() == 2112393756
+
+def _PtsMapJson(ptsList, positions):
+    ptsMap = {}
+    for i, (pts, pos) in enumerate(zip(ptsList, positions)):
+        ptsMap[pts] = {
+            'pts_display': '', 'sad': 0.5,
+            'prev_end_pts': pts - 0.03, 'prev_end_sad': 0.0, 'prev_end_pos': pos - 188,
+            'next_start_pts': pts, 'next_start_sad': 0.0, 'next_start_pos': pos,
+        }
+        if i == 0 or i == len(ptsList) - 1:
+            ptsMap[pts].update(silent_ss=pts, silent_to=pts)
+    return ptsMap
+
+def test_PtsMap_Formats(tmp_path):
+    from tscutter.analyze import WritePtsMap
+    ptsList = [ 0.0, 30.0, 120.5, 300.0, 310.0, 600.0, 900.0 ]
+    ptsMap = _PtsMapJson(ptsList, [ 188 * (1 + 1000 * i) for i in range(len(ptsList)) ])
+    WritePtsMap(ptsMap, tmp_path / 'a.ptsmap')
+    WritePtsMap(ptsMap, tmp_path / 'b.ptsmap', binary=True)
+    jsonMap, binaryMap = PtsMap(tmp_path / 'a.ptsmap'), PtsMap(tmp_path / 'b.ptsmap')
+    assert (tmp_path / 'b.ptsmap').stat().st_size < (tmp_path / 'a.ptsmap').stat().st_size
+    for loaded in jsonMap, binaryMap:
+        assert loaded.Clips() == list(zip(ptsList[:-1], ptsList[1:]))
+        assert loaded.Duration() == 900.0 - 0.03
+        assert loaded.Length() == 188 * 6000
+        # the longest clips until more than half of the video is covered
+        assert loaded.SelectClips(lengthLimit=150) == ([ (600.0, 900.0), (310.0, 600.0) ], 590.0)
+        assert loaded.ClipBoundaries((30.0, 200.0)) == (1, 3)
+        assert loaded.ClipBoundaries((40.0, 120.5)) == (1, 2)
+    assert binaryMap.data == jsonMap.data
+    assert list(jsonMap.data['900.0']) == [ 'pts_display', 'sad', 'silent_ss', 'silent_to', 'prev_end_pts', 'prev_end_sad', 'prev_end_pos', 'next_start_pts', 'next_start_sad', 'next_start_pos' ]
+
+def test_PtsMap_Invalid(tmp_path):
+    from tscutter.analyze import WritePtsMap
+    WritePtsMap(_PtsMapJson([ 0.0, 30.0, 60.0 ], [ 188, 376, 564 ]), tmp_path / 'a.ptsmap', binary=True)
+    data = (tmp_path / 'a.ptsmap').read_bytes()
+    # cut short in the header, in the table, or not a ptsmap at all
+    for content in data[:10], data[:-1], b'[ 0.0', json.dumps({ '0.0': {} }).encode(), b'[ 1, 2 ]', json.dumps({ '0.0': 5 }).encode():
+        (tmp_path / 'b.ptsmap').write_bytes(content)
+        with pytest.raises(InvalidIndexFormat):
+            PtsMap(tmp_path / 'b.ptsmap')
+
+def test_PtsMap_MemoryMappedOnlyWhenLarge(tmp_path, monkeypatch):
+    from tscutter import common
+    from tscutter.analyze import WritePtsMap
+    indexPath = tmp_path / 'a.ptsmap'
+    WritePtsMap(_PtsMapJson([ 0.0, 30.0, 60.0 ], [ 188, 376, 564 ]), indexPath, binary=True)
+    # small tables do not keep the file mapped
+    assert not isinstance(PtsMap(indexPath).table, np.memmap)
+    monkeypatch.setattr(common, 'PTSMAP_MMAP_ROWS', 2)
+    loaded = PtsMap(indexPath)
+    assert isinstance(loaded.table, np.memmap)
+    assert loaded.Clips() == [ (0.0, 30.0), (30.0, 60.0) ]
+
+def test_PtsMap_ExtractClipsPipe(tmp_path):
+    from tscutter.analyze import WritePtsMap
+    ptsList = [ 0.0, 10.0, 20.0, 30.0 ]
+    WritePtsMap(_PtsMapJson(ptsList, [ 188 * (1 + 1000 * i) for i in range(len(ptsList)) ]), tmp_path / 'a.ptsmap')
+    ptsMap = PtsMap(tmp_path / 'a.ptsmap')
+    videoPath = tmp_path / 'a.ts'
+    videoPath.write_bytes(bytes(range(256)) * 188 * 20)
+    clips = [ (20.0, 30.0), (0.0, 10.0), (10.0, 20.0) ]
+    expected = b''
+    for clip in clips:
+        with (tmp_path / 'one.ts').open('wb') as f:
+            ptsMap.ExtractClipPipe(videoPath, clip, f)
+        expected += (tmp_path / 'one.ts').read_bytes()
+    with (tmp_path / 'all.ts').open('wb') as f:
+        assert ptsMap.ExtractClipsPipe(videoPath, clips, f) == len(expected)
+    assert (tmp_path / 'all.ts').read_bytes() == expected
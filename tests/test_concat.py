@@ -0,0 +1,104 @@
+import shutil
+import numpy as np
+import pytest
+from tscutter.concat import ConcatClips, ReadStreamPids, _CopyArgs, _PresentPids
+from tscutter.mpegts import OpenPackets, PacketPids, PacketView, ReadProgramMap, ReadSection, TS_PACKET_SIZE
+from tscutter.pidfilter import _Crc32
+from tests.test_fastprobe import SEQUENCE_HEADER
+from tests.test_mpegts import _Pes, _WriteTs, VIDEO_PID, AUDIO_PID, PMT_PID
+
+PCR_PID = 0x1ff
+# MPEG-1 layer II, 32 kbit/s, 48 kHz, mono: 24 ms of silence
+MP2_FRAME = bytes([ 0xff, 0xfd, 0x14, 0xc0 ]) + bytes(92)
+
+def test_ReadStreamPids(tmp_path):
+    path = tmp_path / 'test.ts'
+    _WriteTs(path, [ (90000, 'I') ])
+    pids = ReadStreamPids(path)
+    assert pids == [ VIDEO_PID, AUDIO_PID ]
+    args = _CopyArgs([ f'0:#{pid:#x}' for pid in pids ], tmp_path / 'out.ts')
+    assert args[:4] == [ '-map', '0:#0x111', '-map', '0:#0x112' ]
+
+def _Section(tableId, body):
+    length = len(body) + 4
+    section = bytes([ tableId, 0xb0 | length >> 8, length & 0xff ]) + body
+    return b'\x00' + section + _Crc32(section).to_bytes(4, 'big')
+
+def _Packets(pid, payload, cc, pusi=True, pcr=None):
+    # unlike _WriteTs, stuff with the adaptation field so that ffmpeg reads clean streams
+    packets = []
+    while True:
+        chunk, payload = payload[:184], payload[184:]
+        adaptation = b''
+        if pcr is not None:
+            adaptation = bytes([ 0x10, pcr >> 25 & 0xff, pcr >> 17 & 0xff, pcr >> 9 & 0xff, pcr >> 1 & 0xff, (pcr & 1) << 7 | 0x7e, 0 ])
+        if len(chunk) < 184 or adaptation:
+            stuffing = 183 - len(chunk) - max(len(adaptation), 1)
+            adaptation = bytes([ 183 - len(chunk) ]) + (adaptation or b'\x00')[:183 - len(chunk)] + b'\xff' * max(stuffing, 0)
+        control = (0x20 if adaptation else 0) | (0x10 if chunk else 0)
+        packets.append(bytes([ 0x47, (0x40 if pusi else 0) | pid >> 8, pid & 0xff, control | cc % 16 ]) + adaptation + chunk)
+        cc += 1
+        pusi = False
+        if not payload:
+            return b''.join(packets)
+
+def _WriteBroadcastTs(path, frames, silentFrames=()):
+    """A TS that ffmpeg can remux, with the PCR on a PID of its own and a PAT and PMT every 15 frames."""
+    psi = _Packets(0, _Section(0x00, bytes([ 0, 1, 0xc1, 0, 0, 0, 1, 0xe0 | PMT_PID >> 8, PMT_PID & 0xff ])), 0)
+    psi += _Packets(PMT_PID, _Section(0x02, bytes([ 0, 1, 0xc1, 0, 0, 0xe0 | PCR_PID >> 8, PCR_PID & 0xff, 0xf0, 0,
+                                                    0x02, 0xe0 | VIDEO_PID >> 8, VIDEO_PID & 0xff, 0xf0, 0,
+                                                    0x03, 0xe0 | AUDIO_PID >> 8, AUDIO_PID & 0xff, 0xf0, 0 ])), 0)
+    data, positions = b'', []
+    for i in range(frames):
+        pts = 90000 + i * 3003
+        if i % 15 == 0:
+            positions.append(len(data))
+            data += psi
+        data += _Packets(PCR_PID, b'', i, pusi=False, pcr=pts - 9000)
+        if i not in silentFrames:
+            data += _Packets(AUDIO_PID, _Pes(0xc0, pts, MP2_FRAME), i)
+        data += _Packets(VIDEO_PID, _Pes(0xe0, pts, SEQUENCE_HEADER + bytes([ 0, 0, 1, 0, 0, 0x0f, 0xff, 0xf8 ]) + bytes(100)), i)
+    path.write_bytes(data)
+    return positions + [ len(data) + TS_PACKET_SIZE ]
+
+def _BroadcastPtsMap(tmp_path, positions):
+    from tscutter.analyze import WritePtsMap
+    from tscutter.common import PtsMap
+    from tests.test_common import _PtsMapJson
+    ptsList = [ i * 15 * 3003 / 90000 for i in range(len(positions)) ]
+    WritePtsMap(_PtsMapJson(ptsList, positions), tmp_path / 'in.ptsmap')
+    return PtsMap(tmp_path / 'in.ptsmap')
+
+def test_PresentPids(tmp_path):
+    path = tmp_path / 'in.ts'
+    positions = _WriteBroadcastTs(path, 45, silentFrames=range(15, 30))
+    assert _PresentPids(path, (positions[0], positions[1]), [ VIDEO_PID, AUDIO_PID ]) == [ VIDEO_PID, AUDIO_PID ]
+    assert _PresentPids(path, (positions[1], positions[2]), [ VIDEO_PID, AUDIO_PID ]) == [ VIDEO_PID ]
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not found in PATH')
+def test_ConcatClips(tmp_path):
+    path = tmp_path / 'in.ts'
+    # the audio pauses during the second clip
+    positions = _WriteBroadcastTs(path, 90, silentFrames=range(60, 75))
+    ptsMap = _BroadcastPtsMap(tmp_path, positions)
+    output = ConcatClips(path, ptsMap, [ ptsMap.Clips()[4], ptsMap.Clips()[1] ], tmp_path / 'out.ts')
+
+    mm, offset, count = OpenPackets(output)
+    packets = PacketView(mm, offset, 0, count)
+    pids = PacketPids(packets)
+    # ffmpeg adds an SDT
+    assert set(pids.tolist()) == { 0, 0x11, PMT_PID, VIDEO_PID, AUDIO_PID }
+    programMap = ReadProgramMap(packets)
+    assert (programMap.serviceId, programMap.pmtPid, programMap.pcrPid) == (1, PMT_PID, VIDEO_PID)
+    assert programMap.streams == [ (0x02, VIDEO_PID), (0x03, AUDIO_PID) ]
+    assert _Crc32(ReadSection(packets, 0, tableId=0x00)) == 0
+    assert _Crc32(ReadSection(packets, PMT_PID, tableId=0x02)) == 0
+    # the continuity counters of the packets with a payload count on across the join
+    for pid in set(pids.tolist()):
+        rows = np.flatnonzero((pids == pid) & (packets[:, 3] & 0x10 != 0))
+        assert np.all(np.diff(packets[rows, 3].astype(np.int32) & 0x0f) % 16 == 1)
+    # both clips contribute their video, only the first its audio
+    assert np.count_nonzero((pids == VIDEO_PID) & (packets[:, 1] & 0x40 != 0)) == 30
+    assert np.count_nonzero((pids == AUDIO_PID) & (packets[:, 1] & 0x40 != 0)) == 15
+    del packets
+    mm.close()
@@ -0,0 +1,49 @@
+import os
+from tscutter.audio import BlockLevels, DetectSilenceFromLevels
+from tscutter.envelope import DetectSilenceFromEnvelope, Envelope, SweepSilence
+from tests.test_audio import _Signal
+
+def test_Envelope_Sweep(tmp_path):
+    tsPath = tmp_path / 'a.ts'
+    tsPath.write_bytes(b'')
+    samples = _Signal(8000, 30, [ (1000, 2000), (5000, 5500), (9000, 16000), (29000, 30000) ])
+    # quiet, but not silent at -80 dB
+    samples[20000 * 8:22000 * 8] = 5
+    levels = BlockLevels(sampleRate=8000)
+    levels.Feed(samples)
+    Envelope.FromLevels(levels.Levels(), tsPath, sampleRate=8000).Save(tmp_path / 'a.envelope')
+    envelope = Envelope.Load(tmp_path / 'a.envelope')
+    assert envelope.IsUpToDate(tsPath)
+    for length, threshold in ((800, -80), (400, -70), (1500, -80)):
+        assert DetectSilenceFromEnvelope(envelope, length, threshold) == DetectSilenceFromLevels(levels.Levels(), sampleRate=8000, min_silence_len=length, silence_thresh=threshold)
+    results = { (result['length'], result['threshold']): result for result in SweepSilence(envelope, [ 400, 800 ], [ -80, -70 ]) }
+    assert results[(800, -80)]['silences'] == 3
+    assert results[(400, -80)]['silences'] == 4
+    assert results[(800, -70)]['silences'] == 4
+    assert results[(800, -80)]['silentSeconds'] == 9.0
+
+def test_DetectSilenceFromEnvelope_OffGrid(tmp_path):
+    tsPath = tmp_path / 'a.ts'
+    tsPath.write_bytes(b'')
+    # silences that start and end within a 10 ms block
+    samples = _Signal(8000, 20, [ (1003, 2507), (6001, 6799), (9004, 15996), (19995, 20000) ])
+    levels = BlockLevels(sampleRate=8000)
+    levels.Feed(samples[:-3])
+    envelope = Envelope.FromLevels(levels.Levels(), tsPath, sampleRate=8000)
+    for length, threshold in ((800, -80), (795, -80), (805, -60), (1504, -80)):
+        assert DetectSilenceFromEnvelope(envelope, length, threshold) == DetectSilenceFromLevels(levels.Levels(), sampleRate=8000, min_silence_len=length, silence_thresh=threshold)
+
+def test_Envelope_IsUpToDate(tmp_path):
+    tsPath = tmp_path / 'a.ts'
+    tsPath.write_bytes(b'\x47' * 188)
+    envelope = Envelope.FromLevels(BlockLevels(sampleRate=8000).Levels(), tsPath, sampleRate=8000)
+    assert envelope.IsUpToDate(tsPath)
+    # the recording went on
+    with tsPath.open('ab') as f:
+        f.write(b'\x47' * 188)
+    assert not envelope.IsUpToDate(tsPath)
+    envelope = Envelope.FromLevels(BlockLevels(sampleRate=8000).Levels(), tsPath, sampleRate=8000)
+    # rewritten in place with the same size
+    stat = tsPath.stat()
+    os.utime(tsPath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert not envelope.IsUpToDate(tsPath)
@@ -0,0 +1,48 @@
+import pytest
+from tscutter.common import InvalidTsFormat
+from tscutter.fastprobe import FastProbe
+from tscutter.mpegts import PTS_WRAP
+from tests.test_mpegts import AUDIO_PID, PMT_PID, VIDEO_PID, _Packet, _Pes, _Section
+
+# 720x480, 4:3, 29.97 fps, then the MPEG-2 sequence extension
+SEQUENCE_HEADER = bytes([ 0, 0, 1, 0xb3, 0x2d, 0x01, 0xe0, 0x24, 0xff, 0xff, 0xe0, 0x00 ]) + bytes([ 0, 0, 1, 0xb5, 0x14, 0x82, 0x00, 0x01, 0x00, 0x00 ])
+
+def _WriteMpeg2Ts(path, firstPts, frames):
+    pat = _Packet(0, _Section(0x00, bytes([ 0, 1, 0xc1, 0, 0, 0, 1, 0xe0 | PMT_PID >> 8, PMT_PID & 0xff ])), pusi=True)
+    pmt = _Packet(PMT_PID, _Section(0x02, bytes([ 0, 1, 0xc1, 0, 0, 0xe0 | VIDEO_PID >> 8, VIDEO_PID & 0xff, 0xf0, 0,
+                                                  0x02, 0xe0 | VIDEO_PID >> 8, VIDEO_PID & 0xff, 0xf0, 0,
+                                                  0x0f, 0xe0 | AUDIO_PID >> 8, AUDIO_PID & 0xff, 0xf0, 0 ])), pusi=True)
+    data = pat + pmt
+    for i in range(frames):
+        pts = (firstPts + i * 3003) % PTS_WRAP
+        es = SEQUENCE_HEADER if i % 15 == 0 else b'\x00\x00\x01\x00'
+        data += _Packet(AUDIO_PID, _Pes(0xc0, pts, b''), pusi=True, cc=i % 16)
+        data += _Packet(VIDEO_PID, _Pes(0xe0, pts, es), pusi=True, cc=i % 16)
+    path.write_bytes(data)
+
+def test_FastProbe(tmp_path):
+    path = tmp_path / 'test.ts'
+    _WriteMpeg2Ts(path, 90000, 30)
+    assert FastProbe(path) == {
+        'serviceId': 1,
+        'soundTracks': 1,
+        'width': 720,
+        'height': 480,
+        'fps': pytest.approx(30000 / 1001),
+        'sar': [ '8', '9' ],
+        'dar': [ '4', '3' ],
+        'duration': pytest.approx(30 * 3003 / 90000),
+    }
+    # the last frames are found in the tail only
+    assert FastProbe(path, tailPackets=4)['duration'] == pytest.approx(30 * 3003 / 90000)
+
+def test_FastProbe_PtsWrap(tmp_path):
+    path = tmp_path / 'test.ts'
+    _WriteMpeg2Ts(path, PTS_WRAP - 5 * 3003, 30)
+    assert FastProbe(path)['duration'] == pytest.approx(30 * 3003 / 90000)
+
+def test_FastProbe_NotTs(tmp_path):
+    path = tmp_path / 'test.mpg'
+    path.write_bytes(b'\x00\x00\x01\xba' * 1000)
+    with pytest.raises(InvalidTsFormat):
+        FastProbe(path)
@@ -0,0 +1,95 @@
+import io, os, threading
+import numpy as np
+import pytest
+from PIL import Image
+from tscutter.common import InvalidTsFormat
+from tscutter.ffmpeg import InputFile, _FrameSampler
+from tscutter.metrics import MetricEngine
+from tests.test_aio import FAILING_FFMPEG, _StubTools
+
+def test_FrameSampler_SameAsBmpPath():
+    rng = np.random.default_rng(1)
+    frames = rng.integers(0, 256, size=(20, 90, 148, 3), dtype=np.uint8)
+    sampler = _FrameSampler('sad')
+    for frame in frames:
+        sampler.frameSizes.put((frame.shape[1], frame.shape[0]))
+    sampler.frameSizes.put(None)
+    sampler.Read(io.BytesIO(frames.tobytes()))
+    # what the BMP path does with the same frames
+    sadSize = round(frames.shape[1] / 8), round(frames.shape[2] / 8)
+    engine = MetricEngine((sadSize[1], sadSize[0], 3))
+    for frame in frames:
+        engine.Add(np.asarray(Image.fromarray(frame).resize(sadSize, Image.NEAREST)))
+    assert np.array_equal(sampler.Results(), engine.Results()['sad'])
+    assert sampler.pipeBytes == frames.nbytes
+
+def test_ReadAudio_Failed(tmp_path, monkeypatch):
+    _StubTools(tmp_path, monkeypatch, ffmpeg=FAILING_FFMPEG)
+    videoPath = tmp_path / 'test.ts'
+    videoPath.write_bytes(bytes(188))
+    samples = []
+    with pytest.raises(InvalidTsFormat, match='exit code 1: Invalid data found'):
+        samples += InputFile(videoPath).ReadAudio(sampleRate=8000)
+    assert sum(len(chunk) for chunk in samples) == 500
+
+def test_ReadAudio_StoppedEarly(tmp_path, monkeypatch):
+    # a consumer that has heard enough kills ffmpeg, that is no failure
+    _StubTools(tmp_path, monkeypatch, ffmpeg='import sys, time; sys.stdout.buffer.write(bytes(16000)); sys.stdout.flush(); time.sleep(60)')
+    videoPath = tmp_path / 'test.ts'
+    videoPath.write_bytes(bytes(188))
+    chunks = InputFile(videoPath).ReadAudio(sampleRate=8000, chunkSeconds=0.5)
+    assert len(next(chunks)) == 4000
+    chunks.close()
+
+# a showinfo line without iskey: and type:, then ffmpeg keeps its pipes open
+MALFORMED_FFMPEG = 'import sys, time; sys.stderr.write("[Parsed_showinfo_1] n:0 pts:0 pos:0 pts_time:0 s:2x2\\n"); sys.stderr.flush(); time.sleep(60)'
+
+def _Errors(function):
+    errors = []
+    def Run():
+        try:
+            function()
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=Run, daemon=True)
+    thread.start()
+    # a deadlock would keep it running until ffmpeg gives up
+    thread.join(30)
+    assert not thread.is_alive()
+    return errors
+
+def test_ExtractFileProps_ParseError(tmp_path, monkeypatch):
+    _StubTools(tmp_path, monkeypatch, ffmpeg5=MALFORMED_FFMPEG)
+    videoPath = tmp_path / 'test.ts'
+    videoPath.write_bytes(bytes(188))
+    errors = _Errors(lambda: InputFile(videoPath).ExtractFileProps())
+    assert [ type(e) for e in errors ] == [ IndexError ]
+
+def test_ExtractFileProps_Failed(tmp_path, monkeypatch):
+    _StubTools(tmp_path, monkeypatch, ffmpeg5=FAILING_FFMPEG)
+    videoPath = tmp_path / 'test.ts'
+    videoPath.write_bytes(bytes(188))
+    errors = _Errors(lambda: InputFile(videoPath).ExtractFileProps())
+    assert [ type(e) for e in errors ] == [ InvalidTsFormat ]
+    assert 'exit code 1: Invalid data found' in str(errors[0])
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='needs /proc/self/fd')
+def test_ExtractFileProps_NotStarted(tmp_path, monkeypatch):
+    _StubTools(tmp_path, monkeypatch, ffmpeg5=FAILING_FFMPEG)
+    videoPath = tmp_path / 'test.ts'
+    videoPath.write_bytes(bytes(188))
+    inputFile = InputFile(videoPath)
+    inputFile.GetInfo()
+    inputFile.ffmpeg5 = str(tmp_path / 'missing')
+    fds = len(os.listdir('/proc/self/fd'))
+    with pytest.raises(FileNotFoundError):
+        inputFile.ExtractFileProps()
+    # the audio pipe is closed on both ends
+    assert len(os.listdir('/proc/self/fd')) == fds
+
+def test_ExtractFramePropsPipe_ParseError(tmp_path, monkeypatch):
+    _StubTools(tmp_path, monkeypatch, ffmpeg5=MALFORMED_FFMPEG)
+    videoPath = tmp_path / 'test.ts'
+    videoPath.write_bytes(bytes(188))
+    errors = _Errors(lambda: InputFile(videoPath)._ExtractFramePropsPipe(0, 1))
+    assert [ type(e) for e in errors ] == [ IndexError ]
@@ -0,0 +1,86 @@
+import io, os, threading
+import pytest
+from tscutter import fileio
+from tscutter.common import CopyPart
+from tscutter.fileio import CopyFileRange, SendFileRange, StreamRanges
+
+DATA = bytes(range(256)) * 4096
+
+def test_CopyFileRange(tmp_path, monkeypatch):
+    src = tmp_path / 'src.ts'
+    src.write_bytes(DATA)
+    dest = tmp_path / 'dest.ts'
+    CopyPart(src, dest, 188, 188 * 100)
+    CopyPart(src, dest, 188 * 200, len(DATA) + 188, mode='ab')
+    assert dest.read_bytes() == DATA[188:188 * 100] + DATA[188 * 200:]
+
+    # the buffered loop must give the same result when the kernel refuses
+    monkeypatch.setattr(fileio, 'KERNEL_STEP', 4096)
+    progress = []
+    with src.open('rb') as f1, (tmp_path / 'small.ts').open('wb') as f2:
+        assert CopyFileRange(f1.fileno(), f2.fileno(), 1000, 10000, onProgress=progress.append, bufsize=3000) == 10000
+    assert (tmp_path / 'small.ts').read_bytes() == DATA[1000:11000]
+    assert sum(progress) == 10000
+    monkeypatch.delattr(os, 'copy_file_range', raising=False)
+    monkeypatch.delattr(os, 'sendfile', raising=False)
+    with src.open('rb') as f1, (tmp_path / 'buffered.ts').open('wb') as f2:
+        assert CopyFileRange(f1.fileno(), f2.fileno(), 1000, 10000, bufsize=3000) == 10000
+    assert (tmp_path / 'buffered.ts').read_bytes() == DATA[1000:11000]
+
+def test_CopyFileRange_ShortKernelCopy(tmp_path, monkeypatch):
+    src = tmp_path / 'src.ts'
+    src.write_bytes(DATA)
+    calls = []
+    def ShortCopy(srcFd, destFd, count, offset):
+        # some file systems give up half way with 0 instead of an error
+        calls.append(offset)
+        if offset >= 5000:
+            return 0
+        return os.write(destFd, os.pread(srcFd, min(count, 5000 - offset), offset))
+    monkeypatch.setattr(os, 'copy_file_range', ShortCopy, raising=False)
+    monkeypatch.delattr(os, 'sendfile', raising=False)
+    with src.open('rb') as f1, (tmp_path / 'dest.ts').open('wb') as f2:
+        assert CopyFileRange(f1.fileno(), f2.fileno(), 1000, 10000, bufsize=3000) == 10000
+    assert (tmp_path / 'dest.ts').read_bytes() == DATA[1000:11000]
+    assert calls == [ 1000, 5000 ]
+    # EOF is where the read ends
+    with src.open('rb') as f1, (tmp_path / 'tail.ts').open('wb') as f2:
+        assert CopyFileRange(f1.fileno(), f2.fileno(), len(DATA) - 100, 1000) == 100
+
+def test_SendFileRange(tmp_path):
+    src = tmp_path / 'src.ts'
+    src.write_bytes(DATA)
+    with src.open('rb') as f1:
+        buffer = io.BytesIO()
+        assert SendFileRange(f1.fileno(), buffer, 5, 70000) == 70000
+        assert buffer.getvalue() == DATA[5:70005]
+
+        readFd, writeFd = os.pipe()
+        received = []
+        reader = threading.Thread(target=lambda: received.append(os.fdopen(readFd, 'rb').read()))
+        reader.start()
+        with os.fdopen(writeFd, 'wb') as pipe:
+            pipe.write(b'header')
+            SendFileRange(f1.fileno(), pipe, 188, 500000)
+        reader.join()
+        assert received[0] == b'header' + DATA[188:500188]
+
+def test_StreamRanges(tmp_path):
+    src = tmp_path / 'src.ts'
+    src.write_bytes(DATA)
+    ranges = [ (188 * 10, 5000), (0, 188), (len(DATA) - 100, 1000), (300000, 0) ]
+    received = bytearray()
+    progress = []
+    with src.open('rb') as f:
+        # past the end of the file only what is there is copied
+        assert StreamRanges(f.fileno(), ranges, received.extend, onProgress=progress.append, bufsize=4096, depth=2) == 5000 + 188 + 100
+    assert received == DATA[1880:6880] + DATA[:188] + DATA[-100:]
+    assert sum(progress) == len(received)
+
+    # a consumer that goes away stops the read-ahead thread
+    def Write(data):
+        raise BrokenPipeError()
+    with src.open('rb') as f:
+        with pytest.raises(BrokenPipeError):
+            StreamRanges(f.fileno(), [ (0, len(DATA)) ], Write, bufsize=4096, depth=2)
+    assert threading.active_count() == 1
@@ -0,0 +1,53 @@
+from tscutter.integrity import DamageMap, DamagedRegion, ScanIntegrity
+from tscutter.mpegts import TS_PACKET_SIZE
+from tests.test_mpegts import AUDIO_PID, VIDEO_PID, _Packet, _WriteTs
+
+PCR_PID = 0x1ff
+
+def _PcrPacket(pcr, cc):
+    base = pcr * 90000 // 1000
+    adaptation = bytes([ 7, 0x10, base >> 25 & 0xff, base >> 17 & 0xff, base >> 9 & 0xff, base >> 1 & 0xff, (base & 1) << 7 | 0x7e, 0 ])
+    header = bytes([ 0x47, PCR_PID >> 8, PCR_PID & 0xff, 0x20 | cc ])
+    return (header + adaptation).ljust(TS_PACKET_SIZE, b'\xff')
+
+def _WriteDamagedTs(path, seconds=60):
+    """One PCR every 50 ms, each followed by 40 video packets."""
+    packets = []
+    for i in range(seconds * 20):
+        packets.append(_PcrPacket(i * 50, 0))
+        packets += [ _Packet(VIDEO_PID, b'\x00' * 184, cc=(40 * i + k) % 16) for k in range(40) ]
+    # a lost packet at 10 s, TEI at 30 s
+    del packets[200 * 41 + 5]
+    packets[600 * 41 + 3] = bytes([ 0x47, 0x80 | VIDEO_PID >> 8 ]) + packets[600 * 41 + 3][2:]
+    data = b''.join(packets)
+    # 100 bytes lost at 45 s
+    cut = 900 * 41 * TS_PACKET_SIZE + 50
+    path.write_bytes(data[:cut] + data[cut + 100:])
+
+def test_ScanIntegrity_Clean(tmp_path):
+    path = tmp_path / 'clean.ts'
+    _WriteTs(path, [ (90000 + i * 3003, 'I') for i in range(100) ])
+    damageMap = ScanIntegrity(path)
+    assert len(damageMap) == 0
+    assert damageMap.pids[VIDEO_PID] == { 'packets': 200, 'tei': 0, 'cc': 0 }
+    assert damageMap.pids[AUDIO_PID]['packets'] == 100
+
+def test_ScanIntegrity_Damaged(tmp_path):
+    path = tmp_path / 'damaged.ts'
+    _WriteDamagedTs(path)
+    damageMap = ScanIntegrity(path, chunkPackets=1000)
+    assert damageMap.pcrPid == PCR_PID
+    assert [ (round(region.ss), region.counts) for region in damageMap.regions ] == [
+        (10, { 'sync': 0, 'tei': 0, 'cc': 1, 'pcr': 0 }),
+        # the packet behind the one with TEI set is out of sequence too
+        (30, { 'sync': 0, 'tei': 1, 'cc': 1, 'pcr': 0 }),
+        (45, { 'sync': 1, 'tei': 0, 'cc': 0, 'pcr': 0 }),
+    ]
+    assert damageMap.ToDict()['cc'] == 2
+
+def test_DamageMap_Narrow():
+    damageMap = DamageMap([ DamagedRegion(0, 0, 10.0, 10.5, {}) ], 0, 0, {})
+    kept, skipped = damageMap.Narrow([ [ 2000, 3000 ], [ 9000, 14000 ], [ 10000, 10800 ] ], splitPosShift=1)
+    # the window of the second one has to end before 9.5 s or start after 11 s
+    assert kept == [ [ 2000, 3000 ], [ 12000, 14000 ] ]
+    assert skipped == [ [ 10000, 10800 ] ]
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from tscutter.metrics import MetricEngine
+
+def _Frames(count=150, shape=(12, 16, 3)):
+    rng = np.random.default_rng(1)
+    return rng.integers(0, 256, size=(count,) + shape, dtype=np.uint8)
+
+def test_MetricEngine_Sad():
+    frames = _Frames()
+    engine = MetricEngine(frames.shape[1:])
+    for frame in frames:
+        engine.Add(frame)
+    sads = engine.Results()['sad']
+    images = frames / 255.0
+    expected = [ 0.0 ] + [ np.sum(np.abs(images[i] - images[i - 1])) / images[i].size for i in range(1, len(images)) ]
+    assert np.allclose(sads, expected)
+
+def test_MetricEngine_Chunks():
+    frames = _Frames()
+    metrics = ('sad', 'luma_sad', 'hist')
+    results = []
+    for chunkFrames, step in ((64, 1), (7, 10), (200, 150)):
+        engine = MetricEngine(frames.shape[1:], metrics=metrics, chunkFrames=chunkFrames)
+        for i in range(0, len(frames), step):
+            engine.Add(frames[i:i + step])
+        results.append(engine.Results())
+    for result in results[1:]:
+        for name in metrics:
+            assert np.array_equal(result[name], results[0][name])
+    assert all(len(values) == len(frames) for values in results[0].values())
+
+def test_MetricEngine_Hist():
+    black, white = np.zeros((4, 4, 3), dtype=np.uint8), np.full((4, 4, 3), 255, dtype=np.uint8)
+    half = black.copy()
+    half[:2] = 255
+    engine = MetricEngine(black.shape, metrics=('hist', 'luma_sad'))
+    engine.Add(np.stack((black, black, white, half)))
+    results = engine.Results()
+    assert results['hist'].tolist() == [ 0.0, 0.0, 1.0, 0.5 ]
+    assert results['luma_sad'].tolist() == [ 0.0, 0.0, 1.0, 0.5 ]
+    with pytest.raises(ValueError):
+        MetricEngine(black.shape, metrics=('ssim',))
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from tscutter.mpegts import BuildPesIndex, OpenPackets, PacketView, ReadProgramMap, PesIndex, TS_PACKET_SIZE
+
+VIDEO_PID, AUDIO_PID, PMT_PID = 0x111, 0x112, 0x100
+
+def _Packet(pid, payload, pusi=False, cc=0, rai=False):
+    header = bytes([ 0x47, (0x40 if pusi else 0) | pid >> 8, pid & 0xff ])
+    if rai:
+        adaptation = bytes([ 1, 0x40 ])
+        packet = header + bytes([ 0x30 | cc ]) + adaptation + payload
+    else:
+        packet = header + bytes([ 0x10 | cc ]) + payload
+    return packet[:TS_PACKET_SIZE].ljust(TS_PACKET_SIZE, b'\xff')
+
+def _Section(tableId, body):
+    length = len(body) + 4
+    return bytes([ 0, tableId, 0xb0 | length >> 8, length & 0xff ]) + body + b'\x00' * 4
+
+def _Pts(pts):
+    return bytes([ 0x21 | (pts >> 29) & 0x0e, pts >> 22 & 0xff, 0x01 | (pts >> 14) & 0xfe, pts >> 7 & 0xff, 0x01 | (pts << 1) & 0xfe ])
+
+def _Pes(streamId, pts, es):
+    return bytes([ 0, 0, 1, streamId, 0, 0, 0x80, 0x80, 5 ]) + _Pts(pts) + es
+
+def _WriteTs(path, frames):
+    pat = _Packet(0, _Section(0x00, bytes([ 0, 1, 0xc1, 0, 0, 0, 1, 0xe0 | PMT_PID >> 8, PMT_PID & 0xff ])), pusi=True)
+    pmt = _Packet(PMT_PID, _Section(0x02, bytes([ 0, 1, 0xc1, 0, 0, 0xe0 | VIDEO_PID >> 8, VIDEO_PID & 0xff, 0xf0, 0,
+                                                  0x02, 0xe0 | VIDEO_PID >> 8, VIDEO_PID & 0xff, 0xf0, 0,
+                                                  0x0f, 0xe0 | AUDIO_PID >> 8, AUDIO_PID & 0xff, 0xf0, 0 ])), pusi=True)
+    data = pat + pmt
+    for i, (pts, frameType) in enumerate(frames):
+        es = b'\x00\x00\x01\xb3' if frameType == 'I' else b'\x00\x00\x01\x00'
+        data += _Packet(AUDIO_PID, _Pes(0xc0, pts - 3000, b''), pusi=True, cc=i % 16)
+        data += _Packet(VIDEO_PID, _Pes(0xe0, pts, es), pusi=True, cc=(2 * i) % 16)
+        data += _Packet(VIDEO_PID, b'\x00' * 184, cc=(2 * i + 1) % 16)
+    path.write_bytes(data)
+    return data
+
+def test_ReadProgramMap(tmp_path):
+    path = tmp_path / 'test.ts'
+    _WriteTs(path, [ (90000, 'I') ])
+    mm, offset, count = OpenPackets(path)
+    programMap = ReadProgramMap(PacketView(mm, offset, 0, count))
+    assert programMap.serviceId == 1
+    assert programMap.VideoPid() == VIDEO_PID
+    assert programMap.AudioPids() == [ AUDIO_PID ]
+
+def test_PesIndex(tmp_path):
+    path = tmp_path / 'test.ts'
+    # decode order I P B B P B B with PTS in display order
+    frames = [ (93003, 'I'), (102012, 'P'), (96006, 'B'), (99009, 'B'), (111021, 'P'), (105015, 'B'), (108018, 'B') ]
+    _WriteTs(path, frames)
+    index = BuildPesIndex(path)
+    assert index.pid == VIDEO_PID
+    assert index.startPts == 90003
+    assert list(index.entries['pts']) == sorted(pts for pts, _ in frames)
+    # each frame is 3 packets after the previous one, behind PAT, PMT and the audio packet
+    assert index.PosAt(102012) == (2 + 3 * 1 + 1) * TS_PACKET_SIZE
+    assert index.PosAt(102013) == -1
+    assert index.RandomAccessBefore(108018) == (93003, 3 * TS_PACKET_SIZE)
+    assert int(index.entries['rap'].sum()) == 1
+
+    sidecar = tmp_path / 'test.pesindex'
+    index.Save(sidecar)
+    loaded = PesIndex.Load(sidecar)
+    assert np.array_equal(loaded.entries, index.entries)
+    assert loaded.IsUpToDate(path)
+
+def test_PesIndex_PartialPacket(tmp_path):
+    path = tmp_path / 'test.ts'
+    frames = [ (93003 + i * 3003, 'I' if i % 15 == 0 else 'P') for i in range(200) ]
+    data = _WriteTs(path, frames)
+    # cut the middle of the second video packet of frame 99
+    cut = (2 + 3 * 99 + 2) * TS_PACKET_SIZE + 50
+    path.write_bytes(data[:cut] + data[cut + 88:])
+    index = BuildPesIndex(path)
+    assert len(index) == 200
+    assert index.PosAt(frames[99][0]) == (2 + 3 * 99 + 1) * TS_PACKET_SIZE
+    assert index.PosAt(frames[100][0]) == (2 + 3 * 100 + 1) * TS_PACKET_SIZE - 88
+    assert index.PosAt(frames[199][0]) == (2 + 3 * 199 + 1) * TS_PACKET_SIZE - 88
+
+def test_PesIndex_OldSidecar(tmp_path):
+    path = tmp_path / 'test.ts'
+    _WriteTs(path, [ (93003, 'I') ])
+    index = BuildPesIndex(path)
+    sidecar = tmp_path / 'test.pesindex'
+    with sidecar.open('wb') as f:
+        np.savez(f, entries=index.entries, pid=index.pid, startPts=index.startPts, fileSize=index.fileSize, fileMtime=index.fileMtime)
+    with pytest.raises(ValueError):
+        PesIndex.Load(sidecar)
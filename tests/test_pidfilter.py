@@ -0,0 +1,93 @@
+import numpy as np
+from tscutter.mpegts import OpenPackets, PacketPids, PacketView, ReadProgramMap, ReadSection, TS_PACKET_SIZE
+from tscutter.pidfilter import PidFilter, _Crc32
+from tests.test_mpegts import AUDIO_PID, PMT_PID, VIDEO_PID, _Packet, _WriteTs
+
+EIT_PID = 0x12
+
+def _WriteBroadcastTs(path):
+    data = _WriteTs(path, [ (90000 + i * 3003, 'I') for i in range(50) ])
+    packets = [ data[i:i + TS_PACKET_SIZE] for i in range(0, len(data), TS_PACKET_SIZE) ]
+    # EPG packets in between, and a PAT and PMT every 10 packets
+    for i in range(len(packets) - 1, 0, -10):
+        packets[i:i] = [ _Packet(EIT_PID, b'\x00' * 184, cc=i % 16), packets[0], packets[1] ]
+    path.write_bytes(b''.join(packets))
+
+def _Filtered(path, pidFilter, chunkSize):
+    data = path.read_bytes()
+    chunks = []
+    writer = pidFilter.Writer(lambda packets: chunks.append(bytes(packets)))
+    for i in range(0, len(data), chunkSize):
+        writer(data[i:i + chunkSize])
+    return b''.join(chunks), writer.written
+
+def test_PidFilter(tmp_path):
+    path = tmp_path / 'in.ts'
+    _WriteBroadcastTs(path)
+    pidFilter = PidFilter.FromFile(path)
+    filtered, written = _Filtered(path, pidFilter, 1 << 20)
+    # chunks that cut packets in two give the same output
+    assert _Filtered(path, pidFilter, 1000) == (filtered, written)
+    assert written == len(filtered)
+    packets = np.frombuffer(filtered, dtype=np.uint8).reshape(-1, TS_PACKET_SIZE)
+    assert set(PacketPids(packets).tolist()) == { 0, PMT_PID, VIDEO_PID, AUDIO_PID }
+    pat = ReadSection(packets, 0, tableId=0x00)
+    assert _Crc32(pat) == 0
+    # the rewritten PAT packets count on
+    patRows = np.flatnonzero(PacketPids(packets) == 0)
+    assert (packets[patRows, 3] & 0x0f).tolist() == [ i % 16 for i in range(len(patRows)) ]
+
+def test_PidFilter_Pids(tmp_path):
+    path = tmp_path / 'in.ts'
+    _WriteBroadcastTs(path)
+    filtered, _ = _Filtered(path, PidFilter.FromFile(path, pids=[ VIDEO_PID ]), 1 << 20)
+    (tmp_path / 'out.ts').write_bytes(filtered)
+    mm, offset, count = OpenPackets(tmp_path / 'out.ts')
+    packets = PacketView(mm, offset, 0, count)
+    assert set(PacketPids(packets).tolist()) == { 0, PMT_PID, VIDEO_PID }
+    programMap = ReadProgramMap(packets)
+    assert programMap.streams == [ (0x02, VIDEO_PID) ]
+    assert _Crc32(ReadSection(packets, PMT_PID, tableId=0x02)) == 0
+    del packets
+    mm.close()
+
+    # the PCR is on the video PID, which is left out
+    filtered, _ = _Filtered(path, PidFilter.FromFile(path, pids=[ AUDIO_PID ]), 1 << 20)
+    packets = np.frombuffer(filtered, dtype=np.uint8).reshape(-1, TS_PACKET_SIZE)
+    assert set(PacketPids(packets).tolist()) == { 0, PMT_PID, AUDIO_PID }
+    assert ReadProgramMap(packets).streams == [ (0x0f, AUDIO_PID) ]
+
+def test_PidFilter_PcrOnly(tmp_path):
+    path = tmp_path / 'in.ts'
+    _WriteBroadcastTs(path)
+    data = path.read_bytes()
+    pcr = bytes([ 0, 0, 0x2b, 0xf2, 0x7e, 0 ])
+    pcrPacket = bytes([ 0x47, VIDEO_PID >> 8, VIDEO_PID & 0xff, 0x30, 7, 0x10 ]) + pcr + b'\x00\x00\x01\xe0' + bytes(172)
+    # a PCR on the video PID every 100 packets
+    path.write_bytes(b''.join(data[i:i + 100 * TS_PACKET_SIZE] + pcrPacket for i in range(0, len(data), 100 * TS_PACKET_SIZE)))
+    filtered, _ = _Filtered(path, PidFilter.FromFile(path, pids=[ AUDIO_PID ]), 1 << 20)
+    packets = np.frombuffer(filtered, dtype=np.uint8).reshape(-1, TS_PACKET_SIZE)
+    rows = packets[PacketPids(packets) == VIDEO_PID]
+    assert len(rows) == -(-len(data) // (100 * TS_PACKET_SIZE))
+    # only the adaptation field with the PCR is left
+    assert np.all(rows[:, 3] & 0x30 == 0x20)
+    assert np.all(rows[:, 4] == TS_PACKET_SIZE - 5)
+    assert all(row[6:12].tobytes() == pcr and set(row[12:].tolist()) == { 0xff } for row in rows)
+
+def test_PtsMap_SplitVideo_PidFilter(tmp_path):
+    from tscutter.analyze import WritePtsMap
+    from tscutter.common import PtsMap
+    from tests.test_common import _PtsMapJson
+    path = tmp_path / 'in.ts'
+    _WriteBroadcastTs(path)
+    count = path.stat().st_size // TS_PACKET_SIZE
+    WritePtsMap(_PtsMapJson([ 0.0, 10.0, 20.0 ], [ 0, TS_PACKET_SIZE * (count // 2), TS_PACKET_SIZE * count ]), tmp_path / 'in.ptsmap')
+    ptsMap = PtsMap(tmp_path / 'in.ptsmap')
+    pidFilter = PidFilter.FromFile(path)
+    ptsMap.SplitVideo(path, tmp_path / 'clips', pidFilter=pidFilter)
+    clipBytes = [ (tmp_path / 'clips' / name).read_bytes() for name in sorted(p.name for p in (tmp_path / 'clips').iterdir()) ]
+    with (tmp_path / 'all.ts').open('wb') as f:
+        assert ptsMap.ExtractClipsPipe(path, ptsMap.Clips(), f, pidFilter=pidFilter) == (tmp_path / 'all.ts').stat().st_size
+    for data in clipBytes + [ (tmp_path / 'all.ts').read_bytes() ]:
+        packets = np.frombuffer(data, dtype=np.uint8).reshape(-1, TS_PACKET_SIZE)
+        assert EIT_PID not in PacketPids(packets)
@@ -0,0 +1,34 @@
+import io, json
+from tscutter._progress import Progress
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+def _Lines(stream):
+    return [ json.loads(line[len('PROGRESS:'):]) for line in stream.getvalue().splitlines() ]
+
+def test_Progress_Coalesces():
+    stream, clock = io.StringIO(), _Clock()
+    progress = Progress(use_protocol=True, rate=2, stream=stream, clock=clock)
+    progress.add_task('outer', 4, 'Outer')
+    progress.add_task('inner', 20, 'Inner', unit='s')
+    for frame in range(1, 19):
+        clock.now += 0.125
+        progress.update('inner', frame, frames=frame)
+    progress.done('inner')
+    progress.update('outer', 1)
+    progress.update('outer', 2)
+    progress.close()
+    lines = _Lines(stream)
+    assert lines[1]['parent'] == 'outer' and 'parent' not in lines[0]
+    updates = [ line for line in lines if line['task'] == 'inner' and 'n' in line ]
+    # 2 updates per second, and the last one held back until done
+    assert [ line['n'] for line in updates ] == [ 4, 8, 12, 16, 18 ]
+    assert updates[0]['frames_per_sec'] == 8 and updates[0]['eta'] == 2
+    assert lines[-3] == { 'task': 'inner', 'status': 'done' }
+    # the second one is held back, then flushed by close()
+    assert [ line['n'] for line in lines[-2:] ] == [ 1, 2 ]
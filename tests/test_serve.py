@@ -0,0 +1,40 @@
+import io, json, os
+from tscutter.analyze import WritePtsMap
+from tscutter.serve import ServeStdio, Worker
+from tests.test_common import _PtsMapJson
+
+def _Serve(worker, requests):
+    stdout = io.StringIO()
+    ServeStdio(worker, stdin=io.StringIO(''.join(json.dumps(request) + '\n' for request in requests)), stdout=stdout)
+    return { message['id']: message for message in map(json.loads, stdout.getvalue().splitlines()) }
+
+def test_ServeStdio(tmp_path):
+    indexPath = tmp_path / 'a.ptsmap'
+    WritePtsMap(_PtsMapJson([ 0.0, 100.0, 400.0 ], [ 188, 188 * 1000, 188 * 5000 ]), indexPath)
+    answers = _Serve(Worker(useCache=False), [
+        { 'id': 1, 'command': 'ping' },
+        { 'id': 2, 'command': 'list-clips', 'args': { 'index': str(indexPath) } },
+        { 'id': 3, 'command': 'select-clips', 'args': { 'index': str(indexPath), 'min-length': 150 } },
+        { 'id': 4, 'command': 'probe', 'args': { 'input': str(tmp_path / 'missing.ts') } },
+        { 'id': 5, 'command': 'list-clips', 'args': { 'index': str(indexPath), 'bogus': 1 } },
+        { 'id': 6, 'command': 'split' },
+        { 'id': 7, 'command': [ 1 ] },
+        { 'id': 8, 'command': 'ping' },
+    ])
+    assert answers[1]['result'] == 'pong'
+    assert answers[2]['result'] == [ [ 0.0, 100.0 ], [ 100.0, 400.0 ] ]
+    assert answers[3]['result'] == [ [ 100.0, 400.0 ] ]
+    assert [ answers[i]['error']['type'] for i in (4, 5, 6, 7) ] == [ 'TsFileNotFound', 'InvalidRequest', 'UnknownCommand', 'InvalidRequest' ]
+    # the worker is still there after a malformed request
+    assert answers[8]['result'] == 'pong'
+
+def test_Worker_ReloadsChangedIndex(tmp_path):
+    indexPath = tmp_path / 'a.ptsmap'
+    worker = Worker(useCache=False)
+    WritePtsMap(_PtsMapJson([ 0.0, 100.0 ], [ 188, 188 * 1000 ]), indexPath)
+    ptsMap = worker._PtsMap(indexPath)
+    assert worker._PtsMap(indexPath) is ptsMap
+    WritePtsMap(_PtsMapJson([ 0.0, 50.0, 100.0 ], [ 188, 188 * 500, 188 * 1000 ]), indexPath)
+    os.utime(indexPath, ns=(0, 1))
+    assert worker._PtsMap(indexPath).Clips() == [ (0.0, 50.0), (50.0, 100.0) ]
+    worker.Close()
@@ -0,0 +1,35 @@
+import json, subprocess, sys
+from tscutter._progress import Progress
+from tscutter.stats import Count, Install, Instrumented, ReapChild, Stats
+
+@Instrumented('Inner')
+def _Inner(frames):
+    Count(frames=frames)
+    with subprocess.Popen([ sys.executable, '-c', 'pass' ], stdout=subprocess.PIPE) as pipeObj:
+        pipeObj.stdout.read()
+        ReapChild(pipeObj)
+    return pipeObj.returncode
+
+@Instrumented('Outer')
+def _Outer():
+    return [ _Inner(10), _Inner(5) ]
+
+def test_Stats(tmp_path, capsys):
+    assert _Outer() == [ 0, 0 ]
+    stats = Stats(progress=Progress(use_protocol=True))
+    Install(stats)
+    try:
+        assert _Outer() == [ 0, 0 ]
+    finally:
+        Install(None)
+    report = stats.Report()
+    assert report['stages']['Outer']['calls'] == 1
+    assert report['stages']['Outer']['seconds'] >= report['stages']['Inner']['seconds']
+    # counters and children belong to the innermost stage
+    assert report['stages']['Outer']['frames'] == 0
+    assert report['stages']['Inner']['frames'] == 15
+    assert report['stages']['Inner']['children'] == 2
+    events = [ json.loads(line[len('PROGRESS:'):]) for line in capsys.readouterr().err.splitlines() ]
+    assert [ event['stage'] for event in events ] == [ 'Inner', 'Inner', 'Outer' ]
+    stats.Save(tmp_path / 'stats.json')
+    assert json.loads((tmp_path / 'stats.json').read_text())['stages']['Inner']['calls'] == 2
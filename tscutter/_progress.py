@@ -2,43 +2,135 @@
 
 Two modes:
   standalone: Rich Progress renders directly in terminal
-  --progress: emit PROGRESS JSON lines to stderr for parent orchestration
+  --progress: emit PROGRESS JSON lines to stderr (or --progress-fd) for parent orchestration
+
+In protocol mode, updates are coalesced to at most `rate` lines per second
+and task; the latest one is always sent before the task is done. Updates
+carry `rate` (units per second), `eta` (seconds) and, for byte tasks or
+updates counting `frames`, `bytes_per_sec` / `frames_per_sec`. A task added
+while another one is open in the same thread is its child (`parent`).
 """
 
-import json, sys
+import json, sys, threading, time
 from rich.progress import Progress as RichProgress
 
+DEFAULT_RATE = 5.0
+
+
+class _Task:
+    def __init__(self, total: float, unit: str, start: float):
+        self.total = total
+        self.unit = unit
+        self.start = start
+        self.last_emit = start
+        # latest (n, fields, time) held back by the rate limit
+        self.pending = None
+
 
 class Progress:
-    def __init__(self, use_protocol: bool = False):
+    def __init__(self, use_protocol: bool = False, rate: float = DEFAULT_RATE, stream=None, clock=time.monotonic):
         self.use_protocol = use_protocol
+        self.rate = rate
+        self.stream = stream
+        self._clock = clock
         self._rich: RichProgress | None = None
         self._tasks: dict[str, int] = {}
+        self._state: dict[str, _Task] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
         if not use_protocol:
             self._rich = RichProgress().__enter__()
 
-    def add_task(self, task_id: str, total: float, desc: str, unit: str = "it"):
+    def _open_tasks(self) -> list:
+        if not hasattr(self._local, "tasks"):
+            self._local.tasks = []
+        return self._local.tasks
+
+    def add_task(self, task_id: str, total: float, desc: str, unit: str = "it", parent: str | None = None):
         if self.use_protocol:
-            self._emit({"task": task_id, "total": total, "desc": desc, "unit": unit})
+            data = {"task": task_id, "total": total, "desc": desc, "unit": unit}
+            with self._lock:
+                opened = self._open_tasks()
+                opened[:] = [t for t in opened if t in self._state and t != task_id]
+                if parent is None and opened:
+                    parent = opened[-1]
+                opened.append(task_id)
+                self._state[task_id] = _Task(total, unit, self._clock())
+            if parent is not None:
+                data["parent"] = parent
+            self._emit(data)
         elif self._rich is not None:
             self._tasks[task_id] = self._rich.add_task(desc, total=total)
 
-    def update(self, task_id: str, n: float):
+    def update(self, task_id: str, n: float, **fields):
         if self.use_protocol:
-            self._emit({"task": task_id, "n": n})
+            now = self._clock()
+            with self._lock:
+                task = self._state.get(task_id)
+                if task is not None and self.rate and now - task.last_emit < 1 / self.rate:
+                    task.pending = (n, fields, now)
+                    return
+                if task is not None:
+                    task.last_emit, task.pending = now, None
+            self._emit(self._update_data(task_id, task, n, fields, now))
         elif self._rich is not None:
             self._rich.update(self._tasks[task_id], completed=n)
 
-    def done(self, task_id: str):
+    def done(self, task_id: str, status: str = "done", **fields):
         if self.use_protocol:
-            self._emit({"task": task_id, "status": "done"})
+            with self._lock:
+                task = self._state.pop(task_id, None)
+            if task is not None and task.pending is not None:
+                self._emit(self._update_data(task_id, task, *task.pending))
+            self._emit({"task": task_id, "status": status, **fields})
         elif self._rich is not None:
             self._rich.update(self._tasks[task_id], visible=False)
 
+    def event(self, kind: str, **fields):
+        if self.use_protocol:
+            self._emit({"event": kind, **fields})
+
+    def flush(self):
+        """Send the updates held back by the rate limit."""
+        with self._lock:
+            pending = [(task_id, task, task.pending) for task_id, task in self._state.items() if task.pending is not None]
+            for _, task, _ in pending:
+                task.pending = None
+        for task_id, task, (n, fields, now) in pending:
+            self._emit(self._update_data(task_id, task, n, fields, now))
+
     def close(self):
+        if self.use_protocol:
+            self.flush()
         if self._rich is not None:
             self._rich.__exit__(None, None, None)
 
+    def _update_data(self, task_id: str, task: _Task | None, n: float, fields: dict, now: float) -> dict:
+        data = {"task": task_id, "n": n}
+        elapsed = now - task.start if task is not None else 0
+        if elapsed > 0:
+            data["rate"] = round(n / elapsed, 3)
+            if task.unit == "B":
+                data["bytes_per_sec"] = round(n / elapsed)
+            if "frames" in fields:
+                data["frames_per_sec"] = round(fields["frames"] / elapsed, 2)
+            if task.total and n > 0:
+                data["eta"] = round(max(task.total - n, 0) * elapsed / n, 1)
+        data.update(fields)
+        return data
+
+    def _emit(self, data: dict):
+        stream = sys.stderr if self.stream is None else self.stream
+        with self._write_lock:
+            stream.write(f"PROGRESS:{json.dumps(data)}\n")
+            stream.flush()
+
+
+class SilentProgress(Progress):
+    """Progress that reports nothing, for callers that require one."""
+    def __init__(self):
+        super().__init__(use_protocol=True)
+
     def _emit(self, data: dict):
-        sys.stderr.write(f"PROGRESS:{json.dumps(data)}\n")
-        sys.stderr.flush()
+        pass
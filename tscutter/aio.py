@@ -0,0 +1,290 @@
+"""Asyncio counterparts of InputFile and AnalyzeVideo.
+
+AsyncInputFile starts ffprobe and ffmpeg with asyncio.create_subprocess_exec
+and parses their output without blocking the event loop, so that one
+orchestrator can probe, extract and analyze many files at once. Each child
+runs under the semaphore given as slots, which can be shared by all the files
+that count against the same limit. If the task awaiting a child is cancelled,
+the child is killed and reaped. The command lines and the parsing are those
+of InputFile.
+
+    slots = asyncio.Semaphore(8)
+    await asyncio.gather(*(AnalyzeVideo(AsyncInputFile(path, slots=slots), jobs=4) for path in paths))
+"""
+
+import asyncio, codecs, json, logging, re, subprocess
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from pathlib import Path
+import numpy as np
+from ._progress import Progress
+from .analyze import DefaultIndexPath, GeneratePtsMap, MergeIntervals, WritePtsMap, _NarrowToIntact, _PickCut, _ReportDamage
+from .audio import BlockLevels, SilenceDetector
+from .cache import Cache
+from .common import InvalidTsFormat
+from .envelope import Envelope, EnvelopePath
+from .ffmpeg import ERROR_LINES, InputFile, VideoInfo, _ErrorTail, _FrameSize, _IsComplete, _ParseProgressTime, _ParseShowInfo, _ProbeToVideoInfo, _StreamFolder, _Subsample, _TrimProps
+from .integrity import ScanIntegrity
+from .metrics import DEFAULT_METRIC, MetricEngine
+from .mpegts import LoadPesIndex
+from .stats import Count
+
+logger = logging.getLogger('tscutter.aio')
+
+# bytes read from a child's pipe at once
+READ_SIZE = 1 << 20
+
+@asynccontextmanager
+async def _Process(slots: asyncio.Semaphore | None, *args, **kwargs):
+    if slots is not None:
+        await slots.acquire()
+    try:
+        process = await asyncio.create_subprocess_exec(*(str(arg) for arg in args), stdin=subprocess.DEVNULL, **kwargs)
+        try:
+            yield process
+        finally:
+            if process.returncode is None:
+                # cancelled or failed while the child still runs
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+    finally:
+        if slots is not None:
+            slots.release()
+
+async def _Lines(stream):
+    """Lines of stream, ended by \\r as well as \\n for ffmpeg's stats line."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    rest = ''
+    while data := await stream.read(READ_SIZE):
+        lines = re.split('[\r\n]', rest + decoder.decode(data))
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    rest += decoder.decode(b'', final=True)
+    if rest:
+        yield rest
+
+class AsyncInputFile:
+    def __init__(self, path, cache: Cache | None = None, slots: asyncio.Semaphore | None = None, fastProbe=False) -> None:
+        self.inputFile = InputFile(path, cache=cache, fastProbe=fastProbe)
+        self.path = self.inputFile.path
+        self.slots = slots
+        self._probeLock = asyncio.Lock()
+
+    async def GetInfo(self) -> VideoInfo:
+        async with self._probeLock:
+            if self.inputFile._info is None:
+                info = await asyncio.to_thread(self.inputFile._CachedInfo)
+                if info is None:
+                    probed = await asyncio.to_thread(self.inputFile._FastProbe)
+                    if not _IsComplete(probed):
+                        args = [ self.inputFile.ffprobe, '-show_format', '-show_streams', '-show_programs', '-of', 'json', self.path ]
+                        async with _Process(self.slots, *args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+                            stdout, _ = await process.communicate()
+                        try:
+                            if process.returncode != 0:
+                                raise ValueError(f'ffprobe exited with {process.returncode}')
+                            probed = asdict(_ProbeToVideoInfo(json.loads(stdout))) | probed
+                        except (ValueError, KeyError, StopIteration):
+                            raise InvalidTsFormat(f'"{self.path.name}" is invalid!')
+                    info = VideoInfo(**probed)
+                # the blocking helpers that still call GetInfo() get it from there
+                await asyncio.to_thread(self.inputFile._SetInfo, info)
+        return self.inputFile._info
+
+    async def ExtractStream(self, output=None, ss=0, to=999999, videoTracks=None, audioTracks=None, toWav=False, progress: Progress | None = None):
+        info = await self.GetInfo()
+        output = await asyncio.to_thread(_StreamFolder, self.path, output)
+        args = self.inputFile._ExtractStreamArgs(output, ss, to, videoTracks, audioTracks, toWav, info)
+        total = min(to, info.duration) - ss
+        tid = "extract_streams"
+        if progress is not None:
+            progress.add_task(tid, total, "Extracting streams", unit="s")
+        async with _Process(self.slots, *args, stderr=subprocess.PIPE) as process:
+            async for line in _Lines(process.stderr):
+                time = _ParseProgressTime(line)
+                if time is not None and progress is not None:
+                    progress.update(tid, time)
+            await process.wait()
+        if progress is not None:
+            progress.update(tid, total)
+            progress.done(tid)
+
+    async def ReadAudio(self, ss=0, to=999999, track=0, sampleRate=48000, chunkSeconds=10, progress: Progress | None = None):
+        """Async generator of the mono s16 samples, like InputFile.ReadAudio()."""
+        args = self.inputFile._ReadAudioArgs(ss, to, track, sampleRate)
+        chunkBytes = int(sampleRate * chunkSeconds) * 2
+        samplesRead = 0
+        # before taking a slot, ffprobe may need one
+        total = min(to, (await self.GetInfo()).duration) - ss
+        tid = "extract_streams"
+        if progress is not None:
+            progress.add_task(tid, total, "Extracting streams", unit="s")
+        errors = deque(maxlen=ERROR_LINES)
+        async with _Process(self.slots, *args, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+            async def ReadErrors():
+                async for line in _Lines(process.stderr):
+                    errors.append(line)
+            reader = asyncio.create_task(ReadErrors())
+            try:
+                while True:
+                    try:
+                        data = await process.stdout.readexactly(chunkBytes)
+                    except asyncio.IncompleteReadError as e:
+                        data = e.partial
+                    if not data:
+                        break
+                    samples = np.frombuffer(data[:len(data) // 2 * 2], dtype='<i2')
+                    samplesRead += len(samples)
+                    Count(pipeBytes=len(data))
+                    if progress is not None:
+                        progress.update(tid, min(samplesRead / sampleRate, total))
+                    yield samples
+                await reader
+                await process.wait()
+            finally:
+                reader.cancel()
+        if process.returncode != 0:
+            raise InvalidTsFormat(f'decoding the audio of "{self.path.name}" failed with exit code {process.returncode}: {_ErrorTail(errors)}')
+        if progress is not None:
+            progress.update(tid, total)
+            progress.done(tid)
+
+    async def ExtractFrameProps(self, ss, to, pesIndex=None, metric=DEFAULT_METRIC, progress: Progress | None = None):
+        """Like InputFile.ExtractFrameProps() through the rawvideo pipe, without the frame props cache."""
+        info = await self.GetInfo()
+        args = self.inputFile._FramePropsPipeArgs(ss, to, pesIndex)
+        # showinfo logs every frame before it is written to stdout
+        frameSizes = asyncio.Queue()
+        engine = None
+        pipeBytes = 0
+        propList = []
+
+        async def ReadFrames(stdout):
+            nonlocal engine, pipeBytes
+            sadSize, cancelled = None, False
+            try:
+                while (size := await frameSizes.get()) is not None:
+                    width, height = size
+                    try:
+                        data = await stdout.readexactly(width * height * 3)
+                    except asyncio.IncompleteReadError:
+                        break
+                    pipeBytes += len(data)
+                    frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+                    if sadSize is None:
+                        sadSize = round(height / 8), round(width / 8)
+                        engine = MetricEngine((sadSize[1], sadSize[0], 3), metrics=(metric,))
+                    engine.Add(_Subsample(frame, sadSize))
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                if not cancelled:
+                    # never leave ffmpeg blocked on a full stdout pipe
+                    while await stdout.read(READ_SIZE):
+                        pass
+
+        total = min(to, info.duration) - ss
+        tid = "extract_props"
+        if progress is not None:
+            progress.add_task(tid, total, "Extracting frame props", unit="s")
+        async with _Process(self.slots, *args, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+            reader = asyncio.create_task(ReadFrames(process.stdout))
+            try:
+                async for line in _Lines(process.stderr):
+                    if 'pts_time:' in line:
+                        prop = _ParseShowInfo(line, ss, pesIndex)
+                        propList.append(prop)
+                        frameSizes.put_nowait(_FrameSize(line))
+                        if progress is not None:
+                            progress.update(tid, prop['ptsTime'] - ss, frames=len(propList))
+            except BaseException:
+                reader.cancel()
+                raise
+            frameSizes.put_nowait(None)
+            await reader
+            await process.wait()
+        if progress is not None:
+            progress.update(tid, total)
+            progress.done(tid)
+        Count(pipeBytes=pipeBytes, frames=len(propList))
+        sadList = [] if engine is None else engine.Results()[metric].tolist()
+        return _TrimProps(propList, sadList, ss, min(to, info.duration))
+
+async def DetectSilence(inputFile: AsyncInputFile, ss=0, to=999999, min_silence_len=800, silence_thresh=-80, sampleRate=48000, withLevels=False, progress=None):
+    """Like audio.DetectSilence() with a single decoder."""
+    detector = SilenceDetector(sampleRate=sampleRate, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
+    blockLevels = BlockLevels(sampleRate, detector.seekStep) if withLevels else None
+    periods = []
+    async for samples in inputFile.ReadAudio(ss=ss, to=to, sampleRate=sampleRate, progress=progress):
+        periods += detector.Feed(samples)
+        if blockLevels is not None:
+            blockLevels.Feed(samples)
+    periods += detector.Flush()
+    levels = blockLevels.Levels() if blockLevels is not None else None
+    return (periods, levels) if withLevels else periods
+
+async def FindSplitPosition(inputFile: AsyncInputFile, ss, to, splitPosShift=1, pesIndex=None, metric=DEFAULT_METRIC):
+    propList = await inputFile.ExtractFrameProps(max(ss - splitPosShift, 0), to + splitPosShift, pesIndex=pesIndex, metric=metric)
+    if not propList:
+        return None, None, None # ffmpeg error
+    return _PickCut(propList, ss, to)
+
+async def AnalyzeVideo(inputFile: AsyncInputFile, indexPath=None, outputFolder=None, minSilenceLen=800, silenceThresh=-80, splitPosShift=1, jobs=1, usePesIndex=False, binaryIndex=False, metric=DEFAULT_METRIC, saveEnvelope=True, scan=False, progress: Progress | None = None) -> Path:
+    """Like analyze.AnalyzeVideo(), with the stages that do not depend on each other running at once.
+
+    The probe, the PES index, the integrity scan and the silence detection run concurrently, then
+    up to jobs cut position searches. inputFile.slots caps the ffmpeg
+    processes across every file sharing it.
+    """
+    if progress is None:
+        progress = Progress()
+    if indexPath is None:
+        indexPath = DefaultIndexPath(inputFile.path, outputFolder)
+    await asyncio.to_thread(indexPath.parent.mkdir, parents=True, exist_ok=True)
+
+    async def LoadIndex():
+        # exact frame byte positions for ffmpeg builds whose showinfo has no pos
+        return await asyncio.to_thread(LoadPesIndex, inputFile.path, indexPath.with_suffix('.pesindex')) if usePesIndex else None
+    async with asyncio.TaskGroup() as group:
+        group.create_task(inputFile.GetInfo())
+        pesIndexTask = group.create_task(LoadIndex())
+        damageTask = group.create_task(asyncio.to_thread(ScanIntegrity, inputFile.path, progress=progress)) if scan else None
+        silenceTask = group.create_task(DetectSilence(inputFile, min_silence_len=minSilenceLen, silence_thresh=silenceThresh, withLevels=saveEnvelope, progress=progress))
+    pesIndex = pesIndexTask.result()
+    periods, levels = silenceTask.result() if saveEnvelope else (silenceTask.result(), None)
+    if levels is not None:
+        await asyncio.to_thread(lambda: Envelope.FromLevels(levels, inputFile.path).Save(EnvelopePath(indexPath)))
+
+    mergedIntervals = MergeIntervals(periods)
+    if damageTask is not None:
+        damageMap = damageTask.result()
+        _ReportDamage(damageMap, progress)
+        mergedIntervals = _NarrowToIntact(damageMap, mergedIntervals, splitPosShift)
+    tid = "cut_position"
+    progress.add_task(tid, len(mergedIntervals), "Finding cut positions")
+    searches = asyncio.Semaphore(jobs)
+    finished = 0
+    async def Search(interval):
+        nonlocal finished
+        async with searches:
+            result = await FindSplitPosition(inputFile, interval[0] / 1000, interval[1] / 1000, splitPosShift, pesIndex=pesIndex, metric=metric)
+        finished += 1
+        progress.update(tid, finished)
+        return result
+    async with asyncio.TaskGroup() as group:
+        tasks = [ group.create_task(Search(interval)) for interval in mergedIntervals ]
+    progress.done(tid)
+    cutLocations = []
+    for prevEnd, sceneChange, nextStart in (task.result() for task in tasks):
+        if prevEnd is not None and sceneChange is not None and nextStart is not None:
+            cutLocations.append([ prevEnd, sceneChange, nextStart ])
+
+    ptsMap = GeneratePtsMap(inputFile=inputFile.inputFile, cutLocations=cutLocations)
+    await asyncio.to_thread(WritePtsMap, ptsMap, indexPath, binary=binaryIndex)
+    return indexPath
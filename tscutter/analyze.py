@@ -1,16 +1,35 @@
-import json, sys
+import json, os, socket, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import logging
 import click
+from rich.console import Console
 from rich.logging import RichHandler
-from ._progress import Progress
-from .audio import DetectSilence
-from .common import FormatTimestamp, PtsMap, TsFileNotFound, InvalidTsFormat
+from ._progress import DEFAULT_RATE, Progress
+from .audio import BlockLevels, DetectSilence, DetectSilenceFromLevels, IterSilence
+from .envelope import DetectSilenceFromEnvelope, Envelope, EnvelopePath, SweepSilence
+from .common import EncodingError, FormatTimestamp, InvalidIndexFormat, PtsMap, PtsMapToTable, SaveBinaryPtsMap, TsFileNotFound, InvalidTsFormat
 from . import __version__
 from .ffmpeg import InputFile
+from .integrity import ScanIntegrity
+from .metrics import DEFAULT_METRIC, METRICS
+from .mpegts import LoadPesIndex
+from .cache import IN_USE_SECONDS, Cache
+from .stats import Count, Install, Instrumented, Profiled, Stats
 
 logger = logging.getLogger('tscutter.analyze')
 
+# seconds behind the end of a growing recording that are not analyzed yet
+FOLLOW_SAFETY_MARGIN = 5
+# seconds searched again for silence at the start of each follow round
+FOLLOW_OVERLAP = 5
+# GOPs decoded at full rate by the coarse search, besides the partial ones at both ends
+COARSE_CANDIDATES = 2
+# seconds decoded before a key frame so that it gets its sad
+COARSE_LEAD_IN = 0.1
+# a search decoding more than this share of the window at full rate anyway is done exhaustively
+COARSE_MAX_SHARE = 0.5
+
 def MergeIntervals(intervals):
     if len(intervals) == 0 or len(intervals) == 1:
         return intervals
@@ -23,11 +42,11 @@ def MergeIntervals(intervals):
             result.append(interval)
     return result
 
-def FindSplitPosition(inputFile: InputFile, ss, to, splitPosShift=1, progress=None):
-    propList = inputFile.ExtractFrameProps(((ss-splitPosShift) if (ss-splitPosShift) > 0 else 0), to+splitPosShift, progress=progress)
-    if not propList:
-        return None, None, None # ffmpeg error
-    
+def SliceFrameTable(frameTable, ss, to):
+    rows = frameTable[(frameTable['ptsTime'] >= ss) & (frameTable['ptsTime'] <= to) & (frameTable['pos'] >= 0)]
+    return [ dict(zip(rows.dtype.names, row)) for row in rows.tolist() ]
+
+def _PickCut(propList, ss, to):
     # sceneChange should be found between [ {interval start}, {internval end} ]
     sceneChange = None
     for prop in propList:
@@ -53,18 +72,159 @@ def FindSplitPosition(inputFile: InputFile, ss, to, splitPosShift=1, progress=No
         nextStart = sceneChange
     return prevEnd, sceneChange, nextStart
 
-def LookingForCutLocations(inputFile: InputFile, intervals, splitPosShift, progress: Progress):
+def _CoarseWindows(keyFrames, ss, to, windowSs, windowTo):
+    """Time ranges to decode at full rate: the GOPs whose key frame changed most, and the partial GOPs at both ends.
+
+    Each range is [start, end, first], first being the earliest frame that needs its sad.
+    """
+    pts = [ prop['ptsTime'] for prop in keyFrames ]
+    def Window(first, last):
+        # from key frame first, decoding the GOP before it for its sad, to key frame last
+        end = windowTo if last >= len(pts) else min(windowTo, pts[last] + COARSE_LEAD_IN)
+        if first < 0:
+            return [ windowSs, end, windowSs ]
+        start = windowSs if first == 0 else max(windowSs, pts[first - 1] - COARSE_LEAD_IN)
+        return [ start, end, pts[first] ]
+    # GOP j is (pts[j-1], pts[j]], ranked by the sad of its key frame against the previous one
+    interior = [ j for j in range(1, len(pts)) if pts[j] >= ss and pts[j - 1] < to ]
+    interior.sort(key=lambda j: keyFrames[j]['sad'], reverse=True)
+    # key frames decoded without their neighbours can be a GOP off, and the I-frames around the cut are needed as well
+    windows = [ Window(j - 2, j + 1) for j in interior[:COARSE_CANDIDATES] ]
+    if pts[0] >= ss:
+        windows.append(Window(-1, 1))
+    if pts[-1] < to:
+        windows.append(Window(len(pts) - 2, len(pts)))
+    windows.sort()
+    merged = [ windows[0] ]
+    for window in windows[1:]:
+        if window[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], window[1])
+            merged[-1][2] = min(merged[-1][2], window[2])
+        else:
+            merged.append(window)
+    return merged
+
+def _CoarseFrameProps(inputFile: InputFile, ss, to, windowSs, windowTo, progress=None, pesIndex=None, metric=DEFAULT_METRIC):
+    """Frames of the decoded range holding the largest sad in [ss, to], or None to search exhaustively."""
+    keyFrames = inputFile.ExtractKeyFrameProps(windowSs, windowTo, pesIndex=pesIndex, metric=metric, progress=progress)
+    if len(keyFrames) < 2:
+        return None
+    windows = _CoarseWindows(keyFrames, ss, to, windowSs, windowTo)
+    if sum(end - start for start, end, _ in windows) > COARSE_MAX_SHARE * (windowTo - windowSs):
+        return None
+    gop = (keyFrames[-1]['ptsTime'] - keyFrames[0]['ptsTime']) / (len(keyFrames) - 1)
+    best, bestProps = None, None
+    for start, end, first in windows:
+        step = gop
+        while True:
+            props = inputFile.ExtractFrameProps(start, end, pesIndex=pesIndex, metric=metric, progress=progress)
+            # seeking may land on a later key frame, go further back until the frame before first is decoded too
+            if start <= windowSs or (props and props[0]['ptsTime'] < first - 0.001):
+                break
+            start = max(windowSs, start - step)
+            step *= 2
+        if start > windowSs:
+            # the first frame has nothing to be compared with
+            props = props[1:]
+        for prop in props:
+            if ss <= prop['ptsTime'] <= to and (best is None or prop['sad'] > best['sad']):
+                best, bestProps = prop, props
+    return bestProps
+
+@Instrumented('FindSplitPosition')
+def FindSplitPosition(inputFile: InputFile, ss, to, splitPosShift=1, progress=None, frameTable=None, pesIndex=None, searchMode='exhaustive', metric=DEFAULT_METRIC):
+    windowSs, windowTo = ((ss-splitPosShift) if (ss-splitPosShift) > 0 else 0), to+splitPosShift
+    propList = None
+    if frameTable is not None:
+        propList = SliceFrameTable(frameTable, ss-splitPosShift, to+splitPosShift)
+    elif searchMode == 'coarse':
+        propList = _CoarseFrameProps(inputFile, ss, to, windowSs, windowTo, progress=progress, pesIndex=pesIndex, metric=metric)
+    if propList is None:
+        propList = inputFile.ExtractFrameProps(windowSs, windowTo, pesIndex=pesIndex, metric=metric, progress=progress)
+    if not propList:
+        return None, None, None # ffmpeg error
+    return _PickCut(propList, ss, to)
+
+def LookingForCutLocations(inputFile: InputFile, intervals, splitPosShift, progress: Progress, jobs=1, frameTable=None, pesIndex=None, searchMode='exhaustive', metric=DEFAULT_METRIC):
     locations = []
     tid = "cut_position"
     progress.add_task(tid, len(intervals), "Finding cut positions")
-    for i, interval in enumerate(intervals):
-        prevEnd, sceneChange, nextStart = FindSplitPosition(inputFile, interval[0] / 1000, interval[1] / 1000, splitPosShift, progress=progress)
+    if frameTable is not None:
+        results = []
+        for i, interval in enumerate(intervals):
+            results.append(FindSplitPosition(inputFile, interval[0] / 1000, interval[1] / 1000, splitPosShift, frameTable=frameTable))
+            progress.update(tid, i + 1)
+    elif jobs > 1:
+        # warm the probe cache before the workers share it
+        inputFile.GetInfo()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [ executor.submit(FindSplitPosition, inputFile, interval[0] / 1000, interval[1] / 1000, splitPosShift, pesIndex=pesIndex, searchMode=searchMode, metric=metric) for interval in intervals ]
+            for i, _ in enumerate(as_completed(futures)):
+                progress.update(tid, i + 1)
+            results = [ future.result() for future in futures ]
+    else:
+        results = []
+        for i, interval in enumerate(intervals):
+            results.append(FindSplitPosition(inputFile, interval[0] / 1000, interval[1] / 1000, splitPosShift, progress=progress, pesIndex=pesIndex, searchMode=searchMode, metric=metric))
+            progress.update(tid, i + 1)
+    for prevEnd, sceneChange, nextStart in results:
         if prevEnd is not None and sceneChange is not None and nextStart is not None:
             locations.append([prevEnd, sceneChange, nextStart])
-        progress.update(tid, i + 1)
     progress.done(tid)
     return locations
 
+def PipelinedCutLocations(inputFile: InputFile, minSilenceLen, silenceThresh, splitPosShift, progress: Progress, jobs=1, pesIndex=None, searchMode='exhaustive', metric=DEFAULT_METRIC, damageMap=None, blockLevels: BlockLevels | None = None):
+    """LookingForCutLocations() over the silences of the whole file, each searched as soon as the silence detection has made it final.
+
+    The audio is decoded by a single ffmpeg meanwhile, and fed to blockLevels as well when it is given.
+    """
+    tid = "cut_position"
+    # the number of intervals is only known at the end
+    progress.add_task(tid, None, "Finding cut positions")
+    futures = []
+    finished = 0
+    lock = threading.Lock()
+    def OnDone(future):
+        nonlocal finished
+        with lock:
+            finished += 1
+            progress.update(tid, finished, intervals=len(futures))
+
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        def Submit(intervals):
+            if damageMap is not None:
+                intervals = _NarrowToIntact(damageMap, intervals, splitPosShift)
+            for interval in intervals:
+                future = executor.submit(FindSplitPosition, inputFile, interval[0] / 1000, interval[1] / 1000, splitPosShift, pesIndex=pesIndex, searchMode=searchMode, metric=metric)
+                with lock:
+                    futures.append(future)
+                future.add_done_callback(OnDone)
+        # the periods of one detector never overlap, MergeIntervals() would leave them as they are
+        for period in IterSilence(inputFile, min_silence_len=minSilenceLen, silence_thresh=silenceThresh, blockLevels=blockLevels, progress=progress):
+            Submit([ period ])
+        results = [ future.result() for future in futures ]
+    except BaseException:
+        executor.shutdown(cancel_futures=True)
+        raise
+    executor.shutdown()
+    progress.done(tid)
+    return [ [ prevEnd, sceneChange, nextStart ] for prevEnd, sceneChange, nextStart in results if prevEnd is not None and sceneChange is not None and nextStart is not None ]
+
+def _ReportDamage(damageMap, progress: Progress):
+    for region in damageMap.regions:
+        where = f'{FormatTimestamp(region.ss)}-{FormatTimestamp(region.to)}' if region.ss is not None else f'bytes {region.start}-{region.end}'
+        logger.warning(f'Damaged packets at {where}: ' + ', '.join(f'{count} {kind}' for kind, count in region.counts.items() if count))
+    progress.event('damage', **damageMap.ToDict())
+
+def _NarrowToIntact(damageMap, intervals, splitPosShift):
+    narrowed, skipped = damageMap.Narrow(intervals, splitPosShift)
+    for interval in skipped:
+        logger.warning(f'Skipped the silence at {FormatTimestamp(interval[0] / 1000)}, it has no intact frames around it')
+    Count(narrowedSilences=sum(interval not in intervals for interval in narrowed), skippedSilences=len(skipped))
+    return narrowed
+
+@Instrumented('GeneratePtsMap')
 def GeneratePtsMap(inputFile: InputFile, cutLocations):
     duration = inputFile.GetInfo().duration
     fileSize = inputFile.path.stat().st_size
@@ -122,39 +282,166 @@ def GeneratePtsMap(inputFile: InputFile, cutLocations):
 
     return ptsmapDedup
 
-def AnalyzeVideo(inputFile: InputFile, indexPath=None, outputFolder=None, minSilenceLen=800, silenceThresh=-80, splitPosShift=1, progress: Progress | None = None):
+def DefaultIndexPath(videoPath: Path, outputFolder=None) -> Path:
+    outputFolder = videoPath.parent if outputFolder is None else Path(outputFolder)
+    return outputFolder / '_metadata' / (videoPath.stem + '.ptsmap')
+
+def WritePtsMap(ptsMap, indexPath: Path, binary=False):
+    # readers never see a half written index
+    tmpPath = indexPath.with_name(indexPath.name + '.tmp')
+    if binary:
+        with tmpPath.open('wb') as f:
+            SaveBinaryPtsMap(PtsMapToTable(ptsMap), f)
+    else:
+        with tmpPath.open('w') as f:
+            json.dump(ptsMap, f, indent=True)
+    os.replace(tmpPath, indexPath)
+
+def AnalyzeVideo(inputFile: InputFile, indexPath=None, outputFolder=None, minSilenceLen=800, silenceThresh=-80, splitPosShift=1, jobs=1, singlePass=False, usePesIndex=False, binaryIndex=False, searchMode='exhaustive', metric=DEFAULT_METRIC, saveEnvelope=True, envelope: Envelope | None = None, scan=False, pipeline=False, progress: Progress | None = None):
+    """Write the .ptsmap of inputFile, and its audio envelope next to it with saveEnvelope.
+
+    Given an envelope, silences are searched in it instead of the decoded audio.
+    With scan, cut positions are only searched where the packets are intact.
+    With pipeline, cut positions are searched while the silence detection is still running.
+    """
     if progress is None:
         progress = Progress()
     if indexPath is None:
-        if outputFolder is None:
-            outputFolder = inputFile.path.parent
-        else:
-            outputFolder = Path(outputFolder)
-        indexPath = outputFolder / '_metadata' / (inputFile.path.stem + '.ptsmap')
+        indexPath = DefaultIndexPath(inputFile.path, outputFolder)
     indexPath.parent.mkdir(parents=True, exist_ok=True)
 
-    separatorIntervals = DetectSilence(inputFile=inputFile, min_silence_len=minSilenceLen, silence_thresh=silenceThresh, progress=progress)
-    mergedIntervals = MergeIntervals(separatorIntervals)
-    cutLocations = LookingForCutLocations(inputFile=inputFile, intervals=mergedIntervals, splitPosShift=splitPosShift, progress=progress)
+    pesIndex = None
+    if usePesIndex:
+        # exact frame byte positions for ffmpeg builds whose showinfo has no pos
+        pesIndex = LoadPesIndex(inputFile.path, indexPath.with_suffix('.pesindex'))
+    damageMap = None
+    if scan:
+        damageMap = ScanIntegrity(inputFile.path, progress=progress)
+        _ReportDamage(damageMap, progress)
+    if singlePass and os.name == 'nt':
+        logger.warning('Single-pass analysis needs an extra pipe to ffmpeg which is not available on Windows, falling back to the default mode')
+        singlePass = False
+    levels, sampleRate, blockMs = None, 48000, 10
+    if pipeline and (envelope is not None or singlePass):
+        logger.warning('The silences are not searched by decoding the audio with an envelope or --single-pass, ignoring --pipeline')
+        pipeline = False
+    if pipeline:
+        blockLevels = BlockLevels(sampleRate, blockMs)
+        cutLocations = PipelinedCutLocations(inputFile=inputFile, minSilenceLen=minSilenceLen, silenceThresh=silenceThresh, splitPosShift=splitPosShift, progress=progress, jobs=jobs, pesIndex=pesIndex, searchMode=searchMode, metric=metric, damageMap=damageMap, blockLevels=blockLevels)
+        levels = blockLevels.Levels()
+    elif envelope is not None:
+        separatorIntervals = DetectSilenceFromEnvelope(envelope, min_silence_len=minSilenceLen, silence_thresh=silenceThresh)
+        frameTable = None
+    elif singlePass:
+        fileProps = inputFile.ExtractFileProps(pesIndex=pesIndex, metric=metric, progress=progress)
+        separatorIntervals = DetectSilenceFromLevels(fileProps.levels, sampleRate=fileProps.sampleRate, min_silence_len=minSilenceLen, silence_thresh=silenceThresh, blockMs=fileProps.blockMs)
+        frameTable = fileProps.frames
+        levels, sampleRate, blockMs = fileProps.levels, fileProps.sampleRate, fileProps.blockMs
+    else:
+        separatorIntervals, levels = DetectSilence(inputFile=inputFile, min_silence_len=minSilenceLen, silence_thresh=silenceThresh, sampleRate=sampleRate, jobs=jobs, withLevels=True, progress=progress)
+        frameTable = None
+    if saveEnvelope and levels is not None:
+        Envelope.FromLevels(levels, inputFile.path, sampleRate=sampleRate, blockMs=blockMs).Save(EnvelopePath(indexPath))
+    if not pipeline:
+        mergedIntervals = MergeIntervals(separatorIntervals)
+        if damageMap is not None:
+            mergedIntervals = _NarrowToIntact(damageMap, mergedIntervals, splitPosShift)
+        cutLocations = LookingForCutLocations(inputFile=inputFile, intervals=mergedIntervals, splitPosShift=splitPosShift, progress=progress, jobs=jobs, frameTable=frameTable, pesIndex=pesIndex, searchMode=searchMode, metric=metric)
     ptsMap = GeneratePtsMap(inputFile=inputFile, cutLocations=cutLocations)
 
-    with indexPath.open('w') as f:
-        json.dump(ptsMap, f, indent=True)
+    WritePtsMap(ptsMap, indexPath, binary=binaryIndex)
     return indexPath
 
+def FollowVideo(videoPath: Path, indexPath=None, outputFolder=None, minSilenceLen=800, silenceThresh=-80, splitPosShift=1, jobs=1, pollInterval=5, idleTimeout=60, endMarker=None, binaryIndex=False, searchMode='exhaustive', metric=DEFAULT_METRIC, progress: Progress | None = None):
+    """Analyze a recording while it is still being written.
+
+    Only the audio appended since the previous round is searched for silence.
+    The last safetyMargin seconds are left out until the recording ends, and so
+    is a silence that reaches the end of the searched range. The .ptsmap is
+    rewritten after each round. The recording is over once endMarker exists or
+    the file has not grown for idleTimeout seconds.
+    """
+    if progress is None:
+        progress = Progress()
+    videoPath = Path(videoPath)
+    if indexPath is None:
+        indexPath = DefaultIndexPath(videoPath, outputFolder)
+    indexPath.parent.mkdir(parents=True, exist_ok=True)
+    # frames up to splitPosShift after a silence have to be on disk already
+    safetyMargin = FOLLOW_SAFETY_MARGIN + splitPosShift
+    overlap = max(FOLLOW_OVERLAP, 2 * minSilenceLen / 1000)
+
+    cutLocations = []
+    segmentSs, confirmedTo = 0.0, 0
+    lastSize, lastGrowth = -1, time.monotonic()
+    while True:
+        size = videoPath.stat().st_size
+        if size != lastSize:
+            lastSize, lastGrowth = size, time.monotonic()
+        finished = (endMarker is not None and Path(endMarker).exists()) or time.monotonic() - lastGrowth >= idleTimeout
+        # probe again in every round, the duration grows
+        inputFile = InputFile(videoPath)
+        try:
+            duration = inputFile.GetInfo().duration
+        except (InvalidTsFormat, StopIteration):
+            if finished:
+                raise InvalidTsFormat(f'"{videoPath.name}" is invalid!')
+            time.sleep(pollInterval)
+            continue
+        segmentTo = duration if finished else duration - safetyMargin
+        if segmentTo - segmentSs > overlap:
+            intervals = DetectSilence(inputFile=inputFile, ss=segmentSs, to=segmentTo, min_silence_len=minSilenceLen, silence_thresh=silenceThresh, progress=progress)
+            intervals = [ [ start + round(segmentSs * 1000), end + round(segmentSs * 1000) ] for start, end in intervals ]
+            # a silence running into the end of the range may go on
+            tentative = [ interval for interval in intervals if not finished and interval[1] >= segmentTo * 1000 - 10 ]
+            confirmed = [ interval for interval in intervals if interval[0] >= confirmedTo and interval not in tentative ]
+            if confirmed:
+                cutLocations += LookingForCutLocations(inputFile=inputFile, intervals=MergeIntervals(confirmed), splitPosShift=splitPosShift, progress=progress, jobs=jobs, searchMode=searchMode, metric=metric)
+                confirmedTo = max(interval[1] for interval in confirmed)
+            segmentSs = tentative[0][0] / 1000 if tentative else max(segmentTo - overlap, confirmedTo / 1000)
+            logger.info(f'Followed "{videoPath.name}" up to {FormatTimestamp(segmentTo)}, {len(cutLocations)} cut positions')
+        WritePtsMap(GeneratePtsMap(inputFile=inputFile, cutLocations=cutLocations), indexPath, binary=binaryIndex)
+        if finished:
+            return indexPath
+        time.sleep(pollInterval)
+
+def ProbeResult(info) -> dict:
+    return {
+        'duration': info.duration,
+        'width': info.width,
+        'height': info.height,
+        'fps': info.fps,
+        'sar': list(info.sar),
+        'dar': list(info.dar),
+        'soundTracks': info.soundTracks,
+        'serviceId': info.serviceId,
+    }
+
 @click.group(context_settings={'help_option_names': ['-h', '--help']})
 @click.option('--quiet', '-q', is_flag=True, help='Suppress non-error output')
 @click.option('--progress', is_flag=True, help='Output PROGRESS JSON lines for pipeline orchestration')
+@click.option('--progress-fd', type=click.IntRange(min=0), help='Write PROGRESS JSON lines to this file descriptor instead of stderr (implies --progress)')
+@click.option('--progress-rate', type=click.FloatRange(min=0), default=DEFAULT_RATE, show_default=True, help='Maximum PROGRESS updates per second and task, 0 for all of them')
 @click.version_option(__version__, prog_name='tscutter', message='%(prog)s %(version)s')
 @click.pass_context
-def cli(ctx, quiet, progress):
+def cli(ctx, quiet, progress, progress_fd, progress_rate):
     """Cut TS files: split by silence and fine-tune by scene-change PTS analysis."""
     log_level = logging.WARNING if quiet else logging.INFO
+    # serve answers on stdout
+    console = Console(stderr=True) if ctx.invoked_subcommand == 'serve' else None
     logging.basicConfig(
         level=log_level, format='%(message)s', datefmt='[%X]',
-        handlers=[RichHandler(rich_tracebacks=True)])
+        handlers=[RichHandler(console=console, rich_tracebacks=True)])
     ctx.ensure_object(dict)
-    ctx.obj['progress'] = Progress(use_protocol=progress)
+    stream = None
+    if progress_fd is not None:
+        try:
+            stream = open(progress_fd, 'w', buffering=1, closefd=False)
+        except OSError as e:
+            raise click.BadParameter(str(e), param_hint='--progress-fd')
+    ctx.obj['progress'] = Progress(use_protocol=progress or stream is not None, rate=progress_rate, stream=stream)
+    # send the updates still held back by the rate limit
+    ctx.call_on_close(ctx.obj['progress'].flush)
 
 
 @cli.command()
@@ -163,42 +450,228 @@ def cli(ctx, quiet, progress):
 @click.option('--length', '-l', type=int, default=800, show_default=True, help='Minimal silence length in ms')
 @click.option('--threshold', '-t', type=int, default=-80, show_default=True, help='Silence threshold in dB')
 @click.option('--shift', '-s', type=float, default=1, show_default=True, help='Split position shift in seconds')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=1, show_default=True, help='Number of parallel cut position searches and silence detection decoders')
+@click.option('--single-pass', is_flag=True, help='Decode the file once and search cut positions in memory')
+@click.option('--pes-index', is_flag=True, help='Take frame byte positions from a TS index (.pesindex) instead of ffmpeg')
+@click.option('--no-cache', is_flag=True, help='Do not use the persistent frame props / probe cache')
+@click.option('--follow', is_flag=True, help='Analyze a recording that is still being written, updating the index as it grows')
+@click.option('--poll-interval', type=float, default=5, show_default=True, help='Seconds between checks of a followed recording')
+@click.option('--idle-timeout', type=float, default=60, show_default=True, help='Finish following once the file has not grown for this many seconds')
+@click.option('--end-marker', help='Finish following as soon as this file exists')
+@click.option('--binary', is_flag=True, help='Write a compact binary .ptsmap instead of JSON')
+@click.option('--search', type=click.Choice(['exhaustive', 'coarse']), default='exhaustive', show_default=True, help='Decode every frame around a silence, or key frames first and only the most likely GOPs at full rate')
+@click.option('--metric', type=click.Choice(list(METRICS)), default=DEFAULT_METRIC, show_default=True, help='Scene change metric between consecutive frames')
+@click.option('--scan', is_flag=True, help='Scan the packets for damage first and keep the cut position searches out of damaged regions')
+@click.option('--pipeline', is_flag=True, help='Search cut positions while the silence detection is still running, with a single audio decoder')
+@click.option('--no-envelope', is_flag=True, help='Do not keep the audio level envelope (.envelope) used by sweep next to the index')
+@click.option('--stats', 'stats_path', help='Write per-stage wall time, ffmpeg CPU time, I/O and memory as JSON to this file')
+@click.option('--profile', help='Profile the main thread into this file (pstats for cprofile, HTML for pyinstrument)')
+@click.option('--profiler', type=click.Choice(['cprofile', 'pyinstrument']), default='cprofile', show_default=True, help='Profiler used by --profile')
 @click.pass_context
-def analyze(ctx, input, output, length, threshold, shift):
+def analyze(ctx, input, output, length, threshold, shift, jobs, single_pass, pes_index, no_cache, follow, poll_interval, idle_timeout, end_marker, binary, search, metric, scan, pipeline, no_envelope, stats_path, profile, profiler):
     """Generate index file (.ptsmap) from mpegts file via silence detection + scene-change SAD."""
-    AnalyzeVideo(
-        inputFile=InputFile(input),
-        indexPath=Path(output) if output else None,
+    progress = ctx.obj['progress']
+    # with --progress the stage events go out on the protocol as well
+    stats = Stats(progress=progress) if stats_path or progress.use_protocol else None
+    Install(stats)
+    try:
+        with Profiled(profile, profiler=profiler):
+            if follow:
+                if single_pass or pes_index or scan or pipeline:
+                    logger.warning('--single-pass, --pes-index, --scan and --pipeline need the whole file and are ignored with --follow')
+                FollowVideo(
+                    videoPath=Path(input),
+                    indexPath=Path(output) if output else None,
+                    minSilenceLen=length,
+                    silenceThresh=threshold,
+                    splitPosShift=shift,
+                    jobs=jobs,
+                    pollInterval=poll_interval,
+                    idleTimeout=idle_timeout,
+                    endMarker=end_marker,
+                    binaryIndex=binary,
+                    searchMode=search,
+                    metric=metric,
+                    progress=progress,
+                )
+            else:
+                AnalyzeVideo(
+                    inputFile=InputFile(input, cache=None if no_cache else Cache()),
+                    indexPath=Path(output) if output else None,
+                    minSilenceLen=length,
+                    silenceThresh=threshold,
+                    splitPosShift=shift,
+                    jobs=jobs,
+                    singlePass=single_pass,
+                    usePesIndex=pes_index,
+                    binaryIndex=binary,
+                    searchMode=search,
+                    metric=metric,
+                    saveEnvelope=not no_envelope,
+                    scan=scan,
+                    pipeline=pipeline,
+                    progress=progress,
+                )
+    finally:
+        Install(None)
+        if stats is not None:
+            progress.event('stats', **stats.Report())
+            if stats_path:
+                stats.Save(stats_path)
+
+
+def _ParseGrid(ctx, param, value):
+    # "400,800,1200" or "start:stop:step", stop included
+    values = []
+    try:
+        for item in value.split(','):
+            if ':' in item:
+                start, stop, step = (int(field) for field in item.split(':'))
+                if step == 0:
+                    raise ValueError('step must not be 0')
+                values += list(range(start, stop + (1 if step > 0 else -1), step))
+            else:
+                values.append(int(item))
+    except ValueError as e:
+        raise click.BadParameter(f'{value!r}: {e}')
+    return values
+
+
+@cli.command()
+@click.option('--input', '-i', required=True, help='Input mpegts path')
+@click.option('--output', '-o', help='Index path (.ptsmap) whose envelope is read, and written with --apply')
+@click.option('--envelope', 'envelope_path', help='Envelope path (default: next to the index)')
+@click.option('--length', '-l', default='800', show_default=True, callback=_ParseGrid, help='Minimal silence lengths in ms, like 400,800 or 400:2000:200')
+@click.option('--threshold', '-t', default='-80', show_default=True, callback=_ParseGrid, help='Silence thresholds in dB, like -90,-80 or -90:-60:5')
+@click.option('--apply', is_flag=True, help='Search cut positions for the one length and threshold given and write the index')
+@click.option('--shift', '-s', type=float, default=1, show_default=True, help='Split position shift in seconds, with --apply')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=1, show_default=True, help='Number of parallel cut position searches, with --apply')
+@click.option('--pes-index', is_flag=True, help='Take frame byte positions from a TS index (.pesindex) instead of ffmpeg, with --apply')
+@click.option('--no-cache', is_flag=True, help='Do not use the persistent frame props / probe cache')
+@click.option('--binary', is_flag=True, help='Write a compact binary .ptsmap instead of JSON, with --apply')
+@click.option('--search', type=click.Choice(['exhaustive', 'coarse']), default='exhaustive', show_default=True, help='Cut position search, with --apply')
+@click.option('--metric', type=click.Choice(list(METRICS)), default=DEFAULT_METRIC, show_default=True, help='Scene change metric between consecutive frames, with --apply')
+@click.pass_context
+def sweep(ctx, input, output, envelope_path, length, threshold, apply, shift, jobs, pes_index, no_cache, binary, search, metric):
+    """Count silences for a grid of lengths and thresholds from the envelope saved by analyze."""
+    indexPath = Path(output) if output else DefaultIndexPath(Path(input))
+    envelopePath = Path(envelope_path) if envelope_path else EnvelopePath(indexPath)
+    try:
+        envelope = Envelope.Load(envelopePath)
+    except FileNotFoundError:
+        print(f'FileNotFoundError: {envelopePath}, run analyze first', file=sys.stderr)
+        sys.exit(1)
+    except (OSError, ValueError, KeyError):
+        print(f'InvalidEnvelopeFormat: {envelopePath}', file=sys.stderr)
+        sys.exit(2)
+    if Path(input).is_file() and not envelope.IsUpToDate(input):
+        logger.warning(f'"{Path(input).name}" changed since {envelopePath.name} was written')
+    if not apply:
+        print(json.dumps(SweepSilence(envelope, length, threshold)))
+        return
+    if len(length) != 1 or len(threshold) != 1:
+        raise click.UsageError('--apply needs a single --length and --threshold')
+    try:
+        AnalyzeVideo(
+            inputFile=InputFile(input, cache=None if no_cache else Cache()),
+            indexPath=indexPath,
+            minSilenceLen=length[0],
+            silenceThresh=threshold[0],
+            splitPosShift=shift,
+            jobs=jobs,
+            usePesIndex=pes_index,
+            binaryIndex=binary,
+            searchMode=search,
+            metric=metric,
+            envelope=envelope,
+            progress=ctx.obj['progress'],
+        )
+    except TsFileNotFound:
+        print(f'TsFileNotFound: "{input}" not found!', file=sys.stderr)
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument('inputs', nargs=-1, required=True)
+@click.option('--output-folder', '-o', help='Folder for _metadata/*.ptsmap (default: next to each input)')
+@click.option('--length', '-l', type=int, default=800, show_default=True, help='Minimal silence length in ms')
+@click.option('--threshold', '-t', type=int, default=-80, show_default=True, help='Silence threshold in dB')
+@click.option('--shift', '-s', type=float, default=1, show_default=True, help='Split position shift in seconds')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=1, show_default=True, help='Number of parallel cut position searches and silence detection decoders per file')
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=2, show_default=True, help='Number of files analyzed at once')
+@click.option('--ffmpeg-budget', type=click.IntRange(min=1), help='Maximum number of ffmpeg decoders across all workers (default: workers x jobs)')
+@click.option('--journal', help='Journal of finished files (default: .tscutter-batch.jsonl in the current folder)')
+@click.option('--force', is_flag=True, help='Analyze files even if their index is up to date')
+@click.option('--single-pass', is_flag=True, help='Decode each file once and search cut positions in memory')
+@click.option('--pes-index', is_flag=True, help='Take frame byte positions from a TS index (.pesindex) instead of ffmpeg')
+@click.option('--no-cache', is_flag=True, help='Do not use the persistent frame props / probe cache')
+@click.option('--binary', is_flag=True, help='Write compact binary .ptsmap files instead of JSON')
+@click.option('--search', type=click.Choice(['exhaustive', 'coarse']), default='exhaustive', show_default=True, help='Decode every frame around a silence, or key frames first and only the most likely GOPs at full rate')
+@click.option('--metric', type=click.Choice(list(METRICS)), default=DEFAULT_METRIC, show_default=True, help='Scene change metric between consecutive frames')
+@click.option('--scan', is_flag=True, help='Scan the packets of each file for damage first and keep the cut position searches out of damaged regions')
+@click.option('--pipeline', is_flag=True, help='Search cut positions while the silence detection is still running, with a single audio decoder per file')
+@click.pass_context
+def analyze_batch(ctx, inputs, output_folder, length, threshold, shift, jobs, workers, ffmpeg_budget, journal, force, single_pass, pes_index, no_cache, binary, search, metric, scan, pipeline):
+    """Analyze TS files, directories or glob patterns in a pool of worker processes."""
+    from .batch import AnalyzeBatch
+    results = AnalyzeBatch(
+        inputs=inputs,
+        outputFolder=output_folder,
+        journalPath=Path(journal) if journal else None,
+        workers=workers,
+        ffmpegBudget=ffmpeg_budget,
+        force=force,
+        useCache=not no_cache,
         minSilenceLen=length,
         silenceThresh=threshold,
         splitPosShift=shift,
+        jobs=jobs,
+        singlePass=single_pass,
+        usePesIndex=pes_index,
+        binaryIndex=binary,
+        searchMode=search,
+        metric=metric,
+        scan=scan,
+        pipeline=pipeline,
         progress=ctx.obj['progress'],
     )
+    if 'failed' in results.values():
+        sys.exit(1)
 
 
 @cli.command()
 @click.option('--input', '-i', required=True, help='Input mpegts path')
-def probe(input):
+@click.option('--no-cache', is_flag=True, help='Do not use the persistent probe cache')
+@click.option('--fast', is_flag=True, help='Read the PAT, PMT, PTS and sequence header at the head and tail of the file, running ffprobe only for what they do not tell')
+def probe(input, no_cache, fast):
     """Probe TS file and output VideoInfo JSON to stdout."""
     try:
-        info = InputFile(input).GetInfo()
+        info = InputFile(input, cache=None if no_cache else Cache(), fastProbe=fast).GetInfo()
     except TsFileNotFound:
         print(f'TsFileNotFound: "{input}" not found!', file=sys.stderr)
         sys.exit(1)
     except InvalidTsFormat:
         print(f'InvalidTsFormat: "{input}" is invalid!', file=sys.stderr)
         sys.exit(2)
-    print(json.dumps({
-        'duration': info.duration,
-        'width': info.width,
-        'height': info.height,
-        'fps': info.fps,
-        'sar': list(info.sar),
-        'dar': list(info.dar),
-        'soundTracks': info.soundTracks,
-        'serviceId': info.serviceId,
-    }))
+    print(json.dumps(ProbeResult(info)))
+
 
+@cli.command()
+@click.option('--input', '-i', required=True, help='Input mpegts path')
+@click.pass_context
+def scan(ctx, input):
+    """Check sync bytes, continuity counters, PCR gaps and TEI flags, and output the damaged regions as JSON."""
+    progress = ctx.obj['progress']
+    try:
+        # the Rich bar would end up in the JSON on stdout
+        damageMap = ScanIntegrity(Path(input), progress=progress if progress.use_protocol else None)
+    except TsFileNotFound:
+        print(f'TsFileNotFound: "{input}" not found!', file=sys.stderr)
+        sys.exit(1)
+    except InvalidTsFormat:
+        print(f'InvalidTsFormat: "{input}" is invalid!', file=sys.stderr)
+        sys.exit(2)
+    print(json.dumps(damageMap.ToDict()))
 
 @cli.command()
 @click.option('--index', '-x', required=True, help='Input index path (.ptsmap)')
@@ -209,7 +682,7 @@ def list_clips(index):
     except FileNotFoundError:
         print(f'FileNotFoundError: {index}', file=sys.stderr)
         sys.exit(1)
-    except (json.JSONDecodeError, KeyError):
+    except InvalidIndexFormat:
         print(f'InvalidIndexFormat: {index}', file=sys.stderr)
         sys.exit(2)
     print(json.dumps(ptsMap.Clips()))
@@ -225,13 +698,106 @@ def select_clips(index, min_length):
     except FileNotFoundError:
         print(f'FileNotFoundError: {index}', file=sys.stderr)
         sys.exit(1)
-    except (json.JSONDecodeError, KeyError):
+    except InvalidIndexFormat:
         print(f'InvalidIndexFormat: {index}', file=sys.stderr)
         sys.exit(2)
     selectedClips, _ = ptsMap.SelectClips(lengthLimit=min_length)
     print(json.dumps(selectedClips))
 
 
+@cli.command()
+@click.option('--input', '-i', required=True, help='Input mpegts path')
+@click.option('--index', '-x', required=True, help='Input index path (.ptsmap)')
+@click.option('--output', '-o', required=True, help='Output mpegts path')
+@click.option('--clips', help='Clips to join as JSON, like the output of list-clips (default: select-clips)')
+@click.option('--min-length', type=float, default=150, show_default=True, help='Minimum clip length in seconds when selecting clips')
+@click.option('--pid', 'pids', multiple=True, type=lambda value: int(value, 0), help='Stream PID to keep, repeatable (default: every stream of the PMT)')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=2, show_default=True, help='Number of clips remuxed at once')
+@click.pass_context
+def concat(ctx, input, index, output, clips, min_length, pids, jobs):
+    """Join clips into one TS with continuous timestamps."""
+    from .concat import ConcatClips
+    try:
+        ptsMap = PtsMap(Path(index))
+    except FileNotFoundError:
+        print(f'FileNotFoundError: {index}', file=sys.stderr)
+        sys.exit(1)
+    except InvalidIndexFormat:
+        print(f'InvalidIndexFormat: {index}', file=sys.stderr)
+        sys.exit(2)
+    if clips is None:
+        selectedClips, _ = ptsMap.SelectClips(lengthLimit=min_length)
+    else:
+        try:
+            selectedClips = [ (float(start), float(end)) for start, end in json.loads(clips) ]
+        except (json.JSONDecodeError, TypeError, ValueError) as e:
+            raise click.BadParameter(str(e), param_hint='--clips')
+    if not selectedClips:
+        raise click.UsageError('no clips to join')
+    try:
+        ConcatClips(Path(input), ptsMap, selectedClips, Path(output), pids=list(pids) or None, jobs=jobs, progress=ctx.obj['progress'])
+    except TsFileNotFound:
+        print(f'TsFileNotFound: "{input}" not found!', file=sys.stderr)
+        sys.exit(1)
+    except InvalidTsFormat:
+        print(f'InvalidTsFormat: "{input}" is invalid!', file=sys.stderr)
+        sys.exit(2)
+    except EncodingError as e:
+        print(f'EncodingError: {e}', file=sys.stderr)
+        sys.exit(3)
+
+
+@cli.command()
+@click.option('--socket', 'socket_path', help='Listen on this Unix socket instead of reading requests from stdin')
+@click.option('--workers', '-w', type=click.IntRange(min=1), default=2, show_default=True, help='Number of analyze requests run at once')
+@click.option('--cache-size', type=click.IntRange(min=1), default=64, show_default=True, help='Number of TS files and indexes kept loaded')
+@click.option('--no-cache', is_flag=True, help='Do not use the persistent frame props / probe cache')
+def serve(socket_path, workers, cache_size, no_cache):
+    """Answer probe, list-clips, select-clips and analyze requests as JSON lines, keeping files loaded."""
+    from .serve import ServeSocket, ServeStdio, Worker
+    worker = Worker(workers=workers, cacheSize=cache_size, useCache=not no_cache)
+    if socket_path:
+        if not hasattr(socket, 'AF_UNIX'):
+            raise click.UsageError('Unix sockets are not available on this platform, serve on stdin instead')
+        ServeSocket(worker, Path(socket_path))
+    else:
+        ServeStdio(worker)
+
+
+@cli.group(name='cache')
+def cache_group():
+    """Inspect and prune the persistent frame props / probe cache."""
+
+
+@cache_group.command(name='info')
+def cache_info():
+    """List cache entries as JSON, most recently used first."""
+    cache = Cache()
+    entries = sorted(cache.Entries(), key=lambda entry: entry.LastAccess(), reverse=True)
+    print(json.dumps({
+        'path': str(cache.root),
+        'size': sum(entry.Size() for entry in entries),
+        'maxSize': cache.maxSize,
+        'entries': [ {
+            'fingerprint': entry.folder.name,
+            'name': entry.Name(),
+            'size': entry.Size(),
+            'lastAccess': entry.LastAccess(),
+        } for entry in entries ],
+    }))
+
+
+@cache_group.command(name='prune')
+@click.option('--max-size', type=click.IntRange(min=0), help='Evict least recently used entries down to this size in MiB')
+@click.option('--all', 'all_', is_flag=True, help='Remove every entry, even the ones used in the last 10 minutes')
+def cache_prune(max_size, all_):
+    """Evict least recently used cache entries, sparing the ones used in the last 10 minutes."""
+    cache = Cache()
+    maxSize = 0 if all_ else None if max_size is None else max_size * 1024 * 1024
+    removed = cache.Prune(maxSize=maxSize, inUseSeconds=0 if all_ else IN_USE_SECONDS)
+    logger.info(f'Removed {len(removed)} cache entries, {cache.Size()} bytes left')
+
+
 def main():
     cli()
 
@@ -1,11 +1,20 @@
-import shutil, tempfile, argparse, logging
-import logging
-from pathlib import Path
+import argparse, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from .ffmpeg import InputFile
 from .common import FormatTimestamp
+from .stats import Instrumented
 
 logger = logging.getLogger('tscutter.audio')
 
+# seconds of audio below which a range is not split for parallel detection
+SEGMENT_MIN_LENGTH = 60
+# ms decoded before a segment, and after it by the previous one, to find where both decoders agree
+SEGMENT_PREROLL = 1000
+SEGMENT_OVERLAP = 30000
+# 10 ms blocks whose energy must be the same in both decodes
+SEGMENT_MATCH_BLOCKS = 50
+
 def FormatTimestamp(timestamp):
     seconds = round(timestamp)
     hour = seconds // 3600
@@ -14,32 +23,234 @@ def FormatTimestamp(timestamp):
     seconds = timestamp % 60 
     return f'{hour:02}:{minutes:02}:{seconds:05.02f}'
 
-def DetectSilence(inputFile: InputFile, ss=0, to=999999, min_silence_len=800, silence_thresh=-80, progress=None):
-    from pydub import AudioSegment
-    from pydub.silence import detect_silence
-    AudioSegment.converter = shutil.which('ffmpeg')
-    if AudioSegment.converter is None:
-        logger.warning('Cannot find ffmpeg in path!')
-    with tempfile.TemporaryDirectory(prefix='logoNet_wav_') as tmpWavFolder:
-        tmpWavFolder = Path(tmpWavFolder)
-        inputFile.ExtractStream(output=tmpWavFolder, ss=ss, to=to, toWav=True, videoTracks=[], audioTracks=[0], progress=progress)
-        audioFilename = tmpWavFolder / 'audio_0.wav'
-        sound = AudioSegment.from_file(audioFilename, channels=1)
-        logger.info(f'Detect silence (min_silence_len: {min_silence_len},  silence_thresh: {silence_thresh})')
-        periods = detect_silence(audio_segment=sound, min_silence_len=min_silence_len, silence_thresh=silence_thresh, seek_step=10)
-        logger.info('Silence detection done')
+class SilenceDetector:
+    """Streaming equivalent of pydub.silence.detect_silence over mono s16 PCM.
+
+    Samples are fed in chunks; only the current window plus one chunk is kept,
+    so memory does not grow with the length of the recording.
+    """
+    def __init__(self, sampleRate=48000, min_silence_len=800, silence_thresh=-80, seek_step=10):
+        self.sampleRate = sampleRate
+        self.minSilenceLen = min_silence_len
+        self.seekStep = seek_step
+        # same threshold as pydub: dBFS relative to the max 16 bit amplitude
+        self.threshold = 10 ** (silence_thresh / 20) * 0x8000
+        self._squares = np.zeros(0, dtype=np.int64)
+        self._bufStart = 0      # absolute sample index of self._squares[0]
+        self._total = 0         # samples fed so far
+        self._nextStart = 0     # next window start in ms
+        self._rangeStart = None
+        self._prevStart = None
+
+    def _ToSample(self, ms):
+        return ms * self.sampleRate // 1000
+
+    def _Scan(self, starts, available):
+        csum = np.concatenate(([0], np.cumsum(self._squares)))
+        begin = self._ToSample(starts)
+        end = self._ToSample(starts + self.minSilenceLen)
+        length = end - begin
+        # pydub pads missing frames at the very end with silence
+        sums = csum[np.minimum(end, available) - self._bufStart] - csum[begin - self._bufStart]
+        rms = np.floor(np.sqrt(sums / length))
+        return starts[rms <= self.threshold]
+
+    def _Merge(self, silenceStarts):
+        periods = []
+        for start in silenceStarts.tolist():
+            if self._prevStart is None:
+                self._rangeStart = start
+            elif start != self._prevStart + self.seekStep and start > self._prevStart + self.minSilenceLen:
+                periods.append([self._rangeStart, self._prevStart + self.minSilenceLen])
+                self._rangeStart = start
+            self._prevStart = start
         return periods
 
+    def _Close(self):
+        if self._prevStart is None:
+            return []
+        period = [self._rangeStart, self._prevStart + self.minSilenceLen]
+        self._rangeStart, self._prevStart = None, None
+        return [period]
+
+    def _CloseIfFinal(self):
+        # no later window can extend the current range anymore
+        if self._prevStart is not None and self._nextStart - self._prevStart > max(self.minSilenceLen, self.seekStep):
+            return self._Close()
+        return []
+
+    def FeedStarts(self, samples) -> np.ndarray:
+        """Feed samples, returns the starts (ms) of the silent windows they complete."""
+        samples = np.asarray(samples, dtype=np.int64)
+        self._squares = np.concatenate((self._squares, samples * samples))
+        self._total += len(samples)
+        # last window start whose samples are all available
+        lastStart = ((self._total + 1) * 1000 - 1) // self.sampleRate - self.minSilenceLen
+        starts = np.arange(self._nextStart, lastStart + 1, self.seekStep, dtype=np.int64)
+        if len(starts) == 0:
+            return starts
+        silenceStarts = self._Scan(starts, self._total)
+        self._nextStart = int(starts[-1]) + self.seekStep
+        drop = self._ToSample(int(starts[-1])) - self._bufStart
+        self._squares = self._squares[drop:]
+        self._bufStart += drop
+        return silenceStarts
+
+    def FlushStarts(self) -> np.ndarray:
+        """Starts of the silent windows that reach the end of the audio."""
+        segLen = round(1000 * self._total / self.sampleRate)
+        lastStart = segLen - self.minSilenceLen
+        if lastStart < 0:
+            return np.zeros(0, dtype=np.int64)
+        starts = np.arange(self._nextStart, lastStart + 1, self.seekStep, dtype=np.int64)
+        # guarantee the last portion of the audio is searched
+        if lastStart % self.seekStep:
+            starts = np.append(starts, lastStart)
+        return self._Scan(starts[starts * self.sampleRate // 1000 >= self._bufStart], self._total) if len(starts) else starts
+
+    def Feed(self, samples) -> list:
+        periods = self._Merge(self.FeedStarts(samples))
+        return periods + self._CloseIfFinal()
+
+    def Flush(self) -> list:
+        return self._Merge(self.FlushStarts()) + self._Close()
+
+def DetectSilenceFromLevels(levels, sampleRate=48000, min_silence_len=800, silence_thresh=-80, blockMs=10):
+    # levels holds the sum of squares per block, so every window start is on
+    # the block grid and the window length is rounded to whole blocks
+    detector = SilenceDetector(sampleRate=sampleRate, min_silence_len=min_silence_len, silence_thresh=silence_thresh, seek_step=blockMs)
+    window = max(1, round(min_silence_len / blockMs))
+    if len(levels) < window:
+        return []
+    csum = np.concatenate(([0], np.cumsum(levels, dtype=np.int64)))
+    sums = csum[window:] - csum[:-window]
+    rms = np.floor(np.sqrt(sums / (window * sampleRate * blockMs // 1000)))
+    silenceStarts = np.flatnonzero(rms <= detector.threshold) * blockMs
+    return detector._Merge(silenceStarts) + detector._Close()
+
+class BlockLevels:
+    """Sum of squares of every blockMs block of the samples fed, the last block may be partial."""
+    def __init__(self, sampleRate=48000, blockMs=10):
+        self.blockSamples = sampleRate * blockMs // 1000
+        self._carry = np.zeros(0, dtype=np.int64)
+        self._levels = []
+
+    def Feed(self, samples):
+        squares = np.concatenate((self._carry, np.asarray(samples, dtype=np.int64) ** 2))
+        full = len(squares) // self.blockSamples * self.blockSamples
+        self._levels.append(squares[:full].reshape(-1, self.blockSamples).sum(axis=1))
+        self._carry = squares[full:]
+
+    def Levels(self) -> np.ndarray:
+        return np.concatenate(self._levels + ([ np.array([ self._carry.sum() ]) ] if len(self._carry) else []) + [ np.zeros(0, dtype=np.int64) ])
+
+@Instrumented('DetectSilenceSegment')
+def _DetectSegment(inputFile: InputFile, ss, to, decodeFrom, decodeTo, detector: SilenceDetector, onProgress):
+    # times in ms from ss, decodeTo None means up to to; returns the silent window starts and the block levels from decodeFrom
+    levels = BlockLevels(detector.sampleRate, detector.seekStep)
+    starts = []
+    for samples in inputFile.ReadAudio(ss=ss + decodeFrom / 1000, to=to if decodeTo is None else ss + decodeTo / 1000, sampleRate=detector.sampleRate):
+        levels.Feed(samples)
+        starts.append(detector.FeedStarts(samples) + decodeFrom)
+        onProgress(len(samples) / detector.sampleRate)
+    if decodeTo is None:
+        starts.append(detector.FlushStarts() + decodeFrom)
+    return np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64), levels.Levels()
+
+def _SwitchPoint(boundary, before, after, seekStep):
+    # the first run of blocks where the decoder of the next segment caught up with the previous one
+    # a decoder that starts late or runs out of audio gives fewer blocks
+    n = min(len(before), len(after))
+    same = before[:n] == after[:n]
+    for i in range(len(same) - SEGMENT_MATCH_BLOCKS + 1):
+        if same[i:i + SEGMENT_MATCH_BLOCKS].all():
+            return boundary - SEGMENT_PREROLL + i * seekStep
+    logger.debug(f'Decoders did not agree around {FormatTimestamp(boundary / 1000)}, switching there')
+    return boundary
+
+def _DetectSilenceSegmented(inputFile: InputFile, ss, to, segments, jobs, min_silence_len, silence_thresh, sampleRate, progress):
+    """Detect silence in parallel segments, stitched where the decoders of two neighbours give the same audio.
+
+    ffmpeg's audio decoders do not always give the very same samples after a
+    seek until they met digital silence, so each segment is decoded from
+    SEGMENT_PREROLL before its start and the previous one SEGMENT_OVERLAP past
+    it. Silent window starts and block levels before the switch point come
+    from the previous segment, the others from the next one, and are merged
+    like a single run.
+    """
+    def Detector():
+        return SilenceDetector(sampleRate=sampleRate, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
+    seekStep = Detector().seekStep
+    total = min(to, inputFile.GetInfo().duration) - ss
+    boundaries = [ round(total * 1000 * i / segments / seekStep) * seekStep for i in range(1, segments) ]
+    regions = [ (boundary - SEGMENT_PREROLL, boundary + SEGMENT_OVERLAP) for boundary in boundaries ]
+    tid = "extract_streams"
+    if progress is not None:
+        progress.add_task(tid, total + (segments - 1) * (SEGMENT_PREROLL + SEGMENT_OVERLAP + min_silence_len) / 1000, "Extracting streams", unit="s")
+    decoded = 0
+    lock = threading.Lock()
+    def OnProgress(seconds):
+        nonlocal decoded
+        with lock:
+            decoded += seconds
+            if progress is not None:
+                progress.update(tid, decoded)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = []
+        for k in range(segments):
+            decodeFrom = 0 if k == 0 else regions[k - 1][0]
+            decodeTo = None if k == segments - 1 else regions[k][1] + min_silence_len
+            futures.append(executor.submit(_DetectSegment, inputFile, ss, to, decodeFrom, decodeTo, Detector(), OnProgress))
+        results = [ future.result() for future in futures ]
+    if progress is not None:
+        progress.done(tid)
+
+    def Blocks(k, fromMs, toMs):
+        decodeFrom = 0 if k == 0 else regions[k - 1][0]
+        return results[k][1][(fromMs - decodeFrom) // seekStep:None if toMs is None else (toMs - decodeFrom) // seekStep]
+    switchPoints = [ _SwitchPoint(boundaries[k], Blocks(k, *regions[k]), Blocks(k + 1, *regions[k]), seekStep) for k in range(segments - 1) ]
+    silenceStarts = np.concatenate([ starts[(starts >= first) & (starts < last)] for (starts, _), first, last in zip(results, [ -np.inf ] + switchPoints, switchPoints + [ np.inf ]) ])
+    levels = np.concatenate([ Blocks(k, first, last) for k, first, last in zip(range(segments), [ 0 ] + switchPoints, switchPoints + [ None ]) ])
+    detector = Detector()
+    return detector._Merge(silenceStarts) + detector._Close(), levels
+
+def IterSilence(inputFile: InputFile, ss=0, to=999999, min_silence_len=800, silence_thresh=-80, sampleRate=48000, blockLevels: BlockLevels | None = None, progress=None):
+    """Silent periods [start, end] in ms from ss, each yielded as soon as no later audio can extend it.
+
+    The decoded samples are fed to blockLevels as well when it is given.
+    """
+    detector = SilenceDetector(sampleRate=sampleRate, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
+    for samples in inputFile.ReadAudio(ss=ss, to=to, sampleRate=sampleRate, progress=progress):
+        yield from detector.Feed(samples)
+        if blockLevels is not None:
+            blockLevels.Feed(samples)
+    yield from detector.Flush()
+
+@Instrumented('DetectSilence')
+def DetectSilence(inputFile: InputFile, ss=0, to=999999, min_silence_len=800, silence_thresh=-80, sampleRate=48000, jobs=1, withLevels=False, progress=None):
+    """Silent periods [start, end] in ms from ss, and with withLevels the sum of squares of every 10 ms block as well."""
+    logger.info(f'Detect silence (min_silence_len: {min_silence_len},  silence_thresh: {silence_thresh})')
+    segments = min(jobs, int((min(to, inputFile.GetInfo().duration) - ss) // SEGMENT_MIN_LENGTH)) if jobs > 1 else 1
+    if segments > 1:
+        periods, levels = _DetectSilenceSegmented(inputFile, ss, to, segments, jobs, min_silence_len, silence_thresh, sampleRate, progress)
+    else:
+        blockLevels = BlockLevels(sampleRate) if withLevels else None
+        periods = list(IterSilence(inputFile, ss, to, min_silence_len, silence_thresh, sampleRate, blockLevels=blockLevels, progress=progress))
+        levels = blockLevels.Levels() if blockLevels is not None else None
+    logger.info('Silence detection done')
+    return (periods, levels) if withLevels else periods
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Detect silent periods in TS files')
     parser.add_argument('--quiet', '-q', action='store_true', help="don't output to the console")
     parser.add_argument('--input', '-i', required=True, help='input mpegts path')
     parser.add_argument('--length', '-l', type=int, default=800, help='min silence length in ms')
     parser.add_argument('--threshold', '-t', type=int, default=-80, help='silence threshold')
+    parser.add_argument('--rate', '-r', type=int, default=48000, help='sample rate for the analysis')
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-    silencePeriods = DetectSilence(inputFile=InputFile(args.input), min_silence_len=args.length, silence_thresh=args.threshold)
+    silencePeriods = DetectSilence(inputFile=InputFile(args.input), min_silence_len=args.length, silence_thresh=args.threshold, sampleRate=args.rate)
     for period in silencePeriods:
         print(FormatTimestamp(period[0] / 1000), period[1] - period[0])
\ No newline at end of file
@@ -0,0 +1,185 @@
+"""Analyze many recordings in one run.
+
+Files are spread over a pool of worker processes, largest first, while a
+shared semaphore caps how many ffmpeg decoders run at once across all of
+them. Every finished file is appended to a journal (JSON lines), so a batch
+that was killed skips what it already did when started again.
+"""
+
+import glob, json, logging, multiprocessing, os, time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from ._progress import Progress, SilentProgress
+from .analyze import AnalyzeVideo, DefaultIndexPath
+from .cache import Cache
+from .ffmpeg import InputFile, SetFfmpegBudget
+
+logger = logging.getLogger('tscutter.batch')
+
+TS_EXTENSIONS = ('.ts', '.m2ts', '.mts')
+
+def CollectInputs(patterns, extensions=TS_EXTENSIONS) -> list[Path]:
+    """Expand files, directories (searched recursively) and glob patterns, without duplicates."""
+    paths = {}
+    for pattern in patterns:
+        pattern = str(pattern)
+        matches = [ Path(p) for p in sorted(glob.glob(pattern, recursive=True)) ] if glob.has_magic(pattern) else [ Path(pattern) ]
+        for path in matches:
+            if path.is_dir():
+                candidates = sorted(p for p in path.rglob('*') if p.suffix.lower() in extensions and '_metadata' not in p.parts)
+            elif path.is_file():
+                candidates = [ path ]
+            else:
+                logger.warning(f'"{path}" not found, skipped')
+                continue
+            for candidate in candidates:
+                paths.setdefault(candidate.resolve(), candidate)
+    return list(paths.values())
+
+class BatchJournal:
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.records = {}
+        self.truncated = False
+        if self.path.is_file():
+            with self.path.open() as f:
+                for line in f:
+                    self.truncated = not line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line of a killed batch may be cut short
+                        continue
+                    self.records[record['path']] = record
+
+    def _Key(self, videoPath: Path) -> str:
+        return str(Path(videoPath).resolve())
+
+    def IsDone(self, videoPath: Path, indexPath: Path, params: dict) -> bool:
+        if not indexPath.is_file():
+            return False
+        stat = Path(videoPath).stat()
+        record = self.records.get(self._Key(videoPath))
+        if record is None:
+            # analyzed outside of a batch
+            return indexPath.stat().st_mtime_ns >= stat.st_mtime_ns
+        return record['status'] == 'done' and record['size'] == stat.st_size and record['mtime'] == stat.st_mtime_ns and record['params'] == params
+
+    def Record(self, videoPath: Path, status: str, params: dict, **fields):
+        stat = Path(videoPath).stat()
+        record = {
+            'path': self._Key(videoPath),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'params': params,
+            'status': status,
+            'time': time.time(),
+            **fields,
+        }
+        self.records[record['path']] = record
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open('a') as f:
+            f.write(('\n' if self.truncated else '') + json.dumps(record) + '\n')
+            self.truncated = False
+            f.flush()
+            os.fsync(f.fileno())
+
+def _InitWorker(ffmpegSlots, logLevel):
+    logging.basicConfig(level=logLevel, format='%(message)s')
+    SetFfmpegBudget(ffmpegSlots)
+
+def _AnalyzeFile(videoPath: Path, indexPath: Path, params: dict, useCache: bool):
+    startTime = time.monotonic()
+    try:
+        AnalyzeVideo(inputFile=InputFile(videoPath, cache=Cache() if useCache else None), indexPath=indexPath, progress=SilentProgress(), **params)
+    except Exception as e:
+        return 'failed', f'{type(e).__name__}: {e}', time.monotonic() - startTime
+    return 'done', None, time.monotonic() - startTime
+
+def AnalyzeBatch(inputs, outputFolder=None, journalPath=None, workers=2, ffmpegBudget=None, force=False, useCache=True, minSilenceLen=800, silenceThresh=-80, splitPosShift=1, jobs=1, singlePass=False, usePesIndex=False, binaryIndex=False, searchMode='exhaustive', metric='sad', scan=False, pipeline=False, progress: Progress | None = None) -> dict:
+    """Analyze every input, returns the final status of each file by path."""
+    if progress is None:
+        progress = Progress()
+    params = {
+        'minSilenceLen': minSilenceLen,
+        'silenceThresh': silenceThresh,
+        'splitPosShift': splitPosShift,
+        'jobs': jobs,
+        'singlePass': singlePass,
+        'usePesIndex': usePesIndex,
+        'binaryIndex': binaryIndex,
+        'searchMode': searchMode,
+        'metric': metric,
+        'scan': scan,
+        'pipeline': pipeline,
+    }
+    journal = BatchJournal(Path.cwd() / '.tscutter-batch.jsonl' if journalPath is None else journalPath)
+    videoPaths = CollectInputs(inputs)
+    results = {}
+    pending = []
+    for videoPath in videoPaths:
+        indexPath = DefaultIndexPath(videoPath, outputFolder)
+        if not force and journal.IsDone(videoPath, indexPath, params):
+            results[str(videoPath)] = 'skipped'
+            progress.add_task(f'file:{videoPath}', videoPath.stat().st_size, videoPath.name, unit='B', parent='batch')
+            progress.done(f'file:{videoPath}', status='skipped')
+        else:
+            pending.append((videoPath, indexPath))
+    # the longest files first, so that the pool does not idle on one straggler at the end
+    pending.sort(key=lambda item: item[0].stat().st_size, reverse=True)
+    logger.info(f'{len(videoPaths)} files, {len(results)} up to date, {len(pending)} to analyze')
+
+    totalBytes = sum(videoPath.stat().st_size for videoPath, _ in pending)
+    tid = 'batch'
+    progress.add_task(tid, totalBytes, f'Analyzing {len(pending)} files', unit='B')
+    bytesDone = 0
+    startTime = time.monotonic()
+    ctx = multiprocessing.get_context()
+    ffmpegSlots = ctx.BoundedSemaphore(workers * jobs if ffmpegBudget is None else ffmpegBudget)
+    def Pool():
+        return ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_InitWorker, initargs=(ffmpegSlots, logger.getEffectiveLevel()))
+    executor = Pool()
+    try:
+        running = {}
+        queued = list(reversed(pending))
+        while queued or running:
+            # only as many files in flight as there are workers, so that a started file is a running file
+            while queued and len(running) < workers:
+                videoPath, indexPath = queued.pop()
+                indexPath.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    future = executor.submit(_AnalyzeFile, videoPath, indexPath, params, useCache)
+                except BrokenProcessPool:
+                    # a worker died (OOM kill, crash): the files it had fail below, the others go to a new pool
+                    logger.warning('A worker process died, starting a new pool')
+                    queued.append((videoPath, indexPath))
+                    executor.shutdown(wait=False)
+                    executor = Pool()
+                    continue
+                fileTid = f'file:{videoPath}'
+                progress.add_task(fileTid, videoPath.stat().st_size, videoPath.name, unit='B', parent='batch')
+                running[future] = (videoPath, fileTid)
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                videoPath, fileTid = running.pop(future)
+                try:
+                    status, error, seconds = future.result()
+                except BrokenProcessPool as e:
+                    status, error, seconds = 'failed', f'{type(e).__name__}: {e}', 0.0
+                size = videoPath.stat().st_size
+                if status == 'done':
+                    journal.Record(videoPath, status, params, seconds=round(seconds, 3))
+                    logger.info(f'"{videoPath.name}" done in {seconds:.1f}s')
+                else:
+                    journal.Record(videoPath, status, params, error=error)
+                    logger.error(f'"{videoPath.name}" failed: {error}')
+                results[str(videoPath)] = status
+                bytesDone += size
+                progress.done(fileTid, status=status, error=error, seconds=round(seconds, 3))
+                elapsed = time.monotonic() - startTime
+                progress.update(tid, bytesDone, gb_per_hour=round(bytesDone / 1e9 / elapsed * 3600, 3) if elapsed > 0 else 0.0, files_done=len(results), files_total=len(videoPaths))
+    finally:
+        executor.shutdown()
+    progress.done(tid)
+    return results
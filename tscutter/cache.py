@@ -0,0 +1,220 @@
+"""On-disk cache of probe results and frame property tables.
+
+Entries are keyed by a fingerprint of the TS file (size, mtime and hashes of
+the head and tail blocks) so a recording is recognised wherever it is opened
+from. Every entry is a folder holding index.json and one .npy table per
+decoded window; whole entries are evicted least recently used first once the
+cache grows beyond its size cap. The index updates and the evictions hold a
+lock file in the cache folder, as analyze-batch workers share it from
+separate processes.
+"""
+
+import hashlib, json, os, shutil, threading, time, uuid
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+
+FINGERPRINT_BLOCK = 1024 * 1024
+DEFAULT_MAX_SIZE = 2 * 1024 * 1024 * 1024
+# entries used this recently may be open in another process and are not evicted
+IN_USE_SECONDS = 600
+# seconds to wait for the lock of the cache folder
+LOCK_TIMEOUT = 60
+# bytes written after an eviction pass before the next one, the cache may outgrow its cap by as much
+PRUNE_STEP = 64 * 1024 * 1024
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _LockFile(f):
+        f.seek(0)
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            try:
+                # retries for 10 seconds itself before it raises
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'"{f.name}" stayed locked for {LOCK_TIMEOUT}s')
+
+    def _UnlockFile(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _LockFile(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _UnlockFile(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def DefaultCacheDir() -> Path:
+    if 'TSCUTTER_CACHE_DIR' in os.environ:
+        return Path(os.environ['TSCUTTER_CACHE_DIR'])
+    if os.name == 'nt' and 'LOCALAPPDATA' in os.environ:
+        return Path(os.environ['LOCALAPPDATA']) / 'tscutter' / 'cache'
+    return Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'tscutter'
+
+def FileFingerprint(path: Path, blockSize=FINGERPRINT_BLOCK) -> str:
+    stat = Path(path).stat()
+    digest = hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    with Path(path).open('rb') as f:
+        digest.update(f.read(blockSize))
+        if stat.st_size > blockSize:
+            f.seek(max(blockSize, stat.st_size - blockSize))
+            digest.update(f.read(blockSize))
+    return digest.hexdigest()
+
+def _WriteJson(path: Path, data):
+    tmpPath = path.with_name(f'.{path.name}.{uuid.uuid4().hex}')
+    with tmpPath.open('w') as f:
+        json.dump(data, f)
+    os.replace(tmpPath, path)
+
+class CacheEntry:
+    def __init__(self, cache: 'Cache', folder: Path) -> None:
+        self.cache = cache
+        self.folder = folder
+        self.indexPath = folder / 'index.json'
+
+    def _Load(self) -> dict:
+        try:
+            with self.indexPath.open() as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return { 'name': '', 'lastAccess': 0, 'probe': None, 'segments': [] }
+
+    def _Save(self, index: dict):
+        index['lastAccess'] = time.time()
+        self.folder.mkdir(parents=True, exist_ok=True)
+        _WriteJson(self.indexPath, index)
+
+    def Name(self) -> str:
+        return self._Load()['name']
+
+    def LastAccess(self) -> float:
+        return self._Load()['lastAccess']
+
+    def Size(self) -> int:
+        return sum(p.stat().st_size for p in self.folder.glob('*') if p.is_file()) if self.folder.is_dir() else 0
+
+    def Touch(self, name=None):
+        with self.cache.Locked():
+            index = self._Load()
+            if name is not None:
+                index['name'] = name
+            self._Save(index)
+
+    def GetProbe(self) -> dict | None:
+        return self._Load()['probe']
+
+    def PutProbe(self, probe: dict):
+        with self.cache.Locked():
+            index = self._Load()
+            index['probe'] = probe
+            self._Save(index)
+        self.cache._Grown(0, keep=self)
+
+    def Segments(self, mode: str) -> list[dict]:
+        return [ segment for segment in self._Load()['segments'] if segment['mode'] == mode ]
+
+    def LoadSegment(self, segment: dict) -> np.ndarray:
+        return np.load(self.folder / segment['file'], allow_pickle=False)
+
+    def PutSegment(self, mode: str, ss: float, to: float, table: np.ndarray, replaces=()):
+        """Store the table covering [ss, to], dropping the segments it supersedes."""
+        fileName = f'{uuid.uuid4().hex}.npy'
+        self.folder.mkdir(parents=True, exist_ok=True)
+        with (self.folder / fileName).open('wb') as f:
+            np.save(f, table, allow_pickle=False)
+            size = f.tell()
+        replaced = { segment['file'] for segment in replaces }
+        with self.cache.Locked():
+            if not (self.folder / fileName).is_file():
+                # the entry was evicted by another process meanwhile
+                return
+            index = self._Load()
+            index['segments'] = [ segment for segment in index['segments'] if segment['file'] not in replaced ]
+            index['segments'].append({ 'mode': mode, 'ss': ss, 'to': to, 'file': fileName })
+            self._Save(index)
+        for name in replaced:
+            (self.folder / name).unlink(missing_ok=True)
+        self.cache._Grown(size, keep=self)
+
+class Cache:
+    def __init__(self, root: Path | None = None, maxSize: int = DEFAULT_MAX_SIZE) -> None:
+        self.root = DefaultCacheDir() if root is None else Path(root)
+        self.maxSize = maxSize
+        self.lock = threading.RLock()
+        self._lockFile = None
+        self._lockDepth = 0
+        # what this process knows of the cache size, None until the first eviction pass
+        self._size = None
+        self._pruneAt = maxSize
+
+    @contextmanager
+    def Locked(self):
+        """Hold the lock of the cache folder, against the other threads and processes using it."""
+        with self.lock:
+            if self._lockDepth == 0:
+                self.root.mkdir(parents=True, exist_ok=True)
+                self._lockFile = (self.root / '.lock').open('a+b')
+                _LockFile(self._lockFile)
+            self._lockDepth += 1
+            try:
+                yield
+            finally:
+                self._lockDepth -= 1
+                if self._lockDepth == 0:
+                    _UnlockFile(self._lockFile)
+                    self._lockFile.close()
+                    self._lockFile = None
+
+    def Entry(self, path: Path) -> CacheEntry:
+        entry = CacheEntry(self, self.root / FileFingerprint(path))
+        entry.Touch(name=Path(path).name)
+        return entry
+
+    def Entries(self) -> list[CacheEntry]:
+        if not self.root.is_dir():
+            return []
+        return [ CacheEntry(self, folder) for folder in self.root.iterdir() if (folder / 'index.json').is_file() ]
+
+    def Size(self) -> int:
+        return sum(entry.Size() for entry in self.Entries())
+
+    def _Grown(self, size: int, keep: CacheEntry | None = None):
+        # an eviction pass reads every entry, so it only runs once the writes may have filled the cache
+        with self.lock:
+            if self._size is not None:
+                self._size += size
+                if self._size <= self._pruneAt:
+                    return
+            self.Prune(keep=keep)
+
+    def Prune(self, maxSize: int | None = None, keep: CacheEntry | None = None, inUseSeconds=IN_USE_SECONDS) -> list[CacheEntry]:
+        """Evict least recently used entries until the cache fits in maxSize, sparing the ones used in the last inUseSeconds."""
+        maxSize = self.maxSize if maxSize is None else maxSize
+        with self.Locked():
+            entries = sorted(self.Entries(), key=lambda entry: entry.LastAccess())
+            sizes = { entry.folder: entry.Size() for entry in entries }
+            total = sum(sizes.values())
+            removed = []
+            for entry in entries:
+                if total <= maxSize:
+                    break
+                if keep is not None and entry.folder == keep.folder:
+                    continue
+                if entry.LastAccess() > time.time() - inUseSeconds:
+                    # the rest were used even more recently
+                    break
+                shutil.rmtree(entry.folder, ignore_errors=True)
+                total -= sizes[entry.folder]
+                removed.append(entry)
+            if maxSize == self.maxSize:
+                # a cache at its cap, or that could not be evicted below it, is not read again on every write
+                self._size = total
+                self._pruneAt = max(self.maxSize, total + PRUNE_STEP)
+            return removed
@@ -1,9 +1,14 @@
-import json, shutil
+import json, math, shutil, threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from pathlib import Path
+import numpy as np
+from .fileio import CopyFileRange, SendFileRange, StreamRanges
 
 class TsFileNotFound(FileNotFoundError): ...
 class InvalidTsFormat(RuntimeError): ...
 class EncodingError(RuntimeError): ...
+class InvalidIndexFormat(RuntimeError): ...
 
 def FormatTimestamp(timestamp):
     seconds = round(timestamp)
@@ -17,125 +22,223 @@ def ClipToFilename(clip):
     return '{:08.3f}-{:08.3f}.ts'.format(float(clip[0]), float(clip[1]))
 
 def CopyPart(src, dest, start, end, mode='wb', pbar=None, bufsize=1024*1024):
+    onProgress = None if pbar is None else pbar.update
     with open(src, 'rb') as f1:
-        f1.seek(start)
         with open(dest, mode) as f2:
-            length = end - start
-            while length:
-                chunk = min(bufsize, length)
-                data = f1.read(chunk)
-                f2.write(data)
-                length -= chunk
-                if pbar is not None:
-                    pbar.update(chunk)
+            f2.flush()
+            CopyFileRange(f1.fileno(), f2.fileno(), start, end - start, onProgress=onProgress, bufsize=bufsize)
 
 def CopyPartPipe(src, pipe, start, end,  pbar=None, bufsize=1024*1024):
+    onProgress = None if pbar is None else pbar.update
     try:
         with open(src, 'rb') as f1:
-            f1.seek(start)
-            length = end - start
-            while length:
-                chunk = min(bufsize, length)
-                data = f1.read(chunk)
-                pipe.write(data)
-                length -= chunk
-                if pbar is not None:
-                    pbar.update(chunk)
-    except ValueError:
+            SendFileRange(f1.fileno(), pipe, start, end - start, onProgress=onProgress, bufsize=bufsize)
+    except (ValueError, BrokenPipeError):
         # pipe is closed by the other side
         pass
 
+# one row per cut position of a .ptsmap, silent_ss / silent_to are NaN where absent
+PtsMapDType = np.dtype([
+    ('pts', '<f8'), ('sad', '<f8'), ('silent_ss', '<f8'), ('silent_to', '<f8'),
+    ('prev_end_pts', '<f8'), ('prev_end_sad', '<f8'), ('prev_end_pos', '<i8'),
+    ('next_start_pts', '<f8'), ('next_start_sad', '<f8'), ('next_start_pos', '<i8'),
+])
+# binary .ptsmap: this magic, the row count as <i8, then the rows
+PTSMAP_MAGIC = b'TSPTSMP\x01'
+PTSMAP_HEADER_SIZE = 16
+# binary tables up to this many rows are read into memory, larger ones are memory-mapped
+PTSMAP_MMAP_ROWS = 1 << 16
+
+def PtsMapToTable(ptsMap: dict) -> np.ndarray:
+    table = np.array([ tuple(float(pts) if name == 'pts' else item.get(name, math.nan) for name in PtsMapDType.names) for pts, item in ptsMap.items() ], dtype=PtsMapDType)
+    return table[np.argsort(table['pts'], kind='stable')]
+
+def TableToPtsMap(table: np.ndarray) -> dict:
+    ptsMap = {}
+    for row in table.tolist():
+        item = dict(zip(PtsMapDType.names, row))
+        pts = item.pop('pts')
+        if math.isnan(item['silent_ss']):
+            del item['silent_ss'], item['silent_to']
+        ptsMap[str(pts)] = { 'pts_display': FormatTimestamp(pts), **item }
+    return ptsMap
+
+def SaveBinaryPtsMap(table: np.ndarray, f):
+    f.write(PTSMAP_MAGIC + np.int64(len(table)).astype('<i8').tobytes())
+    f.write(np.ascontiguousarray(table, dtype=PtsMapDType).tobytes())
+
+def LoadPtsMapTable(path: Path) -> np.ndarray:
+    """Read a JSON or binary .ptsmap.
+
+    A binary table of more than PTSMAP_MMAP_ROWS rows is memory-mapped, and on
+    Windows the file cannot be replaced while the table is referenced.
+    """
+    with Path(path).open('rb') as f:
+        header = f.read(PTSMAP_HEADER_SIZE)
+        if not header.startswith(PTSMAP_MAGIC):
+            f.seek(0)
+            data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError(f'"{Path(path).name}" is no JSON object')
+            return PtsMapToTable(data)
+        if len(header) < PTSMAP_HEADER_SIZE:
+            raise ValueError(f'"{Path(path).name}" ends in its header')
+        count = int(np.frombuffer(header[len(PTSMAP_MAGIC):], dtype='<i8')[0])
+        if count <= PTSMAP_MMAP_ROWS:
+            table = np.fromfile(f, dtype=PtsMapDType, count=count)
+            if len(table) < count:
+                raise ValueError(f'"{Path(path).name}" ends in its table')
+            return table
+    return np.memmap(path, dtype=PtsMapDType, mode='r', offset=PTSMAP_HEADER_SIZE, shape=(count,))
+
 class PtsMap:
     def __init__(self, path: Path) -> None:
         self.path = path
-        with self.path.open() as f:
-            self.data = json.load(f)
+        try:
+            self.table = LoadPtsMapTable(path)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            # not a ptsmap, or a binary one cut short
+            raise InvalidIndexFormat(f'"{Path(path).name}" is invalid!') from e
+        self.pts = self.table['pts']
+
+    @cached_property
+    def data(self) -> dict:
+        return TableToPtsMap(self.table)
 
     def Clips(self) -> list:
-        return [ ( float(list(self.data.keys())[i]),  float(list(self.data.keys())[i + 1]) ) for i in range(len(self.data) - 1) ]
+        pts = self.pts.tolist()
+        return list(zip(pts[:-1], pts[1:]))
 
     def Duration(self) -> float:
-        ptsEnd = list(self.data.keys())[-1]
-        return self.data[ptsEnd]['prev_end_pts']
+        return float(self.table['prev_end_pts'][-1])
     
     def Length(self) -> int:
-        ptsEnd = list(self.data.keys())[-1]
-        return self.data[ptsEnd]['prev_end_pos']
+        return int(self.table['prev_end_pos'][-1])
+
+    def ClipBoundaries(self, clip: tuple[float]) -> tuple[int, int]:
+        """Indexes of the last cut position at or before clip[0] and the first at or after clip[1]."""
+        return int(np.searchsorted(self.pts, clip[0], side='right')) - 1, int(np.searchsorted(self.pts, clip[1], side='left'))
 
     def SelectClips(self, lengthLimit=150) -> tuple:
         clips = self.Clips()
         videoLen = clips[-1][1]
-        selectedClips = []
+        lengths = np.diff(self.pts)
+        # longest first, ties in reverse order like reversed(sorted(...))
+        order = np.argsort(lengths, kind='stable')[::-1]
+        sortedLengths = lengths[order]
+        lengthsBefore = np.concatenate(([ 0.0 ], np.cumsum(sortedLengths)[:-1]))
+        count = int(np.count_nonzero((sortedLengths >= lengthLimit) & (lengthsBefore <= videoLen / 2)))
+        selectedClips = [ clips[i] for i in order[:count].tolist() ]
         selectedLen = 0
-        for clip in reversed(sorted(clips, key=lambda clip: clip[1] - clip[0])):
-            clipLen = clip[1] - clip[0]
-            if clipLen < lengthLimit:
-                break
-            if selectedLen > videoLen / 2:
-                break
-            selectedClips.append(clip)
-            selectedLen += clipLen
+        for clip in selectedClips:
+            selectedLen += clip[1] - clip[0]
         return selectedClips, selectedLen
     
-    def SplitVideo(self, videoPath: Path, outputFolder: Path, progress=None):
+    def SplitVideo(self, videoPath: Path, outputFolder: Path, progress=None, jobs=1, pidFilter=None):
+        """Copy every clip to its own file in outputFolder, only the PIDs kept by pidFilter (a PidFilter) if given."""
         if outputFolder.exists():
             shutil.rmtree(outputFolder)
         outputFolder.mkdir(parents=True)
 
-        ptsList = list(self.data.keys())
-        clips = [ (ptsList[i], ptsList[i + 1]) for i in range(len(ptsList) - 1) ]
-        total_bytes = sum(self.data[c[1]]['prev_end_pos'] - self.data[c[0]]['next_start_pos']
-                          for c in clips)
+        clips = self.Clips()
+        starts = self.table['next_start_pos'][:-1].tolist()
+        ends = self.table['prev_end_pos'][1:].tolist()
+        total_bytes = sum(end - start for start, end in zip(starts, ends))
         if progress is not None:
             progress.add_task("split_files", total_bytes, "Splitting files", unit="B")
         copied = 0
-        for clip in clips:
-            start = self.data[clip[0]]['next_start_pos']
-            end = self.data[clip[1]]['prev_end_pos']
-            outputPath = outputFolder / ClipToFilename(clip)
-            CopyPart(videoPath, outputPath, start, end)
-            copied += end - start
-            if progress is not None:
-                progress.update("split_files", copied)
+        lock = threading.Lock()
+        def OnProgress(n):
+            nonlocal copied
+            with lock:
+                copied += n
+                if progress is not None:
+                    progress.update("split_files", copied)
+        def CopyClip(i):
+            with open(videoPath, 'rb') as f1, open(outputFolder / ClipToFilename(clips[i]), 'wb') as f2:
+                if pidFilter is None:
+                    CopyFileRange(f1.fileno(), f2.fileno(), starts[i], ends[i] - starts[i], onProgress=OnProgress)
+                else:
+                    StreamRanges(f1.fileno(), [ (starts[i], ends[i] - starts[i]) ], pidFilter.Writer(f2.write), onProgress=OnProgress)
+        if jobs > 1:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                list(executor.map(CopyClip, range(len(clips))))
+        else:
+            for i in range(len(clips)):
+                CopyClip(i)
         if progress is not None:
             progress.done("split_files")
     
-    def ExtractClipPipe(self, inFile: Path, clip: tuple[float], pipe, progress=None):
-        for pts in [ float(key) for key in self.data.keys() ]:
-            if pts <= clip[0]:
-                ptsStart = pts
-            if pts >= clip[1]:
-                ptsEnd = pts
-                break
-
-        ptsStartPos =  self.data[str(ptsStart)]['next_start_pos']
-        ptsEndPos =  self.data[str(ptsEnd)]['prev_end_pos']
+    def ClipByteRange(self, clip: tuple[float]) -> tuple[int, int]:
+        """Byte range of clip in the TS file, interpolated between the cut positions around it."""
+        startIndex, endIndex = self.ClipBoundaries(clip)
+        ptsStart, ptsEnd = float(self.pts[startIndex]), float(self.pts[endIndex])
+        ptsStartPos = int(self.table['next_start_pos'][startIndex])
+        ptsEndPos = int(self.table['prev_end_pos'][endIndex])
 
         ratio = (ptsEndPos - ptsStartPos) / (ptsEnd - ptsStart)
 
         start = round(ptsStartPos + (clip[0] - ptsStart) * ratio) // 188 * 188
         totalSize = round((clip[1] - clip[0]) * ratio)
-        end = start + totalSize
+        return start, start + totalSize
+
+    def ExtractClipPipe(self, inFile: Path, clip: tuple[float], pipe, progress=None, pidFilter=None):
+        start, end = self.ClipByteRange(clip)
+        totalSize = end - start
 
         tid = "extract_clip_bytes"
         if progress is not None:
             progress.add_task(tid, totalSize, "Copying", unit="B")
         copied = 0
-        bufsize = 1024 * 1024
+        def OnProgress(n):
+            nonlocal copied
+            copied += n
+            if progress is not None:
+                progress.update(tid, copied)
+        try:
+            with open(inFile, 'rb') as f1:
+                if pidFilter is None:
+                    SendFileRange(f1.fileno(), pipe, start, end - start, onProgress=OnProgress)
+                else:
+                    StreamRanges(f1.fileno(), [ (start, end - start) ], pidFilter.Writer(pipe.write), onProgress=OnProgress)
+                    pipe.flush()
+        except (ValueError, BrokenPipeError):
+            pass
+        pipe.close()
+        if progress is not None:
+            progress.done(tid)
+
+    def ExtractClipsPipe(self, inFile: Path, clips: list, pipe, progress=None, pidFilter=None) -> int:
+        """Stream the clips one after the other into pipe, reading ahead in a thread, returns the bytes written."""
+        ranges = [ self.ClipByteRange(clip) for clip in clips ]
+        if pidFilter is not None:
+            # whole packets only, so that the next clip starts on a packet
+            ranges = [ (start, start + (end - start) // 188 * 188) for start, end in ranges ]
+        # clips that follow each other on disk are read as one range
+        merged = []
+        for start, end in ranges:
+            if merged and merged[-1][1] == start:
+                merged[-1][1] = end
+            else:
+                merged.append([ start, end ])
+        tid = "extract_clips_bytes"
+        if progress is not None:
+            progress.add_task(tid, sum(end - start for start, end in merged), f"Copying {len(clips)} clips", unit="B")
+        copied = 0
+        def OnProgress(n):
+            nonlocal copied
+            copied += n
+            if progress is not None:
+                progress.update(tid, copied)
+        write = pipe.write if pidFilter is None else pidFilter.Writer(pipe.write)
         try:
             with open(inFile, 'rb') as f1:
-                f1.seek(start)
-                length = end - start
-                while length:
-                    chunk = min(bufsize, length)
-                    data = f1.read(chunk)
-                    pipe.write(data)
-                    length -= chunk
-                    copied += chunk
-                    if progress is not None:
-                        progress.update(tid, copied)
-        except ValueError:
+                StreamRanges(f1.fileno(), [ (start, end - start) for start, end in merged ], write, onProgress=OnProgress)
+            pipe.flush()
+        except (ValueError, BrokenPipeError):
+            # pipe is closed by the other side
             pass
         pipe.close()
         if progress is not None:
             progress.done(tid)
+        return copied if pidFilter is None else write.written
@@ -0,0 +1,142 @@
+"""Join clips of a TS file into one TS with continuous timestamps.
+
+Copying the clips' bytes one after the other keeps their original PTS,
+which jump at every clip boundary. Instead, each clip is remuxed on its own
+by an ffmpeg fed straight from the clip's byte range, with the streams
+mapped by PID in the order of the first PMT of the file and keeping their
+PIDs. A clip maps only the PIDs that have packets in its range, the concat
+demuxer matches the streams of every clip by PID, so that all clips share
+one stream layout even where the broadcast reorders its PMT or a stream
+pauses. It then joins them, shifting the timestamps of every clip by
+the duration of the ones before. The joined output keeps the service ID,
+the PMT PID and the stream PIDs of that PMT. ffmpeg carries the PCR on the
+video stream, so a PCR PID that is no elementary stream of the source is
+remapped onto it. See doc/ffmpeg-concat-ts.md.
+"""
+
+import logging, os, shutil, subprocess, tempfile, threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from ._progress import Progress
+from .common import EncodingError, PtsMap, TsFileNotFound
+from .fileio import SendFileRange
+from .ffmpeg import _FfmpegProcess
+from .mpegts import MappedPackets, PacketPids, PacketView, ProgramMap, ReadProgramMap, TS_PACKET_SIZE
+from .stats import Instrumented
+
+logger = logging.getLogger('tscutter.concat')
+
+# packets searched for the PAT and the PMT at the start of the file
+PMT_SEARCH_PACKETS = 1 << 15
+# packets scanned at a time for the PIDs of a clip
+PID_SCAN_PACKETS = 1 << 16
+
+def _ReadFirstProgramMap(path: Path, serviceId=None) -> ProgramMap:
+    with MappedPackets(path) as (mm, offset, count):
+        return ReadProgramMap(PacketView(mm, offset, 0, min(count, PMT_SEARCH_PACKETS)), serviceId)
+
+def ReadStreamPids(path: Path, serviceId=None) -> list[int]:
+    """PIDs of the program's streams, in the order of the first PMT of path."""
+    return [ pid for _, pid in _ReadFirstProgramMap(path, serviceId).streams ]
+
+def _PresentPids(path: Path, byteRange, pids) -> list:
+    """The pids that have packets in byteRange of path, in the order of pids."""
+    start, end = byteRange
+    with MappedPackets(path) as (mm, offset, count):
+        first, last = max((start - offset) // TS_PACKET_SIZE, 0), min((end - offset) // TS_PACKET_SIZE, count)
+        missing = np.array(pids)
+        # usually every stream shows up within the first chunk
+        for i in range(first, last, PID_SCAN_PACKETS):
+            missing = missing[~np.isin(missing, PacketPids(PacketView(mm, offset, i, min(PID_SCAN_PACKETS, last - i))))]
+            if len(missing) == 0:
+                break
+        return [ pid for pid in pids if pid not in missing ]
+
+def _PidArgs(programMap: ProgramMap, pids) -> list:
+    # ffmpeg numbers the PIDs from 0x100 and the PMT from 0x1000 otherwise
+    args = [ '-mpegts_service_id', str(programMap.serviceId), '-mpegts_pmt_start_pid', str(programMap.pmtPid) ]
+    for i, pid in enumerate(pids):
+        args += [ '-streamid', f'{i}:{pid}' ]
+    return args
+
+def _CopyArgs(maps, output: Path, outputArgs=()) -> list:
+    args = []
+    for streams in maps:
+        args += [ '-map', streams ]
+    # -copy_unknown keeps the data streams ffmpeg has no codec for
+    return args + [ '-c', 'copy', '-copy_unknown' ] + list(outputArgs) + [ '-f', 'mpegts', '-y', str(output) ]
+
+def _RemuxClip(ffmpeg, inFile: Path, byteRange, pids, output: Path, onProgress=None):
+    start, end = byteRange
+    present = _PresentPids(inFile, byteRange, pids)
+    if len(present) < len(pids):
+        logger.info(f'Bytes {start}-{end} have no packets of PIDs {", ".join(f"{pid:#x}" for pid in pids if pid not in present)}')
+    # the clip keeps the source PIDs for the concat demuxer to match
+    args = [ ffmpeg, '-hide_banner', '-nostats', '-loglevel', 'error', '-f', 'mpegts', '-i', 'pipe:0' ]
+    args += _CopyArgs([ f'0:#{pid:#x}' for pid in present ], output, [ arg for i, pid in enumerate(present) for arg in ('-streamid', f'{i}:{pid}') ])
+    with _FfmpegProcess(args, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as pipeObj:
+        errors = []
+        reader = threading.Thread(target=lambda: errors.append(pipeObj.stderr.read()), daemon=True)
+        reader.start()
+        try:
+            with open(inFile, 'rb') as f:
+                SendFileRange(f.fileno(), pipeObj.stdin, start, end - start, onProgress=onProgress)
+            pipeObj.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg gave up, its error is reported below
+            pass
+        reader.join()
+        pipeObj.wait()
+    if pipeObj.returncode != 0:
+        raise EncodingError(f'remuxing bytes {start}-{end} of "{inFile.name}" failed with exit code {pipeObj.returncode}: {b"".join(errors).decode(errors="replace").strip()}')
+
+@Instrumented('ConcatClips')
+def ConcatClips(inFile: Path, ptsMap: PtsMap, clips: list, output: Path, pids=None, jobs=2, progress: Progress | None = None) -> Path:
+    """Remux the clips of inFile in parallel and join them in time order into output."""
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg not found in PATH — install ffmpeg or add it to PATH")
+    inFile, output = Path(inFile), Path(output)
+    if not inFile.is_file():
+        raise TsFileNotFound(f'"{inFile.name}" not found!')
+    programMap = _ReadFirstProgramMap(inFile)
+    if pids is None:
+        pids = [ pid for _, pid in programMap.streams ]
+    logger.info(f'Mapping PIDs {", ".join(f"{pid:#x}" for pid in pids)}')
+    if programMap.pcrPid not in pids:
+        logger.info(f'PCR PID {programMap.pcrPid:#x} is not mapped, the PCR moves to the video stream')
+    clips = sorted(clips)
+    ranges = [ ptsMap.ClipByteRange(clip) for clip in clips ]
+
+    tid = "concat_clips"
+    if progress is not None:
+        progress.add_task(tid, sum(end - start for start, end in ranges), f"Remuxing {len(clips)} clips", unit="B")
+    copied = 0
+    lock = threading.Lock()
+    def OnProgress(n):
+        nonlocal copied
+        with lock:
+            copied += n
+            if progress is not None:
+                progress.update(tid, copied)
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    # next to the output, so that the result is moved into place without a copy
+    with tempfile.TemporaryDirectory(prefix='.tscutter-concat-', dir=output.parent) as workFolder:
+        workFolder = Path(workFolder)
+        clipPaths = [ workFolder / f'clip_{i:04d}.ts' for i in range(len(clips)) ]
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(lambda i: _RemuxClip(ffmpeg, inFile, ranges[i], pids, clipPaths[i], OnProgress), range(len(clips))))
+        listPath = workFolder / 'clips.ffconcat'
+        listPath.write_text('ffconcat version 1.0\n' + ''.join(f'stream\nexact_stream_id {pid}\n' for pid in pids) + ''.join(f"file '{path.name}'\n" for path in clipPaths))
+        joinedPath = workFolder / 'joined.ts'
+        args = [ ffmpeg, '-hide_banner', '-nostats', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', str(listPath) ] + _CopyArgs([ '0' ], joinedPath, _PidArgs(programMap, pids))
+        with _FfmpegProcess(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as pipeObj:
+            _, stderr = pipeObj.communicate()
+        if pipeObj.returncode != 0:
+            raise EncodingError(f'joining {len(clips)} clips of "{inFile.name}" failed with exit code {pipeObj.returncode}: {stderr.decode(errors="replace").strip()}')
+        os.replace(joinedPath, output)
+    if progress is not None:
+        progress.done(tid)
+    return output
@@ -0,0 +1,94 @@
+"""Audio level envelope of a TS file, and silence detection on it.
+
+analyze keeps the dBFS level of every 10 ms block of the audio next to the
+.ptsmap. Silence detection for any minimal length and threshold is then a
+few vectorized operations on that envelope instead of decoding the audio
+again, which is what `tscutter sweep` uses to try a whole grid of them. The
+windows are on the block grid, like `analyze --single-pass`.
+"""
+
+from pathlib import Path
+import numpy as np
+
+# amplitude of 0 dBFS, as in SilenceDetector
+FULL_SCALE = 0x8000
+
+class Envelope:
+    def __init__(self, db: np.ndarray, sampleRate=48000, blockMs=10, fileSize: int = 0, fileMtime: int = 0) -> None:
+        self.db = db
+        self.sampleRate = sampleRate
+        self.blockMs = blockMs
+        self.fileSize = fileSize
+        self.fileMtime = fileMtime
+
+    @classmethod
+    def FromLevels(cls, levels: np.ndarray, tsPath: Path, sampleRate=48000, blockMs=10) -> 'Envelope':
+        """Envelope of the sums of squares per block given by DetectSilence() or ExtractFileProps()."""
+        blockSamples = sampleRate * blockMs // 1000
+        with np.errstate(divide='ignore'):
+            db = 10 * np.log10(np.asarray(levels, dtype=np.float64) / blockSamples / FULL_SCALE ** 2)
+        stat = Path(tsPath).stat()
+        return cls(db.astype(np.float32), sampleRate, blockMs, stat.st_size, stat.st_mtime_ns)
+
+    def __len__(self):
+        return len(self.db)
+
+    def MeanSquares(self) -> np.ndarray:
+        return FULL_SCALE ** 2 * 10 ** (self.db.astype(np.float64) / 10)
+
+    def IsUpToDate(self, tsPath: Path) -> bool:
+        stat = Path(tsPath).stat()
+        return stat.st_size == self.fileSize and stat.st_mtime_ns == self.fileMtime
+
+    def Save(self, path: Path):
+        # readers never see a half written envelope
+        tmpPath = Path(path).with_name(Path(path).name + '.tmp')
+        with tmpPath.open('wb') as f:
+            np.savez(f, db=self.db, sampleRate=self.sampleRate, blockMs=self.blockMs, fileSize=self.fileSize, fileMtime=self.fileMtime)
+        tmpPath.replace(path)
+
+    @classmethod
+    def Load(cls, path: Path) -> 'Envelope':
+        with np.load(path) as data:
+            return cls(data['db'], int(data['sampleRate']), int(data['blockMs']), int(data['fileSize']), int(data['fileMtime']))
+
+def EnvelopePath(indexPath: Path) -> Path:
+    return Path(indexPath).with_suffix('.envelope')
+
+def _WindowRms(meanSquares, window) -> np.ndarray:
+    csum = np.concatenate(([ 0.0 ], np.cumsum(meanSquares)))
+    return np.floor(np.sqrt(np.maximum(csum[window:] - csum[:-window], 0) / window))
+
+def _Periods(silent, blockMs, minSilenceLen) -> np.ndarray:
+    # runs of silent window starts closer than minSilenceLen make one period, like SilenceDetector._Merge()
+    starts = np.flatnonzero(silent) * blockMs
+    if len(starts) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(starts) > minSilenceLen)
+    return np.stack((starts[np.concatenate(([ 0 ], breaks + 1))], starts[np.concatenate((breaks, [ len(starts) - 1 ]))] + minSilenceLen), axis=1)
+
+def DetectSilenceFromEnvelope(envelope: Envelope, min_silence_len=800, silence_thresh=-80) -> list:
+    window = max(1, round(min_silence_len / envelope.blockMs))
+    if len(envelope) < window:
+        return []
+    rms = _WindowRms(envelope.MeanSquares(), window)
+    return _Periods(rms <= 10 ** (silence_thresh / 20) * FULL_SCALE, envelope.blockMs, min_silence_len).tolist()
+
+def SweepSilence(envelope: Envelope, lengths, thresholds) -> list[dict]:
+    """Silences found for every min_silence_len in lengths (ms) and silence_thresh in thresholds (dB)."""
+    meanSquares = envelope.MeanSquares()
+    results = []
+    for length in lengths:
+        window = max(1, round(length / envelope.blockMs))
+        rms = _WindowRms(meanSquares, window) if len(envelope) >= window else np.zeros(0)
+        for threshold in thresholds:
+            periods = _Periods(rms <= 10 ** (threshold / 20) * FULL_SCALE, envelope.blockMs, length)
+            results.append({
+                'length': length,
+                'threshold': threshold,
+                'silences': len(periods),
+                # periods that overlap are one interval for the cut position search, like MergeIntervals()
+                'intervals': int(len(periods) and 1 + np.count_nonzero(periods[1:, 0] > periods[:-1, 1])),
+                'silentSeconds': round(float((periods[:, 1] - periods[:, 0]).sum()) / 1000, 3),
+            })
+    return results
@@ -0,0 +1,111 @@
+"""Probe a TS file from the packets at its head and its tail.
+
+FastProbe() reads the first HEAD_PACKETS and the last TAIL_PACKETS packets
+only, so it takes a few milliseconds whatever the size of the file:
+
+  serviceId, soundTracks  the PAT and the PMT of the program on air
+  duration                the first and the last video PTS, or PCR without video
+  width, height, fps,     the first MPEG-1/2 sequence header and its extension,
+  sar, dar                as signalled, without the display extension
+
+Fields it cannot determine are left out, such as the picture of H.264 and
+HEVC video whose parameter sets it does not parse, and InputFile.GetInfo()
+takes them from ffprobe.
+"""
+
+from fractions import Fraction
+from pathlib import Path
+import numpy as np
+from .mpegts import FindSyncOffset, MappedPackets, PacketPids, PacketView, PayloadOffsets, ReadProgramMap, _FindPesStarts, PTS_CLOCK, PTS_WRAP, TS_PACKET_SIZE, TS_SYNC_BYTE
+
+HEAD_PACKETS = 1 << 15
+TAIL_PACKETS = 1 << 14
+# PES headers at the start searched for the earliest PTS, B frames come after their reference
+START_FRAMES = 32
+
+# frame_rate_code and aspect_ratio_information of the sequence header
+FRAME_RATES = { 1: Fraction(24000, 1001), 2: Fraction(24), 3: Fraction(25), 4: Fraction(30000, 1001), 5: Fraction(30), 6: Fraction(50), 7: Fraction(60000, 1001), 8: Fraction(60) }
+DISPLAY_ASPECT_RATIOS = { 2: Fraction(4, 3), 3: Fraction(16, 9), 4: Fraction(221, 100) }
+
+def _Ratio(fraction) -> list[str]:
+    # as split from ffprobe's "num:den"
+    return [ str(fraction.numerator), str(fraction.denominator) ]
+
+def _Payloads(packets, pid) -> bytes:
+    rows = packets[PacketPids(packets) == pid]
+    return rows[np.arange(TS_PACKET_SIZE) >= PayloadOffsets(rows)[:, None]].tobytes()
+
+def _SequenceHeader(es: bytes) -> dict:
+    at = es.find(b'\x00\x00\x01\xb3')
+    if at < 0 or at + 8 > len(es):
+        return {}
+    header = es[at + 4:at + 8]
+    width, height = header[0] << 4 | header[1] >> 4, (header[1] & 0x0f) << 8 | header[2]
+    aspect, fps = header[3] >> 4, FRAME_RATES.get(header[3] & 0x0f)
+    # MPEG-2 follows the sequence header with its extension, after the quantiser matrices
+    extension = es.find(b'\x00\x00\x01\xb5', at + 8)
+    isMpeg2 = 0 <= extension and extension + 10 <= len(es) and es[extension + 4] >> 4 == 1
+    if isMpeg2:
+        ext = es[extension + 4:extension + 10]
+        width |= ((ext[1] & 0x01) << 1 | ext[2] >> 7) << 12
+        height |= (ext[2] >> 5 & 0x03) << 12
+        if fps is not None:
+            fps *= Fraction((ext[5] >> 5 & 0x03) + 1, (ext[5] & 0x1f) + 1)
+    if width == 0 or height == 0:
+        return {}
+    result = { 'width': width, 'height': height }
+    if fps is not None:
+        result['fps'] = float(fps)
+    if aspect == 1:
+        result['sar'], result['dar'] = _Ratio(Fraction(1)), _Ratio(Fraction(width, height))
+    elif isMpeg2 and aspect in DISPLAY_ASPECT_RATIOS:
+        # MPEG-1 signals the sample aspect ratio itself with other codes
+        dar = DISPLAY_ASPECT_RATIOS[aspect]
+        result['sar'], result['dar'] = _Ratio(dar * height / width), _Ratio(dar)
+    return result
+
+def _Relative(pts) -> np.ndarray:
+    # to the first one, across a wrap of the 33 bit clock
+    pts = np.asarray(pts, dtype=np.int64)
+    return (pts - pts[0] + PTS_WRAP // 2) % PTS_WRAP - PTS_WRAP // 2
+
+def _Earliest(pts) -> int:
+    return int(pts[0] + _Relative(pts).min())
+
+def _Latest(pts) -> int:
+    return int(pts[0] + _Relative(pts).max())
+
+def _Pcrs(packets, pid) -> np.ndarray:
+    rows = packets[(PacketPids(packets) == pid) & (packets[:, 3] & 0x20 != 0) & (packets[:, 4] >= 7) & (packets[:, 5] & 0x10 != 0)]
+    b = [ rows[:, 6 + k].astype(np.int64) for k in range(5) ]
+    return b[0] << 25 | b[1] << 17 | b[2] << 9 | b[3] << 1 | b[4] >> 7
+
+def FastProbe(path: Path, headPackets=HEAD_PACKETS, tailPackets=TAIL_PACKETS) -> dict:
+    """The VideoInfo fields of path found at its head and tail, raises InvalidTsFormat if it is no TS or has no PMT."""
+    with MappedPackets(path) as (mm, offset, count):
+        head = PacketView(mm, offset, 0, min(count, headPackets))
+        programMap = ReadProgramMap(head)
+        result = { 'serviceId': programMap.serviceId, 'soundTracks': len(programMap.AudioPids()) }
+        # the tail is aligned on its own, packets may have been lost in between
+        tailStart = max(offset, len(mm) - tailPackets * TS_PACKET_SIZE)
+        tailOffset = tailStart + FindSyncOffset(mm[tailStart:tailStart + TS_PACKET_SIZE * 9])
+        tail = PacketView(mm, tailOffset, 0, (len(mm) - tailOffset) // TS_PACKET_SIZE)
+        tail = tail[tail[:, 0] == TS_SYNC_BYTE]
+        videoPid = programMap.VideoPid()
+        if videoPid is not None:
+            if programMap.VideoStreamType() in (0x01, 0x02):
+                result |= _SequenceHeader(_Payloads(head, videoPid))
+            _, _, _, firstPts = _FindPesStarts(head, videoPid)
+            _, _, _, lastPts = _FindPesStarts(tail, videoPid)
+            if len(firstPts) and len(lastPts):
+                span = (_Latest(lastPts) - _Earliest(firstPts[:START_FRAMES])) % PTS_WRAP
+                # up to the end of the last frame, like ffprobe
+                steps = np.diff(np.sort(_Relative(lastPts)))
+                frameTicks = PTS_CLOCK / result['fps'] if 'fps' in result else int(steps[steps > 0].min(initial=0))
+                result['duration'] = (span + frameTicks) / PTS_CLOCK
+        if 'duration' not in result:
+            firstPcrs, lastPcrs = _Pcrs(head, programMap.pcrPid), _Pcrs(tail, programMap.pcrPid)
+            if len(firstPcrs) and len(lastPcrs):
+                result['duration'] = ((_Latest(lastPcrs) - _Earliest(firstPcrs[:1])) % PTS_WRAP) / PTS_CLOCK
+        del head, tail
+    return result
@@ -1,13 +1,25 @@
+from collections import deque
+from contextlib import contextmanager
 from functools import cache
 import json
-import shutil, subprocess, tempfile
+import io, logging, os, queue, shutil, subprocess, tempfile, threading
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, fields
 from ._progress import Progress
 import numpy as np
 from PIL import Image
 import ffmpeg
 from .common import TsFileNotFound, InvalidTsFormat
+from .fastprobe import FastProbe
+from .mpegts import PTS_CLOCK
+from .cache import Cache, CacheEntry
+from .stats import Count, Instrumented, ReapChild
+from .metrics import DEFAULT_METRIC, MetricEngine
+
+logger = logging.getLogger('tscutter.ffmpeg')
+
+# stderr lines of a failed ffmpeg kept for its error message
+ERROR_LINES = 10
 
 @dataclass
 class VideoInfo:
@@ -20,8 +32,44 @@ class VideoInfo:
     soundTracks: int
     serviceId: int
 
+# per-frame table of the single-pass decode
+FrameTableDType = np.dtype([('ptsTime', 'f8'), ('pos', 'i8'), ('isKey', 'u1'), ('type', 'U1'), ('sad', 'f8')])
+
+@dataclass
+class FileProps:
+    frames: np.ndarray      # FrameTableDType, in output order
+    levels: np.ndarray      # sum of squares of the mono audio per block
+    sampleRate: int
+    blockMs: int = 10
+
+# decoded in front of a missing range so that its first frame gets a real SAD
+CACHE_LEAD_IN = 0.5
+
+# caps the ffmpeg decoders running at once, shared across batch workers
+_ffmpegSlots = None
+
+def SetFfmpegBudget(slots):
+    """Make every decode hold one of slots (a semaphore, or None for no limit)."""
+    global _ffmpegSlots
+    _ffmpegSlots = slots
+
+@contextmanager
+def _FfmpegProcess(args, **kwargs):
+    slots = _ffmpegSlots
+    if slots is not None:
+        slots.acquire()
+    try:
+        with subprocess.Popen(args, **kwargs) as pipeObj:
+            try:
+                yield pipeObj
+            finally:
+                ReapChild(pipeObj)
+    finally:
+        if slots is not None:
+            slots.release()
+
 class InputFile:
-    def __init__(self, path) -> None:
+    def __init__(self, path, cache: Cache | None = None, fastProbe=False) -> None:
         self.ffmpeg = shutil.which('ffmpeg')
         self.ffprobe = shutil.which('ffprobe')
         self.ffmpeg5 = shutil.which('ffmpeg5')
@@ -32,35 +80,55 @@ class InputFile:
         self.path = Path(path)
         if not self.path.is_file():
             raise TsFileNotFound(f'"{self.path.name}" not found!')
+        self.cache = cache
+        # read what it can from the packets instead of running ffprobe
+        self.fastProbe = fastProbe
+        self._info = None
+        self._cacheEntry = None
+
+    def _CacheEntry(self) -> CacheEntry | None:
+        if self.cache is not None and self._cacheEntry is None:
+            self._cacheEntry = self.cache.Entry(self.path)
+        return self._cacheEntry
     
-    @cache
+    def _CachedInfo(self) -> VideoInfo | None:
+        cacheEntry = self._CacheEntry()
+        if cacheEntry is not None and (probe := cacheEntry.GetProbe()) is not None:
+            return VideoInfo(**probe)
+        return None
+
     def GetInfo(self) -> VideoInfo:
+        if self._info is None:
+            if (info := self._CachedInfo()) is not None:
+                self._info = info
+                return info
+            probed = self._FastProbe()
+            if not _IsComplete(probed):
+                try:
+                    probeInfo = ffmpeg.probe(str(self.path), cmd=self.ffprobe, show_programs=None)
+                except (ffmpeg.Error, json.JSONDecodeError, KeyError):
+                    raise InvalidTsFormat(f'"{self.path.name}" is invalid!')
+                probed = asdict(_ProbeToVideoInfo(probeInfo)) | probed
+            self._SetInfo(VideoInfo(**probed))
+        return self._info
+
+    def _FastProbe(self) -> dict:
+        """The fields FastProbe() finds with fastProbe, to be completed by ffprobe."""
+        if not self.fastProbe:
+            return {}
         try:
-            probeInfo = ffmpeg.probe(str(self.path), cmd=self.ffprobe, show_programs=None)
-        except (ffmpeg.Error, json.JSONDecodeError, KeyError):
-            raise InvalidTsFormat(f'"{self.path.name}" is invalid!')
+            return FastProbe(self.path)
+        except (InvalidTsFormat, ValueError) as e:
+            logger.debug(f'Fast probe of "{self.path.name}" failed: {e}')
+            return {}
 
-        video_stream = next(s for s in probeInfo['streams'] if s.get('codec_type') == 'video')
-        audio_streams = [s for s in probeInfo['streams'] if s.get('codec_type') == 'audio']
-
-        videoInfo = VideoInfo(
-            duration = float(video_stream['duration']),
-            width = video_stream['width'],
-            height = video_stream['height'],
-            fps = eval(video_stream['avg_frame_rate']),
-            sar = video_stream['sample_aspect_ratio'].split(':'),
-            dar = video_stream['display_aspect_ratio'].split(':'),
-            soundTracks = len(audio_streams),
-            serviceId = next(p['program_id'] for p in probeInfo['programs'] if p['nb_streams'] > 0),
-        )
-        return videoInfo
-
-    def ExtractStream(self, output=None, ss=0, to=999999, videoTracks=None, audioTracks=None, toWav=False, progress: Progress | None = None):
-        output = self.path.with_suffix('') if output is None else Path(output)
-        if output.is_dir():
-            shutil.rmtree(output)
-        output.mkdir(parents=True)
+    def _SetInfo(self, videoInfo: VideoInfo):
+        cacheEntry = self._CacheEntry()
+        if cacheEntry is not None:
+            cacheEntry.PutProbe(asdict(videoInfo))
+        self._info = videoInfo
 
+    def _ExtractStreamArgs(self, output, ss, to, videoTracks, audioTracks, toWav, info: VideoInfo) -> list:
         args = [
                 self.ffmpeg, '-hide_banner', '-y',
                 '-ss', str(ss), '-to', str(to), '-i', str(self.path),
@@ -73,7 +141,6 @@ class InputFile:
             args += [  '-map', f'0:v:{i}', '-c:v', 'copy', output / f'video_{i}.ts' ]
 
         # copy audio tracks or decode to WAV
-        info = self.GetInfo()
         extName = 'wav' if toWav else 'aac'
         if audioTracks is None:
             audioTracks =  list(range(info.soundTracks))
@@ -85,37 +152,291 @@ class InputFile:
             else:
                 args += [ '-c:a', 'copy' ]
             args += [ output / f'audio_{i}.{extName}' ]
+        return args
+
+    @Instrumented('ExtractStream')
+    def ExtractStream(self, output=None, ss=0, to=999999, videoTracks=None, audioTracks=None, toWav=False, progress: Progress | None = None):
+        output = _StreamFolder(self.path, output)
+        info = self.GetInfo()
+        args = self._ExtractStreamArgs(output, ss, to, videoTracks, audioTracks, toWav, info)
 
-        pipeObj = subprocess.Popen(args, stderr=subprocess.PIPE, universal_newlines='\r', errors='ignore')
         to = min(to, info.duration)
         total = to - ss
         tid = "extract_streams"
         if progress is not None:
             progress.add_task(tid, total, "Extracting streams", unit="s")
-        last_time = 0.0
+        with _FfmpegProcess(args, stderr=subprocess.PIPE, universal_newlines='\r', errors='ignore') as pipeObj:
+            for line in pipeObj.stderr:
+                time = _ParseProgressTime(line)
+                if time is not None and progress is not None:
+                    progress.update(tid, time)
+        if progress is not None:
+            progress.update(tid, total)
+            progress.done(tid)
+        Count(tempBytes=sum(path.stat().st_size for path in output.iterdir() if path.is_file()))
+
+    def _ReadAudioArgs(self, ss, to, track, sampleRate) -> list:
+        return [
+            self.ffmpeg, '-hide_banner', '-nostats', '-loglevel', 'error',
+            '-ss', str(ss), '-to', str(to), '-i', str(self.path),
+            '-map', f'0:a:{track}', '-vn', '-sn', '-dn',
+            # to sync corrputed sound tracks with the actual video length
+            '-af', 'aresample=async=1', '-ac', '1', '-ar', str(sampleRate),
+            '-f', 's16le', '-acodec', 'pcm_s16le', '-',
+        ]
+
+    def ReadAudio(self, ss=0, to=999999, track=0, sampleRate=48000, chunkSeconds=10, progress: Progress | None = None):
+        info = self.GetInfo()
+        args = self._ReadAudioArgs(ss, to, track, sampleRate)
+
+        to = min(to, info.duration)
+        total = to - ss
+        tid = "extract_streams"
+        if progress is not None:
+            progress.add_task(tid, total, "Extracting streams", unit="s")
+        chunkBytes = int(sampleRate * chunkSeconds) * 2
+        samplesRead = 0
+        # the last lines are enough to tell why the decode failed
+        errors = deque(maxlen=ERROR_LINES)
+        with _FfmpegProcess(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as pipeObj:
+            reader = threading.Thread(target=lambda: errors.extend(io.TextIOWrapper(pipeObj.stderr, errors='ignore')), daemon=True)
+            reader.start()
+            data = None
+            try:
+                while True:
+                    data = pipeObj.stdout.read(chunkBytes)
+                    if not data:
+                        break
+                    samples = np.frombuffer(data[:len(data) // 2 * 2], dtype='<i2')
+                    samplesRead += len(samples)
+                    Count(pipeBytes=len(data))
+                    if progress is not None:
+                        progress.update(tid, min(samplesRead / sampleRate, total))
+                    yield samples
+            finally:
+                # ffmpeg exits by itself after EOF, only a consumer that stopped early leaves it running
+                if data:
+                    pipeObj.kill()
+                reader.join()
+        if pipeObj.returncode != 0:
+            raise InvalidTsFormat(f'decoding the audio of "{self.path.name}" failed with exit code {pipeObj.returncode}: {_ErrorTail(errors)}')
+        if progress is not None:
+            progress.update(tid, total)
+            progress.done(tid)
+
+    def _ReadShowInfo(self, pipeObj, ss, to, progress=None, onFrame=None, pesIndex=None):
+        propList = []
+        to = min(to, self.GetInfo().duration)
+        total = to - ss
+        tid = "extract_props"
+        if progress is not None:
+            progress.add_task(tid, total, "Extracting frame props", unit="s")
         for line in pipeObj.stderr:
-            if 'time=' in line:
-                for item in line.split(' '):
-                    if item.startswith('time='):
-                        timeFields = item.replace('time=', '').split(':')
-                        try:
-                            time = float(timeFields[0]) * 3600 + float(timeFields[1]) * 60 + float(timeFields[2])
-                        except ValueError:
-                            continue
-                        if progress is not None:
-                            progress.update(tid, time)
-                        last_time = time
+            if 'pts_time:' in line:
+                prop = _ParseShowInfo(line, ss, pesIndex)
+                propList.append(prop)
+                if onFrame is not None:
+                    onFrame(*_FrameSize(line))
+                if progress is not None:
+                    progress.update(tid, prop['ptsTime'] - ss, frames=len(propList))
         if progress is not None:
             progress.update(tid, total)
             progress.done(tid)
-        pipeObj.wait()
+        return propList
+
+    def _FramePropsPipeArgs(self, ss, to, pesIndex=None, keyFramesOnly=False) -> list:
+        return [
+            self.ffmpeg5, '-hide_banner',
+        ] + ([ '-skip_frame', 'nokey' ] if keyFramesOnly else []) + [
+            '-ss', str(ss), '-to', str(to),
+            '-i', str(self.path),
+        ] + _CopyTsArgs(pesIndex) + [
+            '-filter:v', "select='gte(t,0)',showinfo", '-vsync', '0',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-',
+        ]
+
+    def _ExtractFramePropsPipe(self, ss, to, progress=None, pesIndex=None, keyFramesOnly=False, metric=DEFAULT_METRIC):
+        args = self._FramePropsPipeArgs(ss, to, pesIndex, keyFramesOnly)
+        sampler = _FrameSampler(metric)
+        with _FfmpegProcess(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as pipeObj:
+            pipeObj.stderr = io.TextIOWrapper(pipeObj.stderr, errors='ignore')
+            reader = threading.Thread(target=sampler.Read, args=(pipeObj.stdout,), daemon=True)
+            reader.start()
+            try:
+                propList = self._ReadShowInfo(pipeObj, ss, to, progress=progress, onFrame=lambda w, h: sampler.frameSizes.put((w, h)), pesIndex=pesIndex)
+            except BaseException:
+                # nobody reads stderr any more, ffmpeg would block on it and never close stdout
+                pipeObj.kill()
+                raise
+            finally:
+                sampler.frameSizes.put(None)
+                reader.join()
+        Count(pipeBytes=sampler.pipeBytes)
+        return propList, sampler.Results().tolist()
+
+    @Instrumented('ExtractFileProps')
+    def ExtractFileProps(self, sampleRate=48000, blockMs=10, pesIndex=None, metric=DEFAULT_METRIC, progress: Progress | None = None) -> FileProps:
+        info = self.GetInfo()
+        blockSamples = sampleRate * blockMs // 1000
+        audioRead, audioWrite = os.pipe()
+        args = [
+            self.ffmpeg5, '-hide_banner', '-i', str(self.path),
+        ] + _CopyTsArgs(pesIndex) + [
+            '-map', '0:v:0', '-filter:v', "select='gte(t,0)',showinfo", '-vsync', '0',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1',
+            # to sync corrputed sound tracks with the actual video length
+            '-map', '0:a:0', '-af', 'aresample=async=1', '-ac', '1', '-ar', str(sampleRate),
+            '-f', 's16le', '-acodec', 'pcm_s16le', f'pipe:{audioWrite}',
+        ]
+        # full frames are piped and subsampled here, so that the SADs are the
+        # same as the ones of ExtractFrameProps()
+        sampler = _FrameSampler(metric)
+        levelList = []
+
+        def ReadLevels(fd):
+            with open(fd, 'rb') as f:
+                carry = np.zeros(0, dtype=np.int64)
+                while data := f.read(blockSamples * 2 * 1000):
+                    samples = np.concatenate((carry, np.frombuffer(data[:len(data) // 2 * 2], dtype='<i2').astype(np.int64)))
+                    full = len(samples) // blockSamples * blockSamples
+                    levelList.append((samples[:full] ** 2).reshape(-1, blockSamples).sum(axis=1))
+                    carry = samples[full:]
+                if len(carry):
+                    levelList.append(np.array([ (carry ** 2).sum() ]))
+
+        # the last lines that are no showinfo output tell why the decode failed
+        errors = deque(maxlen=ERROR_LINES)
+        try:
+            with _FfmpegProcess(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, pass_fds=(audioWrite,)) as pipeObj:
+                os.close(audioWrite)
+                audioWrite = None
+                pipeObj.stderr = io.TextIOWrapper(pipeObj.stderr, errors='ignore')
+                readers = [
+                    threading.Thread(target=sampler.Read, args=(pipeObj.stdout,), daemon=True),
+                    threading.Thread(target=ReadLevels, args=(audioRead,), daemon=True),
+                ]
+                for reader in readers:
+                    reader.start()
+                # ReadLevels() closes it
+                audioRead = None
+                rows = []
+                tid = "extract_file_props"
+                if progress is not None:
+                    progress.add_task(tid, info.duration, "Decoding video and audio", unit="s")
+                try:
+                    for line in pipeObj.stderr:
+                        if 'pts_time:' in line:
+                            ptsTime, pos = _ParsePtsPos(line, 0, pesIndex)
+                            isKey = int(line.split(' iskey:')[1].split(' ')[0])
+                            frameType = line.split(' type:')[1].split(' ')[0]
+                            rows.append((ptsTime, pos, isKey, frameType, 0.0))
+                            sampler.frameSizes.put(_FrameSize(line))
+                            if progress is not None:
+                                progress.update(tid, ptsTime, frames=len(rows))
+                        elif 'Parsed_showinfo' not in line:
+                            errors.append(line)
+                except BaseException:
+                    # nobody reads stderr any more, ffmpeg would block on it and never close its pipes
+                    pipeObj.kill()
+                    raise
+                finally:
+                    sampler.frameSizes.put(None)
+                    for reader in readers:
+                        reader.join()
+        finally:
+            # ffmpeg did not start
+            for fd in (audioRead, audioWrite):
+                if fd is not None:
+                    os.close(fd)
+        if pipeObj.returncode != 0:
+            raise InvalidTsFormat(f'decoding "{self.path.name}" failed with exit code {pipeObj.returncode}: {_ErrorTail(errors)}')
+        if progress is not None:
+            progress.update(tid, info.duration)
+            progress.done(tid)
 
-    def ExtractFrameProps(self, ss, to, nosad=False, progress=None):
+        frames = np.array(rows, dtype=FrameTableDType)
+        sads = sampler.Results()
+        # the decode is corrupted if frames and their metadata do not line up
+        if len(sads) != len(frames):
+            raise InvalidTsFormat(f'"{self.path.name}" is invalid!')
+        frames['sad'] = sads
+        levels = np.concatenate(levelList) if levelList else np.zeros(0, dtype=np.int64)
+        Count(frames=len(frames), pipeBytes=sampler.pipeBytes + len(levels) * blockSamples * 2)
+        return FileProps(frames=frames, levels=levels, sampleRate=sampleRate, blockMs=blockMs)
+
+    @Instrumented('ExtractKeyFrameProps')
+    def ExtractKeyFrameProps(self, ss, to, pesIndex=None, metric=DEFAULT_METRIC, progress=None):
+        """Like ExtractFrameProps() but only decodes key frames, sad compares each with the previous key frame."""
+        return self._ExtractFrameProps(ss, to, pesIndex=pesIndex, metric=metric, progress=progress, keyFramesOnly=True)
+
+    @Instrumented('ExtractFrameProps')
+    def ExtractFrameProps(self, ss, to, nosad=False, usePipe=True, pesIndex=None, metric=DEFAULT_METRIC, progress=None):
+        """Frame properties of [ss, to], with the scene change metric of each frame in 'sad'."""
+        cacheEntry = self._CacheEntry()
+        if cacheEntry is None or nosad:
+            return self._ExtractFrameProps(ss, to, nosad=nosad, usePipe=usePipe, pesIndex=pesIndex, metric=metric, progress=progress)
+
+        # only PES timestamps (-copyts) are the same whatever the seek point,
+        # so only then can windows from different decodes be stitched together
+        mode = 'showinfo' if pesIndex is None else 'pes'
+        # other metrics are kept apart from the SADs
+        segmentMode = mode if metric == DEFAULT_METRIC else f'{mode}-{metric}'
+        to = min(to, self.GetInfo().duration)
+        segments, tables = [], []
+        for segment in cacheEntry.Segments(segmentMode):
+            if segment['ss'] <= to and segment['to'] >= ss:
+                if mode == 'showinfo' and not (segment['ss'] <= ss and segment['to'] >= to):
+                    continue
+                try:
+                    tables.append(cacheEntry.LoadSegment(segment))
+                    segments.append(segment)
+                except (OSError, ValueError):
+                    # replaced by a concurrent search in the meantime
+                    pass
+                if mode == 'showinfo':
+                    break
+        gaps, cursor = [], ss
+        for segment in sorted(segments, key=lambda segment: segment['ss']):
+            if segment['ss'] > cursor:
+                gaps.append((cursor, segment['ss']))
+            cursor = max(cursor, segment['to'])
+        if cursor < to:
+            gaps.append((cursor, to))
+
+        for gapSs, gapTo in gaps:
+            leadIn = CACHE_LEAD_IN if segments else 0
+            propList = self._ExtractFrameProps(max(gapSs - leadIn, 0), gapTo, usePipe=usePipe, pesIndex=pesIndex, metric=metric, progress=progress)
+            if not propList:
+                return []
+            tables.append(_PropsToTable(propList))
+        table = np.concatenate(tables) if tables else np.zeros(0, dtype=FrameTableDType)
+        if gaps:
+            # the same frame decoded twice has the same position; the first
+            # frame of a decode has no predecessor and a SAD of 0, keep the other
+            table = table[np.lexsort((-table['sad'], table['pos']))]
+            _, firstIndices = np.unique(table['pos'], return_index=True)
+            table = table[firstIndices]
+            table = table[np.argsort(table['ptsTime'], kind='stable')]
+            newSs, newTo = min([ ss ] + [ s['ss'] for s in segments ]), max([ to ] + [ s['to'] for s in segments ])
+            replaces = segments + [ s for s in cacheEntry.Segments(segmentMode) if newSs <= s['ss'] and s['to'] <= newTo and s not in segments ]
+            cacheEntry.PutSegment(segmentMode, newSs, newTo, table, replaces=replaces)
+        return _TableToProps(table[(table['ptsTime'] >= ss) & (table['ptsTime'] <= to)])
+
+    def _ExtractFrameProps(self, ss, to, nosad=False, usePipe=True, pesIndex=None, metric=DEFAULT_METRIC, progress=None, keyFramesOnly=False):
+        if (nosad or not usePipe) and not keyFramesOnly:
+            propList, sadList = self._ExtractFramePropsBmp(ss, to, nosad=nosad, progress=progress, pesIndex=pesIndex, metric=metric)
+        else:
+            propList, sadList = self._ExtractFramePropsPipe(ss, to, progress=progress, pesIndex=pesIndex, keyFramesOnly=keyFramesOnly, metric=metric)
+        Count(frames=len(propList))
+        return _TrimProps(propList, sadList, ss, min(to, self.GetInfo().duration), nosad=nosad)
+
+    def _ExtractFramePropsBmp(self, ss, to, nosad=False, progress=None, pesIndex=None, metric=DEFAULT_METRIC):
         with tempfile.TemporaryDirectory(prefix='logoNet_frames_') as tmpLogoFolder:
             args = [
                 self.ffmpeg5, '-hide_banner',
                 '-ss', str(ss), '-to', str(to),
                 '-i', str(self.path),
+            ] + _CopyTsArgs(pesIndex) + [
                 '-filter:v', "select='gte(t,0)',showinfo", '-vsync', '0', '-frame_pts', '1',
             ]
             if nosad:
@@ -127,65 +448,155 @@ class InputFile:
                 args += [
                     f'{tmpLogoFolder}/out%8d.bmp'
             ]
-            with subprocess.Popen(args, stderr=subprocess.PIPE, universal_newlines='\r', errors='ignore') as pipeObj:
-                propList = []
-                to = min(to, self.GetInfo().duration)
-                total = to - ss
-                tid = "extract_props"
-                if progress is not None:
-                    progress.add_task(tid, total, "Extracting frame props", unit="s")
-                last_pts = 0.0
-                for line in pipeObj.stderr:
-                    if 'pts_time:' in line:
-                        ptsTime = float(line.split('pts_time:')[1].lstrip().split(' ')[0])
-                        pos = int(line.split('pos:')[1].lstrip().split(' ')[0])
-                        checksum = line.split('checksum:')[1].split(' ')[0]
-                        planeChecksum = line.split('plane_checksum:')[1].split('[')[1].split(']')[0].split(' ')
-                        meanStrList = line.split('mean:')[1].split('\x08')[0].split(']')[0].lstrip('[').split()
-                        stdevStrList = line.split('stdev:')[1].split('\x08')[0].split(']')[0].lstrip('[').split()
-                        mean = [ float(i) for i in meanStrList ]
-                        stdev = [ float(i) for i in stdevStrList ]
-                        isKey = int(line.split(' iskey:')[1].split(' ')[0])
-                        frameType = line.split(' type:')[1].split(' ')[0]
-                        propList.append({
-                            'ptsTime': ptsTime + ss,
-                            'pos': pos,
-                            'checksum': checksum,
-                            'plane_checksum': planeChecksum,
-                            'mean': mean,
-                            'stdev': stdev,
-                            'isKey': isKey,
-                            'type': frameType,
-                        })
-                        last_pts = ptsTime
-                        if progress is not None:
-                            progress.update(tid, ptsTime)
-                if progress is not None:
-                    progress.update(tid, total)
-                    progress.done(tid)
+            with _FfmpegProcess(args, stderr=subprocess.PIPE, universal_newlines='\r', errors='ignore') as pipeObj:
+                propList = self._ReadShowInfo(pipeObj, ss, to, progress=progress, pesIndex=pesIndex)
+            sadList = []
             if not nosad:
                 pathList = sorted(list(Path(tmpLogoFolder).glob('*.bmp')))
+                Count(tempBytes=sum(path.stat().st_size for path in pathList))
                 # The clip is corrputed if we cannot extract any image
                 if len(pathList) == 0:
-                    return []
+                    return propList, sadList
                 originalSize = Image.open(pathList[0]).size
                 sadSize = round(originalSize[1] / 8), round(originalSize[0] / 8)
-                imageList = [ np.array(Image.open(path).resize(sadSize, Image.NEAREST)) / 255.0 for path in pathList ]
-                # The clip is corrputed if we cannot extract the same number of images
-                if len(imageList) != len(propList):
-                    return []
-            else:
-                imageList = []
-        for i, image in enumerate(imageList):
-            if i == 0:
-                sad = 0.0
-            else:
-                sad = np.sum(np.abs(image - imageList[i - 1])) / (sadSize[0] * sadSize[1] * 3)
-            propList[i]['sad'] = sad
-        for prop in propList[:]:
-            if prop['ptsTime'] < ss or prop['ptsTime'] > to:
-                propList.remove(prop)
-        for prop in propList[:]:
-            if prop['pos'] < 0:
-                propList.remove(prop)
-        return propList
+                engine = MetricEngine((sadSize[1], sadSize[0], 3), metrics=(metric,))
+                for path in pathList:
+                    with Image.open(path) as image:
+                        engine.Add(np.asarray(image.convert('RGB').resize(sadSize, Image.NEAREST)))
+                sadList = engine.Results()[metric].tolist()
+        return propList, sadList
+
+def _ProbeToVideoInfo(probeInfo) -> VideoInfo:
+    video_stream = next(s for s in probeInfo['streams'] if s.get('codec_type') == 'video')
+    audio_streams = [s for s in probeInfo['streams'] if s.get('codec_type') == 'audio']
+    return VideoInfo(
+        duration = float(video_stream['duration']),
+        width = video_stream['width'],
+        height = video_stream['height'],
+        fps = eval(video_stream['avg_frame_rate']),
+        sar = video_stream['sample_aspect_ratio'].split(':'),
+        dar = video_stream['display_aspect_ratio'].split(':'),
+        soundTracks = len(audio_streams),
+        serviceId = next(p['program_id'] for p in probeInfo['programs'] if p['nb_streams'] > 0),
+    )
+
+def _IsComplete(probed: dict) -> bool:
+    return all(field.name in probed for field in fields(VideoInfo))
+
+def _StreamFolder(path: Path, output) -> Path:
+    output = path.with_suffix('') if output is None else Path(output)
+    if output.is_dir():
+        shutil.rmtree(output)
+    output.mkdir(parents=True)
+    return output
+
+def _ParseProgressTime(line) -> float | None:
+    # the time= field of ffmpeg's stats line
+    for item in line.split(' '):
+        if item.startswith('time='):
+            timeFields = item.replace('time=', '').split(':')
+            try:
+                return float(timeFields[0]) * 3600 + float(timeFields[1]) * 60 + float(timeFields[2])
+            except (ValueError, IndexError):
+                return None
+    return None
+
+def _ParseShowInfo(line, ss, pesIndex) -> dict:
+    ptsTime, pos = _ParsePtsPos(line, ss, pesIndex)
+    checksum = line.split('checksum:')[1].split(' ')[0]
+    planeChecksum = line.split('plane_checksum:')[1].split('[')[1].split(']')[0].split(' ')
+    meanStrList = line.split('mean:')[1].split('\x08')[0].split(']')[0].lstrip('[').split()
+    stdevStrList = line.split('stdev:')[1].split('\x08')[0].split(']')[0].lstrip('[').split()
+    return {
+        'ptsTime': ptsTime,
+        'pos': pos,
+        'checksum': checksum,
+        'plane_checksum': planeChecksum,
+        'mean': [ float(i) for i in meanStrList ],
+        'stdev': [ float(i) for i in stdevStrList ],
+        'isKey': int(line.split(' iskey:')[1].split(' ')[0]),
+        'type': line.split(' type:')[1].split(' ')[0],
+    }
+
+def _ErrorTail(lines) -> str:
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+def _FrameSize(line) -> tuple[int, int]:
+    width, height = line.split(' s:')[1].split(' ')[0].split('x')
+    return int(width), int(height)
+
+class _FrameSampler:
+    """Reads rgb24 frames from an ffmpeg pipe and feeds their subsampled copies to a MetricEngine."""
+
+    def __init__(self, metric):
+        # showinfo logs every frame before it is written to stdout, so the
+        # stderr reader tells the stdout reader how large the next frame is
+        self.frameSizes = queue.Queue()
+        self.metric = metric
+        self.engine = None
+        self.pipeBytes = 0
+
+    def Read(self, stdout):
+        frame, sadSize = None, None
+        try:
+            while (size := self.frameSizes.get()) is not None:
+                width, height = size
+                if frame is None or frame.shape != (height, width, 3):
+                    frame = np.empty((height, width, 3), dtype=np.uint8)
+                if stdout.readinto(memoryview(frame).cast('B')) != frame.nbytes:
+                    break
+                self.pipeBytes += frame.nbytes
+                if sadSize is None:
+                    sadSize = round(height / 8), round(width / 8)
+                    self.engine = MetricEngine((sadSize[1], sadSize[0], 3), metrics=(self.metric,))
+                self.engine.Add(_Subsample(frame, sadSize))
+        finally:
+            # never leave ffmpeg blocked on a full stdout pipe
+            while stdout.read(1024 * 1024):
+                pass
+
+    def Results(self) -> np.ndarray:
+        return np.zeros(0) if self.engine is None else self.engine.Results()[self.metric]
+
+def _Subsample(frame, sadSize):
+    height, width = frame.shape[:2]
+    rows, cols = _NearestIndex(width, height, *sadSize)
+    return frame[rows[:, None], cols]
+
+def _TrimProps(propList, sadList, ss, to, nosad=False):
+    if not nosad:
+        # The clip is corrputed if we cannot extract the same number of images
+        if len(sadList) == 0 or len(sadList) != len(propList):
+            return []
+    for prop, sad in zip(propList, sadList):
+        prop['sad'] = sad
+    return [ prop for prop in propList if ss <= prop['ptsTime'] <= to and prop['pos'] >= 0 ]
+
+def _PropsToTable(propList):
+    return np.array([ tuple(prop[name] for name in FrameTableDType.names) for prop in propList ], dtype=FrameTableDType)
+
+def _TableToProps(table):
+    return [ dict(zip(FrameTableDType.names, row)) for row in table.tolist() ]
+
+def _CopyTsArgs(pesIndex):
+    # keep the PES timestamps so that frames can be looked up in the index
+    return [] if pesIndex is None else [ '-copyts' ]
+
+def _ParsePtsPos(line, ss, pesIndex):
+    if pesIndex is None:
+        ptsTime = float(line.split('pts_time:')[1].lstrip().split(' ')[0]) + ss
+        pos = int(line.split('pos:')[1].lstrip().split(' ')[0])
+    else:
+        # with -copyts, pts is the PES PTS itself (the TS time base is 1/90000)
+        pts = int(line.split(' pts:')[1].lstrip().split(' ')[0])
+        ptsTime = (pts - pesIndex.startPts) / PTS_CLOCK
+        pos = pesIndex.PosAt(pts)
+    return ptsTime, pos
+
+@cache
+def _NearestIndex(width, height, sadWidth, sadHeight):
+    # the source rows/columns PIL's NEAREST resize samples, so that
+    # subsampling the piped frames gives the same pixels as the BMP path
+    cols = np.array(Image.fromarray(np.arange(width, dtype=np.int32)[None, :], 'I').resize((sadWidth, 1), Image.NEAREST))[0]
+    rows = np.array(Image.fromarray(np.arange(height, dtype=np.int32)[:, None], 'I').resize((1, sadHeight), Image.NEAREST))[:, 0]
+    return rows, cols
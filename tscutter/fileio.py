@@ -0,0 +1,149 @@
+"""Byte range copies that stay in the kernel where possible.
+
+File to file copies go through copy_file_range, which lets the file system
+share extents (reflink) or copy server side where it can, and sendfile
+otherwise. File to pipe copies go through splice or sendfile. Whatever the
+platform or the file system does not support falls back to a buffered
+read/write loop.
+
+StreamRanges() copies many ranges in a row through a ring of buffers that a
+read-ahead thread keeps filled, so that reading and writing overlap.
+"""
+
+import errno, mmap, os, queue, stat, threading
+
+BUFSIZE = 1024 * 1024
+# kernel copies are issued in steps of this size so that progress can be reported
+KERNEL_STEP = 64 * 1024 * 1024
+# ring used by StreamRanges()
+READ_AHEAD_BUFSIZE = 8 * 1024 * 1024
+READ_AHEAD_DEPTH = 4
+
+_FALLBACK_ERRNOS = { errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.ENOTSOCK, errno.ETXTBSY }
+
+def _WriteAll(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def _CopyRange(srcFd, offset, length, kernelCopies, write, onProgress=None, bufsize=BUFSIZE) -> int:
+    done = 0
+    for copy in kernelCopies:
+        try:
+            while done < length:
+                n = copy(offset + done, min(KERNEL_STEP, length - done))
+                if n == 0:
+                    # not always EOF (procfs, FUSE, overlayfs), only the read below tells
+                    break
+                done += n
+                if onProgress is not None:
+                    onProgress(n)
+            if done == length:
+                return done
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+    os.lseek(srcFd, offset + done, os.SEEK_SET)
+    while done < length:
+        data = os.read(srcFd, min(bufsize, length - done))
+        if not data:
+            break
+        write(data)
+        done += len(data)
+        if onProgress is not None:
+            onProgress(len(data))
+    return done
+
+def CopyFileRange(srcFd, destFd, offset, length, onProgress=None, bufsize=BUFSIZE) -> int:
+    """Append length bytes at offset of srcFd to destFd, returns the bytes copied (less at EOF)."""
+    kernelCopies = []
+    if hasattr(os, 'copy_file_range'):
+        kernelCopies.append(lambda start, count: os.copy_file_range(srcFd, destFd, count, start))
+    if hasattr(os, 'sendfile'):
+        kernelCopies.append(lambda start, count: os.sendfile(destFd, srcFd, start, count))
+    return _CopyRange(srcFd, offset, length, kernelCopies, lambda data: _WriteAll(destFd, data), onProgress, bufsize)
+
+def SendFileRange(srcFd, pipe, offset, length, onProgress=None, bufsize=BUFSIZE) -> int:
+    """Write length bytes at offset of srcFd to the file object pipe, returns the bytes copied."""
+    try:
+        destFd = pipe.fileno()
+    except (AttributeError, OSError, ValueError):
+        destFd = None
+    kernelCopies = []
+    if destFd is not None:
+        pipe.flush()
+        if hasattr(os, 'splice') and stat.S_ISFIFO(os.fstat(destFd).st_mode):
+            kernelCopies.append(lambda start, count: os.splice(srcFd, destFd, count, offset_src=start))
+        if hasattr(os, 'sendfile'):
+            kernelCopies.append(lambda start, count: os.sendfile(destFd, srcFd, start, count))
+    return _CopyRange(srcFd, offset, length, kernelCopies, pipe.write, onProgress, bufsize)
+
+def _Advise(fd, offset, length, advice):
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, offset, length, advice)
+        except OSError:
+            pass
+
+def StreamRanges(srcFd, ranges, write, onProgress=None, bufsize=READ_AHEAD_BUFSIZE, depth=READ_AHEAD_DEPTH) -> int:
+    """Pass the (offset, length) ranges of srcFd to write() one after the other, returns the bytes copied.
+
+    A thread reads ahead into depth page-aligned buffers of bufsize bytes
+    while write() drains the ones filled before. write() gets a memoryview
+    that is only valid until it returns.
+    """
+    ranges = [ (int(offset), int(length)) for offset, length in ranges if length > 0 ]
+    # anonymous maps are page aligned
+    buffers = [ mmap.mmap(-1, bufsize) for _ in range(depth) ]
+    free, filled = queue.Queue(), queue.Queue()
+    for index in range(depth):
+        free.put(index)
+    stopped = threading.Event()
+
+    def ReadAhead():
+        try:
+            with open(srcFd, 'rb', buffering=0, closefd=False) as f:
+                if hasattr(os, 'POSIX_FADV_SEQUENTIAL'):
+                    _Advise(srcFd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                for i, (offset, length) in enumerate(ranges):
+                    # let the kernel fetch the next range while this one is read
+                    if i + 1 < len(ranges) and hasattr(os, 'POSIX_FADV_WILLNEED'):
+                        _Advise(srcFd, *ranges[i + 1], os.POSIX_FADV_WILLNEED)
+                    f.seek(offset)
+                    end = offset + length
+                    while offset < end:
+                        index = free.get()
+                        if stopped.is_set():
+                            return
+                        with memoryview(buffers[index]) as view, view[:min(bufsize, end - offset)] as target:
+                            n = f.readinto(target)
+                        if not n:
+                            free.put(index)
+                            break
+                        filled.put((index, n))
+                        offset += n
+            filled.put(None)
+        except BaseException as e:
+            filled.put(e)
+
+    reader = threading.Thread(target=ReadAhead, daemon=True)
+    reader.start()
+    copied = 0
+    try:
+        while (item := filled.get()) is not None:
+            if isinstance(item, BaseException):
+                raise item
+            index, n = item
+            with memoryview(buffers[index]) as view, view[:n] as data:
+                write(data)
+            free.put(index)
+            copied += n
+            if onProgress is not None:
+                onProgress(n)
+    finally:
+        stopped.set()
+        free.put(0)
+        reader.join()
+        for buffer in buffers:
+            buffer.close()
+    return copied
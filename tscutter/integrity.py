@@ -0,0 +1,209 @@
+"""Integrity pre-scan of a TS file.
+
+ScanIntegrity() walks the memory-mapped packets in chunks and checks, with
+vectorized operations on the (n, 188) views, the sync byte, the transport
+error indicator (TEI), the continuity counter of every PID and the gaps
+between the PCRs. Damaged packets close to each other make one
+DamagedRegion, placed on the timeline by the PCRs around it, so that
+AnalyzeVideo can keep its decodes out of them. Times are on the PCR clock,
+which stays within a fraction of a second of ffmpeg's.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+import numpy as np
+from ._progress import Progress
+from .common import TsFileNotFound
+from .mpegts import MappedPackets, PacketPids, _Resync, TS_PACKET_SIZE, TS_SYNC_BYTE, UnwrapPts
+from .stats import Count, Instrumented
+
+logger = logging.getLogger('tscutter.integrity')
+
+DAMAGE_KINDS = ('sync', 'tei', 'cc', 'pcr')
+NULL_PID = 0x1fff
+# twice the 100 ms allowed between PCRs by ISO/IEC 13818-1
+PCR_MAX_GAP = 0.2
+# damaged packets closer than this make one region
+MERGE_PACKETS = 1 << 12
+# seconds kept clear around a region, for the distance between the PCR and ffmpeg's timestamps
+DAMAGE_MARGIN = 0.5
+
+@dataclass
+class DamagedRegion:
+    start: int
+    end: int
+    ss: float | None
+    to: float | None
+    counts: dict = field(default_factory=dict)
+
+    def ToDict(self) -> dict:
+        return { 'start': self.start, 'end': self.end, 'ss': self.ss, 'to': self.to, **self.counts }
+
+class DamageMap:
+    def __init__(self, regions: list[DamagedRegion], packets: int, fileSize: int, pids: dict, pcrPid: int | None = None) -> None:
+        self.regions = regions
+        self.packets = packets
+        self.fileSize = fileSize
+        self.pids = pids
+        self.pcrPid = pcrPid
+
+    def __len__(self):
+        return len(self.regions)
+
+    def Totals(self) -> dict:
+        return { kind: sum(region.counts[kind] for region in self.regions) for kind in DAMAGE_KINDS }
+
+    def ToDict(self) -> dict:
+        return {
+            'packets': self.packets,
+            'bytes': self.fileSize,
+            'pcrPid': self.pcrPid,
+            **self.Totals(),
+            'pids': { f'{pid:#06x}': counts for pid, counts in sorted(self.pids.items()) },
+            'regions': [ region.ToDict() for region in self.regions ],
+        }
+
+    def Narrow(self, intervals, splitPosShift=1):
+        """Silence intervals (ms) whose decode windows stay out of the damaged regions, and the ones left out.
+
+        An interval whose window reaches into a region keeps its longest part
+        that is at least splitPosShift seconds away from any of them.
+        """
+        damaged = [ (region.ss - DAMAGE_MARGIN, region.to + DAMAGE_MARGIN) for region in self.regions if region.ss is not None ]
+        kept, skipped = [], []
+        for interval in intervals:
+            ss, to = interval[0] / 1000, interval[1] / 1000
+            pieces = [ (ss - splitPosShift, to + splitPosShift) ]
+            for damagedSs, damagedTo in damaged:
+                pieces = [ part for start, end in pieces for part in ((start, min(end, damagedSs)), (max(start, damagedTo), end)) if part[1] > part[0] ]
+            best = None
+            for start, end in pieces:
+                candidate = (max(ss, start + splitPosShift), min(to, end - splitPosShift))
+                if candidate[1] > candidate[0] and (best is None or candidate[1] - candidate[0] > best[1] - best[0]):
+                    best = candidate
+            if best is None:
+                skipped.append(interval)
+            else:
+                kept.append([ round(best[0] * 1000), round(best[1] * 1000) ])
+        return kept, skipped
+
+def _ScanChunk(packets, pos, state):
+    """Append the damage events of the packets at byte position pos to state."""
+    count = len(packets)
+    positions = pos + np.arange(count, dtype=np.int64) * TS_PACKET_SIZE
+    pids = PacketPids(packets)
+    state['packetCounts'] += np.bincount(pids, minlength=NULL_PID + 1)
+    tei = packets[:, 1] & 0x80 != 0
+    state['events'].append((positions[tei], positions[tei] + TS_PACKET_SIZE, np.full(np.count_nonzero(tei), DAMAGE_KINDS.index('tei'))))
+    state['teiCounts'] += np.bincount(pids[tei], minlength=NULL_PID + 1)
+
+    afc = packets[:, 3] >> 4 & 3
+    hasAf = (afc & 2 != 0) & (packets[:, 4] > 0)
+    discontinuity = hasAf & (packets[:, 5] & 0x80 != 0)
+    # the header of a packet with TEI set cannot be trusted
+    rows = np.flatnonzero((afc & 1 != 0) & ~tei & (pids != NULL_PID))
+    rows = rows[np.argsort(pids[rows], kind='stable')]
+    rowPids, cc = pids[rows], (packets[rows, 3] & 0x0f).astype(np.int16)
+    prev = np.empty(len(rows), dtype=np.int16)
+    prev[1:] = cc[:-1]
+    firsts = np.flatnonzero(np.diff(rowPids, prepend=-1) != 0)
+    lastCc = state['lastCc']
+    prev[firsts] = lastCc[rowPids[firsts]]
+    # a packet may be sent twice in a row
+    errors = (prev >= 0) & (cc != (prev + 1) & 0x0f) & (cc != prev) & ~discontinuity[rows]
+    lasts = np.concatenate((firsts[1:] - 1, [ len(rows) - 1 ])) if len(rows) else firsts
+    lastCc[rowPids[lasts]] = cc[lasts]
+    errorPositions = positions[rows[errors]]
+    state['events'].append((errorPositions, errorPositions + TS_PACKET_SIZE, np.full(len(errorPositions), DAMAGE_KINDS.index('cc'))))
+    state['ccCounts'] += np.bincount(rowPids[errors], minlength=NULL_PID + 1)
+
+    pcrRows = np.flatnonzero(hasAf & ~tei & (packets[:, 4] >= 7) & (packets[:, 5] & 0x10 != 0))
+    if state['pcrPid'] is None and len(pcrRows):
+        state['pcrPid'] = int(pids[pcrRows[0]])
+    pcrRows = pcrRows[pids[pcrRows] == state['pcrPid']]
+    b = [ packets[pcrRows, 6 + k].astype(np.int64) for k in range(5) ]
+    state['pcrPositions'].append(positions[pcrRows])
+    # the 90 kHz base is precise enough for the gaps
+    state['pcrs'].append(b[0] << 25 | b[1] << 17 | b[2] << 9 | b[3] << 1 | b[4] >> 7)
+    state['pcrDiscontinuities'].append(discontinuity[pcrRows])
+
+def _Regions(state, pcrPositions, pcrTimes) -> list[DamagedRegion]:
+    starts, ends, kinds = (np.concatenate([ event[k] for event in state['events'] ]) if state['events'] else np.zeros(0, dtype=np.int64) for k in range(3))
+    if len(starts) == 0:
+        return []
+    order = np.argsort(starts, kind='stable')
+    starts, ends, kinds = starts[order], ends[order], kinds[order]
+    reach = np.maximum.accumulate(ends)
+    breaks = np.flatnonzero(starts[1:] > reach[:-1] + MERGE_PACKETS * TS_PACKET_SIZE) + 1
+    regionIds = np.zeros(len(starts), dtype=np.int64)
+    regionIds[breaks] = 1
+    regionIds = np.cumsum(regionIds)
+    counts = np.bincount(regionIds * len(DAMAGE_KINDS) + kinds, minlength=(len(breaks) + 1) * len(DAMAGE_KINDS)).reshape(-1, len(DAMAGE_KINDS))
+    regionStarts = starts[np.concatenate(([ 0 ], breaks))]
+    regionEnds = reach[np.concatenate((breaks - 1, [ len(starts) - 1 ]))]
+    regions = []
+    for start, end, regionCounts in zip(regionStarts, regionEnds, counts):
+        ss = to = None
+        if len(pcrPositions):
+            ss, to = (round(float(np.interp(p, pcrPositions, pcrTimes)), 3) for p in (start, end))
+        regions.append(DamagedRegion(int(start), int(end), ss, to, dict(zip(DAMAGE_KINDS, regionCounts.tolist()))))
+    return regions
+
+@Instrumented('ScanIntegrity')
+def ScanIntegrity(path: Path, chunkPackets=1 << 18, progress: Progress | None = None) -> DamageMap:
+    path = Path(path)
+    if not path.is_file():
+        raise TsFileNotFound(f'"{path.name}" not found!')
+    fileSize = path.stat().st_size
+    state = {
+        'events': [],
+        'packetCounts': np.zeros(NULL_PID + 1, dtype=np.int64),
+        'teiCounts': np.zeros(NULL_PID + 1, dtype=np.int64),
+        'ccCounts': np.zeros(NULL_PID + 1, dtype=np.int64),
+        'lastCc': np.full(NULL_PID + 1, -1, dtype=np.int16),
+        'pcrPid': None,
+        'pcrPositions': [ np.zeros(0, dtype=np.int64) ],
+        'pcrs': [ np.zeros(0, dtype=np.int64) ],
+        'pcrDiscontinuities': [ np.zeros(0, dtype=bool) ],
+    }
+    tid = "scan_integrity"
+    if progress is not None:
+        progress.add_task(tid, fileSize, "Scanning packets", unit="B")
+    with MappedPackets(path) as (mm, offset, _):
+        pos = offset
+        while pos + TS_PACKET_SIZE <= fileSize:
+            count = min(chunkPackets, (fileSize - pos) // TS_PACKET_SIZE)
+            packets = np.frombuffer(mm, dtype=np.uint8, count=count * TS_PACKET_SIZE, offset=pos).reshape(count, TS_PACKET_SIZE)
+            lost = np.flatnonzero(packets[:, 0] != TS_SYNC_BYTE)
+            if len(lost):
+                count = int(lost[0])
+            _ScanChunk(packets[:count], pos, state)
+            del packets
+            pos += count * TS_PACKET_SIZE
+            if len(lost):
+                resync = _Resync(mm, pos)
+                state['events'].append((np.array([ pos ]), np.array([ resync ]), np.array([ DAMAGE_KINDS.index('sync') ])))
+                # the counters start over behind the gap
+                state['lastCc'][:] = -1
+                pos = resync
+            if progress is not None:
+                progress.update(tid, pos)
+    if progress is not None:
+        progress.done(tid)
+
+    pcrPositions = np.concatenate(state['pcrPositions'])
+    pcrs = UnwrapPts(np.concatenate(state['pcrs']))
+    gaps = np.diff(pcrs)
+    discontinuities = np.concatenate(state['pcrDiscontinuities'])[1:]
+    bad = np.flatnonzero(((gaps > PCR_MAX_GAP * 90000) | (gaps < 0)) & ~discontinuities)
+    state['events'].append((pcrPositions[bad], pcrPositions[bad + 1] + TS_PACKET_SIZE, np.full(len(bad), DAMAGE_KINDS.index('pcr'))))
+    # a jump back does not take any time
+    pcrTimes = np.concatenate(([ 0 ], np.cumsum(np.maximum(gaps, 0)))) / 90000
+
+    regions = _Regions(state, pcrPositions, pcrTimes)
+    packetCounts = state['packetCounts']
+    pids = { int(pid): { 'packets': int(packetCounts[pid]), 'tei': int(state['teiCounts'][pid]), 'cc': int(state['ccCounts'][pid]) } for pid in np.flatnonzero(packetCounts) }
+    damageMap = DamageMap(regions, int(packetCounts.sum()), fileSize, pids, state['pcrPid'])
+    Count(damagedRegions=len(regions), damagedBytes=sum(region.end - region.start for region in regions))
+    return damageMap
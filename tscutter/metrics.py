@@ -0,0 +1,88 @@
+"""Scene change metrics between consecutive downscaled frames.
+
+MetricEngine copies the frames it is given into one uint8 buffer of
+chunkFrames frames, and scores all consecutive pairs of a full buffer in one
+pass with integer math, so memory does not grow with the number of frames.
+Every metric is 0 for identical frames and 1 for the largest possible change:
+
+  sad       mean absolute difference of the RGB samples
+  luma_sad  mean absolute difference of the luma (BT.601)
+  hist      half the L1 distance between the 64 bin luma histograms
+"""
+
+import numpy as np
+
+DEFAULT_METRIC = 'sad'
+CHUNK_FRAMES = 64
+HIST_BINS = 64
+
+def _Luma(frames) -> np.ndarray:
+    frames = frames.astype(np.uint16)
+    return ((frames[..., 0] * 77 + frames[..., 1] * 150 + frames[..., 2] * 29) >> 8).astype(np.uint8)
+
+def _MeanAbsDiff(stack) -> np.ndarray:
+    diffs = np.abs(np.diff(stack.astype(np.int16), axis=0))
+    return diffs.reshape(len(diffs), -1).sum(axis=1, dtype=np.int64) / (255 * stack[0].size)
+
+def _Sad(stack, luma):
+    return _MeanAbsDiff(stack)
+
+def _LumaSad(stack, luma):
+    return _MeanAbsDiff(luma)
+
+def _HistDiff(stack, luma):
+    bins = luma.reshape(len(luma), -1) // (256 // HIST_BINS)
+    # one bincount for all frames, each in its own range of bins
+    counts = np.bincount((bins + np.arange(len(luma))[:, None] * HIST_BINS).ravel(), minlength=len(luma) * HIST_BINS).reshape(len(luma), HIST_BINS)
+    return np.abs(np.diff(counts, axis=0)).sum(axis=1) / (2 * luma[0].size)
+
+METRICS = {
+    'sad': _Sad,
+    'luma_sad': _LumaSad,
+    'hist': _HistDiff,
+}
+
+class MetricEngine:
+    def __init__(self, shape, metrics=(DEFAULT_METRIC,), chunkFrames=CHUNK_FRAMES) -> None:
+        unknown = set(metrics) - METRICS.keys()
+        if unknown:
+            raise ValueError(f'unknown metrics: {", ".join(sorted(unknown))}')
+        self.metrics = list(metrics)
+        # slot 0 keeps the last frame of the previous chunk
+        self.buffer = np.empty((chunkFrames + 1,) + tuple(shape), dtype=np.uint8)
+        self.count = 0
+        self.started = False
+        self.values = { name: [] for name in self.metrics }
+
+    def Add(self, frames):
+        """Add one frame (h, w, 3) or a stack of them (n, h, w, 3)."""
+        frames = np.asarray(frames, dtype=np.uint8)
+        if frames.ndim == 3:
+            frames = frames[None]
+        while len(frames):
+            n = min(len(frames), len(self.buffer) - self.count)
+            self.buffer[self.count:self.count + n] = frames[:n]
+            self.count += n
+            frames = frames[n:]
+            if self.count == len(self.buffer):
+                self._Score()
+
+    def _Score(self):
+        stack = self.buffer[:self.count]
+        if not self.started:
+            # the first frame has nothing to compare with
+            for name in self.metrics:
+                self.values[name].append(np.zeros(1))
+            self.started = True
+        if len(stack) > 1:
+            luma = _Luma(stack) if any(name != 'sad' for name in self.metrics) else None
+            for name in self.metrics:
+                self.values[name].append(METRICS[name](stack, luma))
+        self.buffer[0] = stack[-1]
+        self.count = 1
+
+    def Results(self) -> dict[str, np.ndarray]:
+        """Metric values of every frame added, by name."""
+        if self.count > (1 if self.started else 0):
+            self._Score()
+        return { name: np.concatenate(values) if values else np.zeros(0) for name, values in self.values.items() }
@@ -0,0 +1,306 @@
+import mmap
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+import numpy as np
+from .common import InvalidTsFormat
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+PTS_CLOCK = 90000
+PTS_WRAP = 1 << 33
+# consecutive sync bytes needed to lock on again after a sync loss
+RESYNC_PACKETS = 5
+
+# stream_type values of the PMT
+VIDEO_STREAM_TYPES = { 0x01: 'mpeg1video', 0x02: 'mpeg2video', 0x1b: 'h264', 0x24: 'hevc' }
+AUDIO_STREAM_TYPES = { 0x03: 'mp2', 0x04: 'mp2', 0x0f: 'aac', 0x11: 'aac_latm', 0x81: 'ac3' }
+
+def OpenPackets(path: Path):
+    """Memory-map a TS file and return (mmap, sync offset, packet count)."""
+    with Path(path).open('rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    offset = FindSyncOffset(mm)
+    return mm, offset, (len(mm) - offset) // TS_PACKET_SIZE
+
+@contextmanager
+def MappedPackets(path: Path):
+    """OpenPackets() as a context manager, which closes the map on exit."""
+    mm, offset, count = OpenPackets(path)
+    try:
+        yield mm, offset, count
+    finally:
+        try:
+            mm.close()
+        except BufferError:
+            # a view is still referenced while an exception propagates
+            pass
+
+def FindSyncOffset(buf, probePackets=8) -> int:
+    head = np.frombuffer(buf, dtype=np.uint8, count=min(len(buf), TS_PACKET_SIZE * (probePackets + 1)))
+    for offset in range(min(TS_PACKET_SIZE, len(head))):
+        syncBytes = head[offset::TS_PACKET_SIZE]
+        if len(syncBytes) and (syncBytes == TS_SYNC_BYTE).all():
+            return offset
+    raise InvalidTsFormat('no MPEG-TS sync byte found')
+
+def _Resync(buf, pos) -> int:
+    """Position of the first packet after pos followed by RESYNC_PACKETS - 1 more, or the end of buf."""
+    window = 1 << 20
+    start = pos + 1
+    while start + TS_PACKET_SIZE <= len(buf):
+        length = min(len(buf) - start, window + RESYNC_PACKETS * TS_PACKET_SIZE)
+        data = np.frombuffer(buf, dtype=np.uint8, count=length, offset=start)
+        candidates = np.flatnonzero(data[:min(window, length - TS_PACKET_SIZE + 1)] == TS_SYNC_BYTE)
+        ok = np.ones(len(candidates), dtype=bool)
+        for k in range(1, RESYNC_PACKETS):
+            at = candidates + k * TS_PACKET_SIZE
+            # the last packets of the file count as long as they are whole
+            inside = at + TS_PACKET_SIZE <= length
+            ok &= ~inside | (data[np.minimum(at, length - 1)] == TS_SYNC_BYTE)
+        del data
+        if ok.any():
+            return start + int(candidates[np.argmax(ok)])
+        start += window
+    return len(buf)
+
+def PacketView(buf, offset, start, count) -> np.ndarray:
+    """(count, 188) uint8 view on the packets [start, start + count) without copying."""
+    return np.frombuffer(buf, dtype=np.uint8, count=count * TS_PACKET_SIZE, offset=offset + start * TS_PACKET_SIZE).reshape(count, TS_PACKET_SIZE)
+
+def PacketPids(packets) -> np.ndarray:
+    return ((packets[:, 1] & 0x1f).astype(np.int32) << 8) | packets[:, 2]
+
+def PayloadOffsets(packets) -> np.ndarray:
+    """Offset of the payload in each packet, 188 if there is none."""
+    afc = packets[:, 3] >> 4 & 3
+    offsets = np.where(afc & 2 != 0, 5 + packets[:, 4].astype(np.int32), 4)
+    return np.where((afc & 1 != 0) & (offsets < TS_PACKET_SIZE), offsets, TS_PACKET_SIZE)
+
+def ReadSection(packets, pid, tableId=None) -> bytes | None:
+    """First complete PSI section carried on pid (PAT, PMT, ...)."""
+    pids = PacketPids(packets)
+    section = None
+    for i in np.flatnonzero(pids == pid):
+        packet = packets[i].tobytes()
+        start = PayloadOffsets(packets[i:i + 1])[0]
+        if start >= TS_PACKET_SIZE:
+            continue
+        payload = packet[start:]
+        if packet[1] & 0x40:
+            pointer = payload[0]
+            section = payload[1 + pointer:]
+        elif section is None:
+            continue
+        else:
+            section += payload
+        if len(section) >= 3:
+            if tableId is not None and section[0] != tableId:
+                section = None
+                continue
+            length = 3 + ((section[1] & 0x0f) << 8 | section[2])
+            if len(section) >= length:
+                return section[:length]
+    return None
+
+@dataclass
+class ProgramMap:
+    serviceId: int
+    pmtPid: int
+    pcrPid: int
+    streams: list[tuple[int, int]] = field(default_factory=list)    # (stream_type, pid)
+
+    def VideoPid(self) -> int | None:
+        return next((pid for streamType, pid in self.streams if streamType in VIDEO_STREAM_TYPES), None)
+
+    def VideoStreamType(self) -> int | None:
+        return next((streamType for streamType, pid in self.streams if streamType in VIDEO_STREAM_TYPES), None)
+
+    def AudioPids(self) -> list[int]:
+        return [ pid for streamType, pid in self.streams if streamType in AUDIO_STREAM_TYPES ]
+
+def ReadProgramMap(packets, serviceId=None) -> ProgramMap:
+    pat = ReadSection(packets, 0x0000, tableId=0x00)
+    if pat is None:
+        raise InvalidTsFormat('no PAT found')
+    programs = []
+    for i in range(8, len(pat) - 4, 4):
+        programNumber = pat[i] << 8 | pat[i + 1]
+        pid = (pat[i + 2] & 0x1f) << 8 | pat[i + 3]
+        if programNumber != 0:
+            programs.append((programNumber, pid))
+    for programNumber, pmtPid in programs:
+        if serviceId is not None and programNumber != serviceId:
+            continue
+        pmt = ReadSection(packets, pmtPid, tableId=0x02)
+        if pmt is None:
+            continue
+        programMap = ProgramMap(serviceId=programNumber, pmtPid=pmtPid, pcrPid=(pmt[8] & 0x1f) << 8 | pmt[9])
+        i = 12 + ((pmt[10] & 0x0f) << 8 | pmt[11])
+        while i + 5 <= len(pmt) - 4:
+            pid = (pmt[i + 1] & 0x1f) << 8 | pmt[i + 2]
+            programMap.streams.append((pmt[i], pid))
+            i += 5 + ((pmt[i + 3] & 0x0f) << 8 | pmt[i + 4])
+        # the program with streams is the one on air
+        if programMap.streams:
+            return programMap
+    raise InvalidTsFormat('no PMT found')
+
+def _ReadPts(rows, offsets):
+    b = [ rows[np.arange(len(rows)), offsets + k].astype(np.int64) for k in range(5) ]
+    return ((b[0] >> 1) & 7) << 30 | b[1] << 22 | (b[2] >> 1) << 15 | b[3] << 7 | b[4] >> 1
+
+def UnwrapPts(pts) -> np.ndarray:
+    pts = np.asarray(pts, dtype=np.int64)
+    if len(pts) < 2:
+        return pts
+    jumps = np.diff(pts)
+    wraps = np.cumsum(np.where(jumps < -PTS_WRAP // 2, PTS_WRAP, 0) - np.where(jumps > PTS_WRAP // 2, PTS_WRAP, 0))
+    return pts + np.concatenate(([0], wraps))
+
+def _FindPesStarts(packets, pid):
+    """Rows, payload offsets and PTS of the PES headers with a PTS on pid."""
+    pusi = (packets[:, 0] == TS_SYNC_BYTE) & (packets[:, 1] & 0x40 != 0)
+    candidates = np.flatnonzero(pusi & (PacketPids(packets) == pid))
+    rows = packets[candidates]
+    starts = PayloadOffsets(rows)
+    ok = starts + 14 <= TS_PACKET_SIZE
+    clipped = np.minimum(starts, TS_PACKET_SIZE - 14)
+    at = lambda k: rows[np.arange(len(rows)), clipped + k]
+    ok &= (at(0) == 0) & (at(1) == 0) & (at(2) == 1) & (at(7) & 0x80 != 0)
+    candidates, rows, starts = candidates[ok], rows[ok], starts[ok]
+    return candidates, rows, starts, _ReadPts(rows, starts + 9)
+
+def _RandomAccess(rows, starts, streamType) -> np.ndarray:
+    hasAf = (rows[:, 3] & 0x20 != 0) & (rows[:, 4] > 0)
+    rap = hasAf & (rows[:, 5] & 0x40 != 0)
+    esStarts = starts + 9 + rows[np.arange(len(rows)), starts + 8]
+    if streamType in (0x01, 0x02):
+        # I pictures are preceded by a sequence or GOP header
+        ok = esStarts + 4 <= TS_PACKET_SIZE
+        clipped = np.minimum(esStarts, TS_PACKET_SIZE - 4)
+        at = lambda k: rows[np.arange(len(rows)), clipped + k]
+        rap |= ok & (at(0) == 0) & (at(1) == 0) & (at(2) == 1) & ((at(3) == 0xb3) | (at(3) == 0xb8))
+    elif streamType in (0x1b, 0x24):
+        for i in np.flatnonzero(~rap):
+            es = rows[i, esStarts[i]:].tobytes()
+            at = es.find(b'\x00\x00\x01')
+            while 0 <= at < len(es) - 3:
+                nal = es[at + 3]
+                nalType = nal & 0x1f if streamType == 0x1b else nal >> 1 & 0x3f
+                if (streamType == 0x1b and nalType in (5, 7)) or (streamType == 0x24 and (16 <= nalType <= 23 or nalType == 32)):
+                    rap[i] = True
+                    break
+                at = es.find(b'\x00\x00\x01', at + 3)
+    return rap
+
+PesIndexDType = np.dtype([('pts', 'i8'), ('pos', 'i8'), ('rap', '?')])
+# bumped when BuildPesIndex changes, so that older sidecars are rebuilt
+PES_INDEX_VERSION = 2
+
+class PesIndex:
+    """Video PES headers of a TS file sorted by PTS: exact byte position of any frame."""
+    def __init__(self, entries: np.ndarray, pid: int, startPts: int, fileSize: int = 0, fileMtime: int = 0) -> None:
+        self.entries = entries
+        self.pid = pid
+        self.startPts = startPts
+        self.fileSize = fileSize
+        self.fileMtime = fileMtime
+
+    def __len__(self):
+        return len(self.entries)
+
+    def ToPts(self, ptsTime) -> int:
+        return self.startPts + round(ptsTime * PTS_CLOCK)
+
+    def PosAt(self, pts, tolerance=0) -> int:
+        """Byte position of the PES carrying pts, -1 if there is none within tolerance."""
+        ptsList = self.entries['pts']
+        i = np.searchsorted(ptsList, pts)
+        best = None
+        for j in (i - 1, i):
+            if 0 <= j < len(ptsList) and abs(ptsList[j] - pts) <= tolerance:
+                if best is None or abs(ptsList[j] - pts) < abs(ptsList[best] - pts):
+                    best = j
+        return -1 if best is None else int(self.entries['pos'][best])
+
+    def PosAtTime(self, ptsTime, tolerance=0) -> int:
+        return self.PosAt(self.ToPts(ptsTime), tolerance=tolerance)
+
+    def RandomAccessBefore(self, pts):
+        """Last random access point with PTS <= pts as (pts, pos), or None."""
+        raps = self.entries[self.entries['rap']]
+        i = np.searchsorted(raps['pts'], pts, side='right')
+        return None if i == 0 else (int(raps['pts'][i - 1]), int(raps['pos'][i - 1]))
+
+    def IsUpToDate(self, tsPath: Path) -> bool:
+        stat = Path(tsPath).stat()
+        return stat.st_size == self.fileSize and stat.st_mtime_ns == self.fileMtime
+
+    def Save(self, path: Path):
+        with Path(path).open('wb') as f:
+            np.savez(f, entries=self.entries, pid=self.pid, startPts=self.startPts, fileSize=self.fileSize, fileMtime=self.fileMtime, version=PES_INDEX_VERSION)
+
+    @classmethod
+    def Load(cls, path: Path) -> 'PesIndex':
+        with np.load(path) as data:
+            if 'version' not in data or int(data['version']) != PES_INDEX_VERSION:
+                raise ValueError(f'"{Path(path).name}" is no version {PES_INDEX_VERSION} PES index')
+            return cls(data['entries'], int(data['pid']), int(data['startPts']), int(data['fileSize']), int(data['fileMtime']))
+
+def BuildPesIndex(path: Path, pid=None, chunkPackets=1 << 18) -> PesIndex:
+    with MappedPackets(path) as (mm, offset, count):
+        programMap = ReadProgramMap(PacketView(mm, offset, 0, min(count, 1 << 15)))
+        if pid is None:
+            pid = programMap.VideoPid()
+            if pid is None:
+                raise InvalidTsFormat(f'"{Path(path).name}" has no video stream!')
+        streamType = dict((p, t) for t, p in programMap.streams).get(pid)
+        otherPids = set(programMap.AudioPids()) - { pid }
+        chunks = []
+        firstPts = {}
+        pos = offset
+        while pos + TS_PACKET_SIZE <= len(mm):
+            chunkCount = min(chunkPackets, (len(mm) - pos) // TS_PACKET_SIZE)
+            packets = PacketView(mm, pos, 0, chunkCount)
+            # a partial packet shifts all the packets behind it
+            lost = np.flatnonzero(packets[:, 0] != TS_SYNC_BYTE)
+            if len(lost):
+                packets = packets[:lost[0]]
+            candidates, rows, starts, pts = _FindPesStarts(packets, pid)
+            chunk = np.empty(len(candidates), dtype=PesIndexDType)
+            chunk['pts'] = pts
+            chunk['pos'] = pos + candidates * TS_PACKET_SIZE
+            chunk['rap'] = _RandomAccess(rows, starts, streamType)
+            chunks.append(chunk)
+            # ffmpeg's timeline starts at the earliest PTS of the program
+            for esPid in otherPids - firstPts.keys():
+                _, _, _, esPts = _FindPesStarts(packets, esPid)
+                if len(esPts):
+                    firstPts[esPid] = int(esPts[0])
+            pos += len(packets) * TS_PACKET_SIZE
+            del packets, rows
+            if len(lost):
+                pos = _Resync(mm, pos)
+    entries = np.concatenate(chunks) if chunks else np.zeros(0, dtype=PesIndexDType)
+    entries['pts'] = UnwrapPts(entries['pts'])
+    entries = entries[np.argsort(entries['pts'], kind='stable')]
+    videoStart = int(entries['pts'][0]) if len(entries) else 0
+    # relate other streams' first PTS to the video one across a wrap
+    startPts = min([ videoStart ] + [ videoStart + ((p - videoStart + PTS_WRAP // 2) % PTS_WRAP - PTS_WRAP // 2) for p in firstPts.values() ])
+    stat = Path(path).stat()
+    return PesIndex(entries, pid, startPts, stat.st_size, stat.st_mtime_ns)
+
+def LoadPesIndex(tsPath: Path, sidecarPath: Path) -> PesIndex:
+    """Load the sidecar index of tsPath, rebuilding it when missing or stale."""
+    if sidecarPath.is_file():
+        try:
+            index = PesIndex.Load(sidecarPath)
+            if index.IsUpToDate(tsPath):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+    index = BuildPesIndex(tsPath)
+    sidecarPath.parent.mkdir(parents=True, exist_ok=True)
+    index.Save(sidecarPath)
+    return index
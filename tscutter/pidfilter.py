@@ -0,0 +1,163 @@
+"""Drop the elementary streams a clip does not need while it is copied.
+
+Broadcast TS files carry EPG, data carousel and other SI/data PIDs besides
+the program's audio and video. PidFilter keeps the streams of one program,
+or a chosen subset of them, with their PMT and PCR. The PAT is rewritten to
+list that program only, and so is the PMT when streams of it are left out.
+When the PCR is carried by a stream that is left out, only its PCRs are
+kept, in packets stripped down to their adaptation field.
+The chunks given by StreamRanges() are filtered as (n, 188) packet views
+with one lookup in a PID mask, so it runs at close to plain copy speed.
+Packets are assumed to start at the offsets given, like everywhere else the
+.ptsmap positions are used; a partial packet at the end is dropped.
+"""
+
+import logging
+from pathlib import Path
+import numpy as np
+from .mpegts import MappedPackets, PacketPids, PacketView, ProgramMap, ReadProgramMap, ReadSection, TS_PACKET_SIZE, TS_SYNC_BYTE
+
+logger = logging.getLogger('tscutter.pidfilter')
+
+# packets searched for the PAT and the PMT at the start of the file
+PMT_SEARCH_PACKETS = 1 << 15
+PID_COUNT = 0x2000
+
+def _Crc32(data) -> int:
+    """CRC-32/MPEG-2 of a PSI section."""
+    crc = 0xffffffff
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x04c11db7 if crc & 0x80000000 else crc << 1
+        crc &= 0xffffffff
+    return crc
+
+def _Section(head, body) -> bytes:
+    # section_length counts from after its field up to and including the CRC
+    length = len(head) - 3 + len(body) + 4
+    section = bytes([ head[0], head[1] & 0xf0 | length >> 8, length & 0xff ]) + bytes(head[3:]) + bytes(body)
+    return section + _Crc32(section).to_bytes(4, 'big')
+
+def _SectionPacket(pid, section) -> np.ndarray | None:
+    """Single packet carrying section, or None if it does not fit."""
+    if len(section) > TS_PACKET_SIZE - 5:
+        return None
+    packet = bytes([ TS_SYNC_BYTE, 0x40 | pid >> 8, pid & 0xff, 0x10, 0 ]) + section
+    return np.frombuffer(packet.ljust(TS_PACKET_SIZE, b'\xff'), dtype=np.uint8)
+
+def _AdaptationOnly(packets) -> np.ndarray:
+    """The packets with their payload dropped and their adaptation field stuffed up to the end."""
+    packets = packets.copy()
+    ends = 5 + packets[:, 4].astype(np.int32)
+    packets[np.arange(TS_PACKET_SIZE)[None, :] >= ends[:, None]] = 0xff
+    packets[:, 4] = TS_PACKET_SIZE - 5
+    packets[:, 1] &= 0xbf
+    # adaptation_field_control 10, the continuity counter stays put without a payload
+    packets[:, 3] = packets[:, 3] & 0xc0 | 0x20
+    return packets
+
+class PidFilter:
+    def __init__(self, programMap: ProgramMap, pat: bytes, pmt: bytes, pids=None) -> None:
+        streamPids = [ pid for _, pid in programMap.streams ]
+        if pids is not None:
+            unknown = set(pids) - set(streamPids)
+            if unknown:
+                raise ValueError(f'PIDs {", ".join(f"{pid:#x}" for pid in sorted(unknown))} are not streams of service {programMap.serviceId}')
+        self.programMap = programMap
+        self.pids = streamPids if pids is None else [ pid for pid in streamPids if pid in pids ]
+        self.mask = np.zeros(PID_COUNT, dtype=bool)
+        self.mask[self.pids] = True
+        self.mask[programMap.pmtPid] = True
+        if programMap.pcrPid != PID_COUNT - 1:
+            self.mask[programMap.pcrPid] = True
+        # the PCR PID of a stream that is left out
+        self.pcrOnlyPid = programMap.pcrPid if programMap.pcrPid != PID_COUNT - 1 and programMap.pcrPid in streamPids and programMap.pcrPid not in self.pids else None
+        # PSI rewritten into a single packet, by PID
+        self.tables = {}
+        self.tables[0x0000] = _SectionPacket(0x0000, _Section(pat[:8], bytes([ programMap.serviceId >> 8, programMap.serviceId & 0xff, 0xe0 | programMap.pmtPid >> 8, programMap.pmtPid & 0xff ])))
+        if len(self.pids) < len(streamPids):
+            infoEnd = 12 + ((pmt[10] & 0x0f) << 8 | pmt[11])
+            loop, i = b'', infoEnd
+            while i + 5 <= len(pmt) - 4:
+                entryEnd = i + 5 + ((pmt[i + 3] & 0x0f) << 8 | pmt[i + 4])
+                if ((pmt[i + 1] & 0x1f) << 8 | pmt[i + 2]) in self.pids:
+                    loop += pmt[i:entryEnd]
+                i = entryEnd
+            packet = _SectionPacket(programMap.pmtPid, _Section(pmt[:infoEnd], loop))
+            if packet is None:
+                logger.warning(f'The PMT of service {programMap.serviceId} does not fit in a packet once rewritten, it is kept as it is')
+            else:
+                self.tables[programMap.pmtPid] = packet
+        for pid in self.tables:
+            self.mask[pid] = False
+
+    @classmethod
+    def FromFile(cls, path: Path, serviceId=None, pids=None) -> 'PidFilter':
+        """Filter for the program serviceId of path (the one on air by default), keeping pids of it or all its streams."""
+        with MappedPackets(path) as (mm, offset, count):
+            packets = PacketView(mm, offset, 0, min(count, PMT_SEARCH_PACKETS))
+            programMap = ReadProgramMap(packets, serviceId)
+            pat = ReadSection(packets, 0x0000, tableId=0x00)
+            pmt = ReadSection(packets, programMap.pmtPid, tableId=0x02)
+            del packets
+        return cls(programMap, pat, pmt, pids)
+
+    def Writer(self, write) -> '_FilterWriter':
+        """Callable passing the packets of the data given to it through the filter to write()."""
+        return _FilterWriter(self, write)
+
+class _FilterWriter:
+    def __init__(self, pidFilter: PidFilter, write) -> None:
+        self.filter = pidFilter
+        self.write = write
+        self.rest = b''
+        self.written = 0
+        # continuity counters of the rewritten tables
+        self.counters = dict.fromkeys(pidFilter.tables, 0)
+
+    def __call__(self, data):
+        data = memoryview(data).cast('B')
+        if self.rest:
+            # the packet cut in two by the previous chunk
+            need = TS_PACKET_SIZE - len(self.rest)
+            self.rest += bytes(data[:need])
+            data = data[need:]
+            if len(self.rest) < TS_PACKET_SIZE:
+                return
+            self._Filter(self.rest)
+            self.rest = b''
+        whole = len(data) // TS_PACKET_SIZE * TS_PACKET_SIZE
+        if whole:
+            self._Filter(data[:whole])
+        self.rest = bytes(data[whole:])
+
+    def _Filter(self, data):
+        packets = np.frombuffer(data, dtype=np.uint8).reshape(-1, TS_PACKET_SIZE)
+        pids = PacketPids(packets)
+        keep = self.filter.mask[pids]
+        pcrOnlyRows = None
+        if self.filter.pcrOnlyPid is not None:
+            pcrOnlyRows = pids == self.filter.pcrOnlyPid
+            hasPcr = (packets[:, 3] & 0x20 != 0) & (packets[:, 4] >= 7) & (packets[:, 5] & 0x10 != 0)
+            keep &= ~pcrOnlyRows | hasPcr
+        tableRows = {}
+        for pid in self.filter.tables:
+            # a table starts in a packet with payload_unit_start_indicator set, the packets continuing it are dropped
+            rows = (pids == pid) & (packets[:, 1] & 0x40 != 0)
+            keep |= rows
+            tableRows[pid] = rows
+        kept = packets[keep]
+        if pcrOnlyRows is not None:
+            rows = np.flatnonzero(pcrOnlyRows[keep])
+            if len(rows):
+                kept[rows] = _AdaptationOnly(kept[rows])
+        for pid, rows in tableRows.items():
+            rows = np.flatnonzero(rows[keep])
+            if len(rows):
+                kept[rows] = self.filter.tables[pid]
+                kept[rows, 3] = 0x10 | (self.counters[pid] + np.arange(len(rows))) & 0x0f
+                self.counters[pid] += len(rows)
+        if len(kept):
+            self.write(kept)
+            self.written += kept.nbytes
@@ -0,0 +1,248 @@
+"""Long-lived worker answering tscutter commands as JSON-lines requests.
+
+    {"id": 1, "command": "probe", "args": {"input": "a.ts"}}
+    {"id": 1, "progress": {"task": "extract_props", "n": 12.5}}
+    {"id": 1, "result": {"duration": 1800.68, ...}}
+    {"id": 2, "error": {"type": "InvalidTsFormat", "message": "..."}}
+
+Requests come from stdin, answered on stdout, or from the connections of a
+Unix socket. They run in thread pools, so answers may come out of order and
+are matched by id. `analyze` requests share a bounded pool of their own, so
+they never hold up the short commands. InputFile and PtsMap objects stay in
+LRU caches keyed by path, size and mtime, so a file is probed only once for
+as long as it does not change.
+"""
+
+import inspect, json, logging, os, socketserver, sys, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from ._progress import Progress
+from .analyze import AnalyzeVideo, ProbeResult
+from .cache import Cache
+from .common import InvalidIndexFormat, PtsMap, TsFileNotFound, InvalidTsFormat
+from .ffmpeg import InputFile
+
+logger = logging.getLogger('tscutter.serve')
+
+# threads answering everything but analyze
+QUICK_WORKERS = 4
+
+class RequestError(Exception):
+    def __init__(self, type: str, message: str) -> None:
+        super().__init__(message)
+        self.type = type
+
+class LruCache:
+    def __init__(self, maxSize: int) -> None:
+        self.maxSize = maxSize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def Get(self, key, factory):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return self.items[key]
+        # build outside the lock, a concurrent miss at worst builds it twice
+        value = factory()
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxSize:
+                self.items.popitem(last=False)
+        return value
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+class _RequestProgress(Progress):
+    def __init__(self, send, requestId) -> None:
+        super().__init__(use_protocol=True)
+        self.send, self.requestId = send, requestId
+
+    def _emit(self, data: dict):
+        self.send({ 'id': self.requestId, 'progress': data })
+
+def _FileKey(path: Path):
+    path = Path(path).resolve()
+    stat = path.stat()
+    return str(path), stat.st_size, stat.st_mtime_ns
+
+class Worker:
+    def __init__(self, workers=2, cacheSize=64, useCache=True) -> None:
+        self.diskCache = Cache() if useCache else None
+        self.inputFiles = LruCache(cacheSize)
+        self.ptsMaps = LruCache(cacheSize)
+        self.analyzeExecutor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tscutter-analyze')
+        self.quickExecutor = ThreadPoolExecutor(max_workers=QUICK_WORKERS, thread_name_prefix='tscutter-quick')
+        self.commands = {
+            'ping': self._Ping,
+            'probe': self._Probe,
+            'list-clips': self._ListClips,
+            'select-clips': self._SelectClips,
+            'analyze': self._Analyze,
+            'stats': self._Stats,
+        }
+
+    def _InputFile(self, path) -> InputFile:
+        try:
+            key = _FileKey(path)
+        except OSError:
+            raise TsFileNotFound(f'"{Path(path).name}" not found!')
+        return self.inputFiles.Get(key, lambda: InputFile(key[0], cache=self.diskCache))
+
+    def _PtsMap(self, path) -> PtsMap:
+        try:
+            key = _FileKey(path)
+        except OSError:
+            raise RequestError('FileNotFoundError', str(path))
+        try:
+            return self.ptsMaps.Get(key, lambda: PtsMap(Path(key[0])))
+        except InvalidIndexFormat:
+            raise RequestError('InvalidIndexFormat', str(path))
+
+    def _Ping(self, progress):
+        return 'pong'
+
+    def _Probe(self, progress, input):
+        return ProbeResult(self._InputFile(input).GetInfo())
+
+    def _ListClips(self, progress, index):
+        return self._PtsMap(index).Clips()
+
+    def _SelectClips(self, progress, index, min_length=150):
+        selectedClips, _ = self._PtsMap(index).SelectClips(lengthLimit=min_length)
+        return selectedClips
+
+    def _Analyze(self, progress, input, output=None, length=800, threshold=-80, shift=1, jobs=1, single_pass=False, pes_index=False, binary=False, search='exhaustive', metric='sad', scan=False, pipeline=False):
+        indexPath = AnalyzeVideo(
+            inputFile=self._InputFile(input),
+            indexPath=Path(output) if output else None,
+            minSilenceLen=length,
+            silenceThresh=threshold,
+            splitPosShift=shift,
+            jobs=jobs,
+            singlePass=single_pass,
+            usePesIndex=pes_index,
+            binaryIndex=binary,
+            searchMode=search,
+            metric=metric,
+            scan=scan,
+            pipeline=pipeline,
+            progress=progress,
+        )
+        return { 'index': str(indexPath) }
+
+    def _Stats(self, progress):
+        return { 'inputFiles': len(self.inputFiles), 'ptsMaps': len(self.ptsMaps) }
+
+    def _Run(self, requestId, command: str, args: dict, send):
+        handler = self.commands[command]
+        args = { key.replace('-', '_'): value for key, value in args.items() }
+        try:
+            try:
+                inspect.signature(handler).bind(None, **args)
+            except TypeError as e:
+                raise RequestError('InvalidRequest', str(e))
+            result = handler(_RequestProgress(send, requestId), **args)
+            send({ 'id': requestId, 'result': result })
+        except RequestError as e:
+            send({ 'id': requestId, 'error': { 'type': e.type, 'message': str(e) } })
+        except (TsFileNotFound, InvalidTsFormat) as e:
+            send({ 'id': requestId, 'error': { 'type': type(e).__name__, 'message': str(e) } })
+        except Exception as e:
+            logger.exception(f'Request {requestId} ({command}) failed')
+            send({ 'id': requestId, 'error': { 'type': type(e).__name__, 'message': str(e) } })
+
+    def Submit(self, line: str, send):
+        """Start the request on line, returns its future, or None when it was answered right away."""
+        try:
+            request = json.loads(line)
+            requestId = request.get('id')
+            command, args = request['command'], request.get('args', {})
+            if not isinstance(command, str):
+                raise RequestError('InvalidRequest', 'command must be a string')
+            if command not in self.commands:
+                raise RequestError('UnknownCommand', f'unknown command "{command}"')
+            if not isinstance(args, dict):
+                raise RequestError('InvalidRequest', 'args must be an object')
+        except RequestError as e:
+            send({ 'id': requestId, 'error': { 'type': e.type, 'message': str(e) } })
+            return None
+        except (json.JSONDecodeError, AttributeError, KeyError) as e:
+            send({ 'id': None, 'error': { 'type': 'InvalidRequest', 'message': str(e) } })
+            return None
+        executor = self.analyzeExecutor if command == 'analyze' else self.quickExecutor
+        return executor.submit(self._Run, requestId, command, args, send)
+
+    def Close(self):
+        self.quickExecutor.shutdown()
+        self.analyzeExecutor.shutdown()
+
+def _Sender(stream, binary=False):
+    lock = threading.Lock()
+    def Send(message: dict):
+        data = json.dumps(message) + '\n'
+        with lock:
+            try:
+                stream.write(data.encode() if binary else data)
+                stream.flush()
+            except (BrokenPipeError, ValueError, OSError):
+                # the client went away, its remaining answers are dropped
+                pass
+    return Send
+
+def _IsShutdown(line: str) -> bool:
+    try:
+        return json.loads(line).get('command') == 'shutdown'
+    except (json.JSONDecodeError, AttributeError):
+        return False
+
+def ServeStdio(worker: Worker, stdin=None, stdout=None):
+    """Answer requests read from stdin until EOF or a shutdown request."""
+    stdin = sys.stdin if stdin is None else stdin
+    send = _Sender(sys.stdout if stdout is None else stdout)
+    for line in stdin:
+        if not line.strip():
+            continue
+        if _IsShutdown(line):
+            break
+        worker.Submit(line, send)
+    worker.Close()
+
+def ServeSocket(worker: Worker, socketPath: Path):
+    """Answer requests from every connection of a Unix socket until a shutdown request."""
+    socketPath = Path(socketPath)
+    if socketPath.exists():
+        # left behind by a worker that was killed
+        socketPath.unlink()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            send = _Sender(self.wfile, binary=True)
+            futures = []
+            for line in self.rfile:
+                line = line.decode(errors='replace')
+                if not line.strip():
+                    continue
+                if _IsShutdown(line):
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    break
+                futures.append(worker.Submit(line, send))
+            # answer everything this client asked for before closing
+            for future in futures:
+                if future is not None:
+                    future.result()
+
+    class Server(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+    with Server(str(socketPath), Handler) as server:
+        os.chmod(socketPath, 0o600)
+        logger.info(f'Listening on {socketPath}')
+        try:
+            server.serve_forever()
+        finally:
+            worker.Close()
+            socketPath.unlink(missing_ok=True)
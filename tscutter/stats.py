@@ -0,0 +1,178 @@
+"""Per-stage instrumentation of an analysis.
+
+Functions decorated with Instrumented() are timed while a Stats collector is
+installed, and do nothing extra otherwise. Counters reported with Count() and
+the rusage of every ffmpeg child belong to the innermost stage running in the
+calling thread, wall time is inclusive of nested stages.
+"""
+
+import functools, json, os, sys, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# the Stats currently recording, see Install()
+_collector = None
+
+def _MaxRss(usage) -> float:
+    # kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+def _ProcessReadBytes(pid: int) -> int | None:
+    try:
+        with open(f'/proc/{pid}/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+class Stats:
+    def __init__(self, progress=None) -> None:
+        self.progress = progress
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.startTime = time.perf_counter()
+
+    def _Stack(self) -> list:
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def _Record(self, name: str) -> dict:
+        if name not in self.stages:
+            self.stages[name] = {
+                'calls': 0, 'seconds': 0.0,
+                'childUserSeconds': 0.0, 'childSystemSeconds': 0.0, 'childMaxRssMiB': 0.0, 'children': 0,
+                'inputBytes': 0, 'pipeBytes': 0, 'frames': 0, 'tempBytes': 0,
+                'maxRssMiB': 0.0,
+            }
+        return self.stages[name]
+
+    @contextmanager
+    def Stage(self, name: str):
+        stack = self._Stack()
+        stack.append(name)
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - startTime
+            stack.pop()
+            with self.lock:
+                record = self._Record(name)
+                record['calls'] += 1
+                record['seconds'] += seconds
+                if resource is not None:
+                    record['maxRssMiB'] = max(record['maxRssMiB'], _MaxRss(resource.getrusage(resource.RUSAGE_SELF)))
+                event = { 'stage': name, 'seconds': round(seconds, 6), 'total': { k: round(v, 6) if isinstance(v, float) else v for k, v in record.items() } }
+            if self.progress is not None:
+                self.progress.event('stage', **event)
+
+    def Count(self, **counters):
+        stack = self._Stack()
+        with self.lock:
+            record = self._Record(stack[-1] if stack else 'other')
+            for key, value in counters.items():
+                record[key] += value
+
+    def ChildExited(self, usage, inputBytes=None):
+        stack = self._Stack()
+        with self.lock:
+            record = self._Record(stack[-1] if stack else 'other')
+            record['children'] += 1
+            record['childUserSeconds'] += usage.ru_utime
+            record['childSystemSeconds'] += usage.ru_stime
+            record['childMaxRssMiB'] = max(record['childMaxRssMiB'], _MaxRss(usage))
+            if inputBytes is not None:
+                record['inputBytes'] += inputBytes
+
+    def Report(self) -> dict:
+        with self.lock:
+            return {
+                'seconds': round(time.perf_counter() - self.startTime, 6),
+                'maxRssMiB': round(_MaxRss(resource.getrusage(resource.RUSAGE_SELF)), 1) if resource is not None else None,
+                'stages': { name: { k: round(v, 6) if isinstance(v, float) else v for k, v in record.items() } for name, record in self.stages.items() },
+            }
+
+    def Save(self, path: Path):
+        with Path(path).open('w') as f:
+            json.dump(self.Report(), f, indent=2)
+
+def Install(stats: Stats | None):
+    global _collector
+    _collector = stats
+
+def Instrumented(name: str):
+    """Decorator that records every call of the function as the stage name."""
+    def Decorator(func):
+        @functools.wraps(func)
+        def Wrapper(*args, **kwargs):
+            collector = _collector
+            if collector is None:
+                return func(*args, **kwargs)
+            with collector.Stage(name):
+                return func(*args, **kwargs)
+        return Wrapper
+    return Decorator
+
+def Count(**counters):
+    collector = _collector
+    if collector is not None:
+        collector.Count(**counters)
+
+def ReapChild(pipeObj):
+    """Wait for a finished Popen like its __exit__ would, recording its rusage."""
+    collector = _collector
+    if collector is None or not hasattr(os, 'wait4') or pipeObj.returncode is not None:
+        return
+    for stream in (pipeObj.stdout, pipeObj.stderr):
+        if stream is not None:
+            stream.close()
+    if pipeObj.stdin is not None:
+        try:
+            pipeObj.stdin.close()
+        except BrokenPipeError:
+            pass
+    inputBytes = None
+    if hasattr(os, 'waitid'):
+        # let it exit but keep it around, so that its I/O counters can still be read
+        os.waitid(os.P_PID, pipeObj.pid, os.WEXITED | os.WNOWAIT)
+        inputBytes = _ProcessReadBytes(pipeObj.pid)
+    _, status, usage = os.wait4(pipeObj.pid, 0)
+    pipeObj.returncode = os.waitstatus_to_exitcode(status)
+    collector.ChildExited(usage, inputBytes)
+
+@contextmanager
+def Profiled(path: Path | None, profiler='cprofile'):
+    """Profile the calling thread into path: a pstats file for cprofile, HTML for pyinstrument."""
+    if path is None:
+        yield
+        return
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise RuntimeError('pyinstrument not installed — pip install pyinstrument or use the cprofile profiler')
+        sampler = Profiler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            Path(path).write_text(sampler.output_html())
+    else:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(str(path))